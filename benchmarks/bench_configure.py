@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+'''Measure the import time of extendedlogging and the cost of (re)configuration.
+
+Import time is measured in a fresh interpreter (best of a few runs), relative to a bare interpreter.
+Configuration is timed in-process: first configure, repeated identical configure (incremental, nothing to do),
+a level change (incremental, handler kept) and a full rebuild (handlers removed first, as before incremental apply).
+'''
+
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+
+import benchutil
+sys.path.insert(0, benchutil.BASEDIR)
+
+
+DEFAULT_N = 200
+
+
+def import_time(module, repeat):
+    '''Best wall-clock time of importing given module in a fresh interpreter.'''
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.pathsep.join([benchutil.BASEDIR, environ.get('PYTHONPATH', '')])
+    cmd = [sys.executable, '-c', 'import {}'.format(module) if module else 'pass']
+    best = None
+    for it in range(repeat):
+        t_start = time.perf_counter()
+        subprocess.run(cmd, env=environ, check=True)
+        elapsed = time.perf_counter() - t_start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def time_configure(n, setup=None, **kwargs):
+    '''Average time of n configure calls, in microseconds.'''
+    import extendedlogging
+    total = 0.0
+    for it in range(n):
+        options = kwargs
+        if callable(setup):
+            options = setup(it)
+        t_start = time.perf_counter()
+        extendedlogging.configure(**options)
+        total += time.perf_counter() - t_start
+    return 1e6 * total / n
+
+
+def run(n=DEFAULT_N, repeat=benchutil.DEFAULT_REPEAT):
+    baseline = import_time(None, repeat)
+    rows = [['interpreter', '{:.1f}'.format(1e3 * baseline)]]
+    for module in ['extendedlogging', 'ttvlib.ttviewer']:
+        rows.append(['import ' + module, '{:.1f}'.format(1e3 * (import_time(module, repeat) - baseline))])
+    benchutil.report(['import', 'time(ms)'], rows)
+    sys.stdout.write('\n')
+    import extendedlogging
+    filename = os.path.join(tempfile.mkdtemp(), 'bench_configure.log')
+    options = {'tracing': True, 'filename': filename, 'console_enabled': False}
+    levels = [extendedlogging.TRACE, extendedlogging.DEBUG]
+    def first(it):
+        extendedlogging.remove_all_handlers()
+        return options
+    rows = []
+    rows.append(['first', '{:.1f}'.format(time_configure(n, first))])
+    rows.append(['identical', '{:.1f}'.format(time_configure(n, **options))])
+    rows.append(['level change', '{:.1f}'.format(time_configure(n, lambda it: dict(options, file_level=levels[it % 2])))])
+    rows.append(['full rebuild', '{:.1f}'.format(time_configure(n, lambda it: dict(first(it), file_level=levels[it % 2])))])
+    extendedlogging.remove_all_handlers()
+    benchutil.report(['configure', 'time(us)'], rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=DEFAULT_N, help='number of configure calls per scenario')
+    parser.add_argument('-r', '--repeat', type=int, default=benchutil.DEFAULT_REPEAT, help='number of import runs, best is taken')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    run(**vars(parse_args()))
+
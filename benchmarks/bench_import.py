@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''Import-time regression benchmark, based on python -X importtime.
+
+Each module is imported in a fresh interpreter; the cumulative import time (best of a few runs) is reported,
+together with the heaviest direct dependencies. Modules which are intentionally deferred must not show up.
+With option --budget, exit code is nonzero if a module exceeds the given time, so it can be used as a regression check.
+'''
+
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import argparse
+import subprocess
+
+import benchutil
+
+
+MODULES = ['extendedlogging', 'ttvlib.ttparse', 'ttvlib.ttprofile', 'ttvlib.ttviewer']
+
+# modules which must not be imported as a side effect (they are imported on first use)
+DEFERRED = {
+    'extendedlogging': ['logging.config', 'ttvlib'],
+    'ttvlib.ttparse': ['ttvlib.ttconvert', 'logging'],
+    'ttvlib.ttprofile': ['ttvlib.ttconvert'],
+    'ttvlib.ttviewer': ['ttvlib.ttconvert.standard', 'ttvlib.ttperfetto'],
+}
+DEFAULT_TOP = 3
+
+
+def importtime(module):
+    '''Import given module in a fresh interpreter, return a dict of module name -> (cumulative time in microseconds, nesting depth).'''
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.pathsep.join([benchutil.BASEDIR, environ.get('PYTHONPATH', '')])
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import ' + module]
+    p = subprocess.run(cmd, env=environ, check=True, stderr=subprocess.PIPE, universal_newlines=True)
+    result = {}
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2 # indented by two spaces per level
+        result[name.strip()] = (int(fields[1]), depth)
+    return result
+
+
+def run(modules=MODULES, repeat=benchutil.DEFAULT_REPEAT, top=DEFAULT_TOP, budget=None):
+    rows = []
+    failures = []
+    for module in modules:
+        runs = [importtime(module) for it in range(repeat)]
+        best = min(runs, key=lambda r: r[module][0])
+        elapsed_ms = 1e-3 * best[module][0]
+        heaviest = sorted((m for m in best if best[m][1] == 1), key=lambda m: -best[m][0]) # direct imports
+        rows.append([module, '{:.1f}'.format(elapsed_ms), ', '.join('{} {:.1f}'.format(m, 1e-3 * best[m][0]) for m in heaviest[:top])])
+        for m in DEFERRED.get(module, []):
+            if m in best:
+                failures.append('{} imports {}, which should be deferred'.format(module, m))
+        if budget is not None and elapsed_ms > budget:
+            failures.append('{} import takes {:.1f}ms, budget is {:.1f}ms'.format(module, elapsed_ms, budget))
+    benchutil.report(['module', 'time(ms)', 'heaviest imports (ms)'], rows)
+    for failure in failures:
+        sys.stdout.write('REGRESSION: ' + failure + '\n')
+    return len(failures) == 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=MODULES, help='modules to import, default: %(default)s')
+    parser.add_argument('-r', '--repeat', type=int, default=benchutil.DEFAULT_REPEAT, help='number of runs per module, best is taken')
+    parser.add_argument('-t', '--top', type=int, default=DEFAULT_TOP, help='number of heaviest imports to show')
+    parser.add_argument('-b', '--budget', type=float, help='maximum cumulative import time per module (ms)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run(**vars(parse_args())) else 1)
+
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+'''Handler lock contention: many threads tracing into a single file, unbuffered versus thread buffers.
+
+Runs a scaled-up demos/demo_multiprocessing.py: each thread makes many small traced calls.
+Unbuffered, each record takes the handler lock to format and write; with a thread buffer,
+records are formatted without lock and written per chunk.
+'''
+
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import argparse
+
+import benchutil
+
+
+DEFAULT_THREADS = [1, 4, 16]
+DEFAULT_CALLS = 20000
+DEFAULT_BUFFER = 256
+
+
+def run(threads=DEFAULT_THREADS, calls=DEFAULT_CALLS, processes=1, buffer=DEFAULT_BUFFER, repeat=benchutil.DEFAULT_REPEAT):
+    script = os.path.join(benchutil.DEMOS, 'demo_multiprocessing.py')
+    rows = []
+    for n in threads:
+        total_calls = processes * n * calls
+        unbuffered = benchutil.run_script(script, [processes, n, calls, 0], repeat=repeat)
+        buffered = benchutil.run_script(script, [processes, n, calls, buffer], repeat=repeat)
+        rows.append([n, total_calls, '{:.3f}'.format(unbuffered), '{:.3f}'.format(buffered),
+            '{:.2f}'.format(1e6 * unbuffered / total_calls), '{:.2f}'.format(1e6 * buffered / total_calls)])
+    sys.stdout.write('python {}, {} process(es), {} calls per thread, thread buffer {} lines\n'.format(sys.version.split()[0], processes, calls, buffer))
+    benchutil.report(['threads', 'calls', 'unbuffered(s)', 'buffered(s)', 'us/call', 'us/call(buffered)'], rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=DEFAULT_THREADS, help='numbers of threads per process to compare')
+    parser.add_argument('-n', '--calls', type=int, default=DEFAULT_CALLS, help='traced calls per thread')
+    parser.add_argument('-p', '--processes', type=int, default=1, help='number of processes')
+    parser.add_argument('-b', '--buffer', type=int, default=DEFAULT_BUFFER, help='thread buffer size (lines)')
+    parser.add_argument('-r', '--repeat', type=int, default=benchutil.DEFAULT_REPEAT, help='number of runs, best is taken')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    run(**vars(parse_args()))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+'''Compare tracing engines on demos/demo_fib.py: autologging proxies versus sys.monitoring/setprofile.
+
+Each engine runs in a fresh interpreter (the engine is chosen at decoration time).
+The baseline has tracing decorators disabled (AUTOLOGGING_TRACED_NOOP), so the overhead per call can be derived.
+'''
+
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import argparse
+
+import benchutil
+
+
+ENGINES = ['proxy', 'monitor', 'setprofile']
+DEFAULT_N = 18
+
+
+def number_of_calls(n):
+    # fib(n) recursion tree size
+    a, b = 1, 1
+    for it in range(n):
+        a, b = b, a + b + 1
+    return a
+
+
+def run(n=DEFAULT_N, repeat=benchutil.DEFAULT_REPEAT):
+    script = os.path.join(benchutil.DEMOS, 'demo_fib.py')
+    calls = number_of_calls(n)
+    baseline = benchutil.run_script(script, [n], env={'AUTOLOGGING_TRACED_NOOP': '1'}, repeat=repeat)
+    rows = [['noop', '{:.3f}'.format(baseline), '-']]
+    for engine in ENGINES:
+        elapsed = benchutil.run_script(script, [n], env={'EXTENDEDLOGGING_TRACING_ENGINE': engine}, repeat=repeat)
+        rows.append([engine, '{:.3f}'.format(elapsed), '{:.2f}'.format(1e6 * (elapsed - baseline) / calls)])
+    sys.stdout.write('python {}, fib({}): {} traced calls\n'.format(sys.version.split()[0], n, calls))
+    benchutil.report(['engine', 'time(s)', 'us/call'], rows)
+    if not hasattr(sys, 'monitoring'):
+        sys.stdout.write('(sys.monitoring requires python >= 3.12, engine monitor fell back to setprofile)\n')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=DEFAULT_N, help='fibonacci number to compute')
+    parser.add_argument('-r', '--repeat', type=int, default=benchutil.DEFAULT_REPEAT, help='number of runs per engine, best is taken')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    run(**vars(parse_args()))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+# shared helpers for the benchmarks
+
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import time
+import subprocess
+
+
+BASEDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+DEMOS = os.path.join(BASEDIR, 'demos')
+DEFAULT_REPEAT = 5
+
+
+def run_script(script, args=(), env=None, repeat=DEFAULT_REPEAT):
+    '''Run given python script in a fresh interpreter, return the best wall-clock time in seconds.'''
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.pathsep.join([BASEDIR, environ.get('PYTHONPATH', '')])
+    environ.update(env or {})
+    cmd = [sys.executable, script] + [str(a) for a in args]
+    best = None
+    for it in range(repeat):
+        t_start = time.perf_counter()
+        subprocess.run(cmd, env=environ, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - t_start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(headers, rows, output=sys.stdout):
+    '''Write a simple aligned table.'''
+    widths = [max(len(str(v)) for v in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        output.write('  '.join('{:>{}}'.format(str(v), w) for (v, w) in zip(row, widths)) + '\n')
+
+
+def synthetic_log(filename, lines, format_spec, **kwargs):
+    '''Write a synthetic tracing log of about given number of lines, in given format (as in the '# format: ' header).
+    See ttvlib.ttgenerate for the options.'''
+    sys.path.insert(0, BASEDIR)
+    import ttvlib.ttgenerate
+    return ttvlib.ttgenerate.write(filename, lines=lines, format_spec=format_spec, **kwargs)
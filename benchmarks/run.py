@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+'''Benchmark suite: tracing overhead and conversion throughput, with machine-readable results.
+
+Benchmarks:
+  calls      per-call overhead of @traced (autologging proxy): tracing disabled, console only, to file
+  formatter  TraceFormatter.format cost against argument size and nesting depth
+  errors     cost per traced frame of an exception unwinding through nested traced calls, against the depth
+  parser     LoggingParser lines/sec for each tracing format header variant, on synthetic logs (also BulkLoggingParser for the default)
+  store      TracingJsonStore items/sec (including parsing) and peak RSS, on synthetic logs
+
+Results can be written as json (--json) and compared against a previous run (--compare),
+which lists the ratios and exits nonzero if any result regressed more than the threshold.
+'''
+
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import platform
+import argparse
+import datetime
+import subprocess
+
+import benchutil
+sys.path.insert(0, benchutil.BASEDIR)
+import extendedlogging
+import ttvlib.ttparse as ttparse
+import ttvlib.ttstore as ttstore
+
+
+BENCHMARKS = ['calls', 'formatter', 'errors', 'parser', 'store']
+DEFAULT_SIZES = [10**4, 10**5]
+DEFAULT_CALLS = 20000
+DEFAULT_THRESHOLD = 1.2
+BATCHES = 5 # timings are the best batch, to suppress noise
+
+# the tracing format header variants which extendedlogging writes, by configure option
+FORMAT_OPTIONS = {
+    'default': {},
+    'threads': {'thread_names': True},
+    'processes': {'thread_names': True, 'process_names': True},
+    'tasks': {'task_names': True},
+    'monotonic': {'monotonic_timing': True},
+}
+
+ARGUMENT_SIZES = [1, 10, 100, 1000, 10000]
+ARGUMENT_DEPTHS = [1, 2, 4, 6]
+UNWIND_DEPTHS = [1, 10, 100]
+
+
+class Results():
+    '''Collect results, each a single value with a unit and a direction (lower or higher is better).'''
+    def __init__(self):
+        self.results = []
+
+    def add(self, benchmark, case, metric, value, unit, better='lower'):
+        self.results.append({'benchmark': benchmark, 'case': case, 'metric': metric, 'value': value, 'unit': unit, 'better': better})
+
+    def rows(self, benchmark):
+        return [r for r in self.results if r['benchmark'] == benchmark]
+
+    def dump(self, filename):
+        data = {'meta': metadata(), 'results': self.results}
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=1)
+
+
+def metadata():
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=benchutil.BASEDIR, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except Exception:
+        pass
+    return {'python': sys.version.split()[0], 'platform': platform.platform(), 'commit': commit,
+        'time': datetime.datetime.now().isoformat(timespec='seconds')}
+
+
+def format_specs():
+    '''Tracing format per variant, as extendedlogging derives it from the options.'''
+    result = {}
+    for (name, options) in FORMAT_OPTIONS.items():
+        cfg = extendedlogging.FileConfiguration(**options)
+        cfg.apply()
+        result[name] = cfg.format
+    return result
+
+
+def bench_calls(results, tmpdir, calls=DEFAULT_CALLS):
+    def plain(x, y):
+        return x
+    traced = extendedlogging.traced(plain)
+    devnull = open(os.devnull, 'w')
+    def measure(function):
+        n = max(1, calls // BATCHES)
+        best = None
+        for batch in range(BATCHES):
+            t_start = time.perf_counter_ns()
+            for it in range(n):
+                function(it, 'abc')
+            elapsed = time.perf_counter_ns() - t_start
+            best = elapsed if best is None else min(best, elapsed)
+        return best / n
+    modes = [
+        ('disabled', {'tracing': False}, False),
+        ('console', {'tracing': False}, True),
+        ('file', {'tracing': True}, True),
+    ]
+    baseline = measure(plain)
+    results.add('calls', 'plain', 'time', baseline, 'ns/call')
+    for (mode, options, enabled) in modes:
+        extendedlogging.configure(filename=os.path.join(tmpdir, 'calls.log'), console_stream=devnull, **options)
+        if enabled:
+            extendedlogging.enable_tracing()
+        else:
+            extendedlogging.disable_tracing()
+        results.add('calls', mode, 'overhead', measure(traced) - baseline, 'ns/call')
+    extendedlogging.tracing_control.get().clear_rules()
+    extendedlogging.remove_all_handlers()
+    devnull.close()
+
+
+def nested(size, depth):
+    if depth <= 1:
+        return list(range(size))
+    return [nested(size, depth - 1) for it in range(size)]
+
+
+def bench_formatter(results, repeat=1000):
+    formatter = extendedlogging.FileConfiguration().get_formatter()
+    def measure(args):
+        record = logging.LogRecord('', extendedlogging.TRACE, 'bench.py', 1, 'CALL *%r **%r', None, None, func='f')
+        n = max(1, repeat // BATCHES)
+        best = None
+        for batch in range(BATCHES):
+            t_start = time.perf_counter_ns()
+            for it in range(n):
+                record.args = args
+                formatter.format(record)
+            elapsed = time.perf_counter_ns() - t_start
+            best = elapsed if best is None else min(best, elapsed)
+        return 1e-3 * best / n
+    measure(((0,), {})) # warmup
+    for size in ARGUMENT_SIZES:
+        results.add('formatter', 'list[{}]'.format(size), 'time', measure(((list(range(size)),), {})), 'us/record')
+    for depth in ARGUMENT_DEPTHS:
+        results.add('formatter', 'nested[4]x{}'.format(depth), 'time', measure(((nested(4, depth),), {})), 'us/record')
+
+
+def bench_errors(results, tmpdir, repeat=200):
+    @extendedlogging.traced
+    def recurse(depth):
+        if depth > 1:
+            return recurse(depth - 1)
+        raise ValueError('unwind')
+    extendedlogging.configure(filename=os.path.join(tmpdir, 'errors.log'), console_enabled=False, tracing=True)
+    def measure(depth):
+        n = max(1, repeat // BATCHES)
+        best = None
+        for batch in range(BATCHES):
+            t_start = time.perf_counter_ns()
+            for it in range(n):
+                try:
+                    recurse(depth)
+                except ValueError:
+                    pass
+            elapsed = time.perf_counter_ns() - t_start
+            best = elapsed if best is None else min(best, elapsed)
+        return 1e-3 * best / n / depth
+    for depth in UNWIND_DEPTHS:
+        results.add('errors', 'depth{}'.format(depth), 'time', measure(depth), 'us/frame')
+    extendedlogging.remove_all_handlers()
+
+
+def synthetic(tmpdir, name, format_spec, size):
+    filename = os.path.join(tmpdir, '{}_{}.log'.format(name, size))
+    if not os.path.isfile(filename):
+        benchutil.synthetic_log(filename, size, format_spec)
+    return filename
+
+
+def bench_parser(results, tmpdir, sizes=DEFAULT_SIZES):
+    ttparse.BulkLoggingParser().parse_lines([]) # warmup, imports numpy
+    for (name, format_spec) in format_specs().items():
+        for size in sizes:
+            filename = synthetic(tmpdir, name, format_spec, size)
+            for (case, parser) in [('{}/{}', ttparse.LoggingParser), ('{}/{}/bulk', ttparse.BulkLoggingParser)]:
+                if parser is ttparse.BulkLoggingParser and format_spec != ttparse.DEFAULT_FORMAT_SPEC:
+                    continue # same as per-line parsing
+                store = ttstore.TracingStore() # matches calls, no output
+                t_start = time.perf_counter()
+                lines = ttparse.parse_into(filename, store, parser())
+                elapsed = time.perf_counter() - t_start
+                results.add('parser', case.format(name, size), 'throughput', lines / elapsed, 'lines/s', 'higher')
+
+
+def bench_store(results, tmpdir, sizes=DEFAULT_SIZES):
+    format_spec = format_specs()['default']
+    for size in sizes:
+        filename = synthetic(tmpdir, 'default', format_spec, size)
+        # fresh interpreter per size, for a meaningful peak RSS
+        cmd = [sys.executable, os.path.realpath(__file__), '--store-worker', filename, os.path.join(tmpdir, 'store.json')]
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        worker = json.loads(output)
+        results.add('store', str(size), 'throughput', worker['items'] / worker['seconds'], 'items/s', 'higher')
+        results.add('store', str(size), 'peak_rss', worker['peak_rss_mb'], 'MB')
+
+
+def store_worker(filename, outputfilename):
+    import resource
+    t_start = time.perf_counter()
+    store = ttstore.TracingJsonStore(outputfilename)
+    ttparse.parse_into(filename, store, ttparse.LoggingParser())
+    store.close()
+    elapsed = time.perf_counter() - t_start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # kilobytes on linux
+    sys.stdout.write(json.dumps({'items': store.size, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb}) + '\n')
+
+
+def compare(results, baselinefile, threshold=DEFAULT_THRESHOLD):
+    '''Print the ratio of each result against the baseline, return the list of regressions.'''
+    with open(baselinefile, 'r') as f:
+        baseline = {(r['benchmark'], r['case'], r['metric']): r for r in json.load(f)['results']}
+    rows = []
+    regressions = []
+    for r in results.results:
+        key = (r['benchmark'], r['case'], r['metric'])
+        if key not in baseline or not baseline[key]['value'] or not r['value']:
+            continue
+        ratio = r['value'] / baseline[key]['value']
+        if r['better'] == 'higher':
+            ratio = 1.0 / ratio
+        # ratio > 1 is worse, for either direction
+        rows.append(['/'.join(key), '{:.4g}'.format(baseline[key]['value']), '{:.4g}'.format(r['value']), r['unit'], '{:.2f}'.format(ratio)])
+        if ratio > threshold:
+            regressions.append('/'.join(key))
+    sys.stdout.write('\ncomparison against {} (slowdown factor, > 1 is worse):\n'.format(baselinefile))
+    benchutil.report(['result', 'baseline', 'current', 'unit', 'factor'], rows)
+    return regressions
+
+
+def run(benchmarks=BENCHMARKS, sizes=DEFAULT_SIZES, calls=DEFAULT_CALLS, output=None, baseline=None, threshold=DEFAULT_THRESHOLD):
+    results = Results()
+    tmpdir = tempfile.mkdtemp(prefix='extendedlogging_bench_')
+    for benchmark in benchmarks:
+        if benchmark == 'calls':
+            bench_calls(results, tmpdir, calls)
+        elif benchmark == 'formatter':
+            bench_formatter(results)
+        elif benchmark == 'errors':
+            bench_errors(results, tmpdir)
+        elif benchmark == 'parser':
+            bench_parser(results, tmpdir, sizes)
+        elif benchmark == 'store':
+            bench_store(results, tmpdir, sizes)
+        else:
+            raise Exception('unknown benchmark {}, expected one of {}'.format(benchmark, BENCHMARKS))
+        sys.stdout.write('{}:\n'.format(benchmark))
+        benchutil.report(['case', 'metric', 'value', 'unit'], [[r['case'], r['metric'], '{:.4g}'.format(r['value']), r['unit']] for r in results.rows(benchmark)])
+    if output:
+        results.dump(output)
+    regressions = []
+    if baseline:
+        regressions = compare(results, baseline, threshold)
+        for regression in regressions:
+            sys.stdout.write('REGRESSION: ' + regression + '\n')
+    return len(regressions) == 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS, help='benchmarks to run, default all: %(default)s')
+    parser.add_argument('-s', '--sizes', type=float, nargs='+', default=DEFAULT_SIZES, help='synthetic log sizes (lines), for example 1e4 1e7')
+    parser.add_argument('-n', '--calls', type=int, default=DEFAULT_CALLS, help='number of calls per mode, for benchmark calls')
+    parser.add_argument('-o', '--output', '--json', help='write results to given json file')
+    parser.add_argument('-c', '--compare', dest='baseline', help='compare against results of a previous run (json file)')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD, help='slowdown factor which counts as regression')
+    parser.add_argument('--store-worker', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes]
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.store_worker:
+        store_worker(*args.store_worker)
+        sys.exit(0)
+    del args.store_worker
+    sys.exit(0 if run(**vars(args)) else 1)
+
@@ -5,18 +5,25 @@ import threading
 import time
 
 
-
 SLEEP_TIME = 0.1
 NUM_THREADS = 2
 NUM_PROCESSES = 3
+NUM_CALLS = 0
 
 
 @extendedlogging.traced
 def doit_thread():
     time.sleep(SLEEP_TIME)
+    for it in range(NUM_CALLS):
+        work(it)
     #extendedlogging.info('thread {} in process {} is done'.format(threading.current_thread().name, multiprocessing.current_process()))
 
 
+@extendedlogging.traced
+def work(x):
+    return x + 1
+
+
 @extendedlogging.traced
 def doit_process():
     threads = []
@@ -38,6 +45,19 @@ def main():
 
 
 if __name__ == "__main__":
-    extendedlogging.configure(tracing=True, thread_names=True, process_names=True)
+    # optional scaling (used by benchmarks/bench_threads.py): processes, threads per process, calls per thread, thread buffer size, shared memory transport, flows
+    import sys
+    args = [int(a) for a in sys.argv[1:]]
+    if len(args) > 0:
+        NUM_PROCESSES = args[0]
+    if len(args) > 1:
+        NUM_THREADS = args[1]
+    if len(args) > 2:
+        NUM_CALLS = args[2]
+    thread_buffer = None
+    if len(args) > 3 and args[3] > 0:
+        thread_buffer = args[3]
+    shared_memory = len(args) > 4 and args[4] > 0
+    flows = len(args) > 5 and args[5] > 0
+    extendedlogging.configure(tracing=True, thread_names=True, process_names=True, thread_buffer=thread_buffer, shared_memory=shared_memory, flows=flows)
     main()
-
@@ -8,52 +8,126 @@ It also implements some extra features:
 
 To enable/configure: just call configure(). It accepts the following options:
     tracing                # boolean, default disabled, when enabled logging (and tracing) is written to file
+    levels                 # dict: module, class or function name -> level, tracing is disabled for levels above TRACE, other records below the level are dropped
     filename               # trace file name, default {DEFAULT_LOG_FILE}
     timestamp_resolution   # tracing timestamp resolution, default {DEFAULT_TIMESTAMP_RESOLUTION}
     fold_newlines          # tracing newline folding, default {DEFAULT_NEWLINE_FOLDING}
     string_size_limit      # tracing string size limit, default {DEFAULT_STRING_SIZE_LIMIT}
+    error_size_limit       # tracing string size limit of ERROR records, which are not cut off at the string size limit (a traced exception message is cut before formatting), default {DEFAULT_ERROR_SIZE_LIMIT}
     array_size_limit       # tracing array size limit, default {DEFAULT_ARRAY_SIZE_LIMIT}
     array_tail_truncation  # tracing array truncation option, to cut off arrays at the end instead of interior, default {DEFAULT_ARRAY_TAIL_TRUNCATION}
     error_handling         # tracing error handler, default {DEFAULT_ERROR_HANDLING}
+    generator_spans        # tracing option to log a generator as one span, from first next to exhaustion, instead of each yield, default {DEFAULT_GENERATOR_SPANS}
+    generator_sample       # generator span option, log every n-th yield, default {DEFAULT_GENERATOR_SAMPLE} (no yields)
     thread_names           # tracing option to also log thread id/name on each line, default {DEFAULT_LOG_THREAD_NAMES}
     process_names          # tracing option to also log process name on each line, default {DEFAULT_LOG_PROCESS_NAMES}
+    task_names             # tracing option to also log asyncio task name on each line, default {DEFAULT_LOG_TASK_NAMES}
     write_format_header    # tracing option to write a header line with the format used, default {DEFAULT_WRITE_FORMAT_HEADER}
-    *_format               # logging format to use
+    compression            # tracing file compression: None, 'gzip' or 'zstd', default {DEFAULT_COMPRESSION} (derive from filename suffix .gz/.zst)
+    flush_interval         # tracing option, seconds between flush points of a compressed file, default {DEFAULT_FLUSH_INTERVAL}
+    max_bytes              # tracing file rotation: start a new segment when the file exceeds this size, default {DEFAULT_MAX_BYTES} (no limit)
+    max_age                # tracing file rotation: start a new segment after this many seconds, default {DEFAULT_MAX_AGE} (no limit)
+    segments               # tracing file rotation: number of segments to keep, default {DEFAULT_SEGMENTS}
+    monotonic_timing       # tracing option to log monotonic nanosecond timestamps (perf_ns) and durations (duration_ns), default {DEFAULT_MONOTONIC_TIMING}
+    flows                  # tracing option to log flow events when starting threads/processes and submitting to executors, default {DEFAULT_FLOWS}
+    thread_buffer          # tracing option, number of lines each thread buffers before writing them in one chunk, default {DEFAULT_THREAD_BUFFER} (unbuffered)
+    shared_memory          # tracing option, forked child processes pass their records via shared memory to the parent, which writes them in timestamp order, default {DEFAULT_SHARED_MEMORY} (python 3.8 or later)
+    metrics                # collect call counts and latency histograms per traced callable, also without tracing to file, default {DEFAULT_METRICS}
+    metrics_file           # metrics option, file to append a json snapshot to periodically and at exit, default {DEFAULT_METRICS_FILE}
+    metrics_interval       # metrics option, seconds between snapshots, default {DEFAULT_METRICS_INTERVAL}
+    stats                  # measure the own overhead per phase (record creation, formatting, writing, ...), summarized at exit, default {DEFAULT_STATS}
+    *_format               # logging format to use, file_format='jsonl' writes one json object per record (use a .jsonl filename)
     *_level                # logging level to use
 Where applicable (as marked with *_), the option prefix must be either 'file' or 'console'.
+
+Tracing can be switched per function, class or module at runtime, without reconfiguration:
+see enable_tracing, disable_tracing and install_trigger (module tracing_control).
+Metrics can be read at any time with metrics() (module tracing_metrics), the own overhead with stats() (module tracing_stats).
 """
 __author__ = 'Jan Feitsma'
 
 import sys
 import os
+import io
+import json
+import zlib
 import time
-import inspect
+import weakref
 import logging
-import logging.config
+import threading
 import autologging
 import patch_autologging
+import tracing_engine
+import tracing_control
+import tracing_flow
+import tracing_metrics
+import tracing_stats
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# errors which the handlers raise instead of reporting, like logging.StreamHandler does (python2 has no RecursionError)
+_RAISED_ERRORS = (RecursionError,) if sys.version_info >= (3, 5) else ()
 
 # interface dealing
 from logging import *
 from autologging import *
+from tracing_control import enable_tracing, disable_tracing, traced_callables, install_trigger
+from tracing_flow import flow_start, flow_end
+from tracing_metrics import metrics
+from tracing_stats import stats
 
 # monkey patch to freeze the name, which enables consistent logging across multiple modules and over multiple reconfiguration runs
 autologging._generate_logger_name = lambda *args, **kwargs: MAIN_LOGGER_NAME
 
 
+def traced(*args, **kwargs):
+    """Tracing decorator, see autologging.traced.
+    The tracing engine is chosen at decoration time, see tracing_engine.ENGINE: by default autologging proxies,
+    optionally the low-overhead sys.monitoring/setprofile engine."""
+    if tracing_engine.ENGINE == 'proxy' or autologging.traced == autologging._traced_noop:
+        return autologging.traced(*args, **kwargs)
+    return tracing_engine.traced(*args, **kwargs)
+
+
 # constants
 DEFAULT_LOG_FILE = '/tmp/extendedlogging.log'
 MAIN_LOGGER_NAME = ''
 DEFAULT_NEWLINE_FOLDING = True
 DEFAULT_TIMESTAMP_RESOLUTION = 6
 DEFAULT_STRING_SIZE_LIMIT = 1000
+DEFAULT_ERROR_SIZE_LIMIT = 100000
 DEFAULT_ARRAY_SIZE_LIMIT = 10
 DEFAULT_ARRAY_TAIL_TRUNCATION = False # default inner, not tail
 DEFAULT_ERROR_HANDLING = True # log ERROR in tracing upon exception
+DEFAULT_GENERATOR_SPANS = True
+DEFAULT_GENERATOR_SAMPLE = None
 DEFAULT_LOG_PROCESS_NAMES = False
 DEFAULT_LOG_THREAD_NAMES = False
+DEFAULT_LOG_TASK_NAMES = False
 # TODO: try to auto-detect multiprocessing/threading, although that seems too complicated and error prone
 DEFAULT_WRITE_FORMAT_HEADER = False
+DEFAULT_COMPRESSION = None # derive from filename suffix
+DEFAULT_FLUSH_INTERVAL = 1.0 # seconds
+COMPRESSED_MEMBER_SIZE = 1 << 20 # bytes, a flush point is also written when this much compressed data is pending
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+DEFAULT_MAX_BYTES = None
+DEFAULT_MAX_AGE = None
+DEFAULT_SEGMENTS = 5 # current file plus 4 older segments: name.1.log (newest) .. name.4.log (oldest)
+LOGFILE_FORMAT_SPEC = '# format: '
+LOGFILE_CONTINUED_MARK = '# continued'
+JSONL_FORMAT = 'jsonl' # file format option: structured output instead of a logging format string
+DEFAULT_MONOTONIC_TIMING = False
+DEFAULT_THREAD_BUFFER = None
+DEFAULT_SHARED_MEMORY = False
+DEFAULT_FLOWS = False
+DEFAULT_METRICS = False
+DEFAULT_METRICS_FILE = None
+DEFAULT_METRICS_INTERVAL = tracing_metrics.DEFAULT_DUMP_INTERVAL
+DEFAULT_STATS = False
+# file options which require a new handler (and a fresh trace file) when changed, others are updated in place
+FILE_HANDLER_OPTIONS = ('filename', 'compression', 'max_bytes', 'max_age', 'segments', 'thread_buffer', 'shared_memory')
 
 
 
@@ -63,6 +137,9 @@ def configure(**kwargs):
     return c.apply()
 configure.__doc__ = __doc__.format(**vars()) # trick to fill in the default values, although this might not be how __doc__ was intended
 
+# the last applied configuration, to be able to reconfigure incrementally
+_applied = None
+
 
 def remove_all_handlers():
     """Blunt reset: remove all handlers registered in logging module."""
@@ -93,30 +170,114 @@ class FileConfiguration():
         self.level = autologging.TRACE
         self.fold_newlines = DEFAULT_NEWLINE_FOLDING
         self.string_size_limit = DEFAULT_STRING_SIZE_LIMIT
+        self.error_size_limit = DEFAULT_ERROR_SIZE_LIMIT
         self.array_size_limit = DEFAULT_ARRAY_SIZE_LIMIT
         self.array_tail_truncation = DEFAULT_ARRAY_TAIL_TRUNCATION
         self.error_handling = DEFAULT_ERROR_HANDLING
+        self.generator_spans = DEFAULT_GENERATOR_SPANS
+        self.generator_sample = DEFAULT_GENERATOR_SAMPLE
         self.process_names = DEFAULT_LOG_PROCESS_NAMES
         self.thread_names = DEFAULT_LOG_THREAD_NAMES
+        self.task_names = DEFAULT_LOG_TASK_NAMES
         self.write_format_header = DEFAULT_WRITE_FORMAT_HEADER
+        self.compression = DEFAULT_COMPRESSION
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self.max_age = DEFAULT_MAX_AGE
+        self.segments = DEFAULT_SEGMENTS
+        self.monotonic_timing = DEFAULT_MONOTONIC_TIMING
+        self.thread_buffer = DEFAULT_THREAD_BUFFER
+        self.shared_memory = DEFAULT_SHARED_MEMORY
+        self.flows = DEFAULT_FLOWS
+        self.metrics = DEFAULT_METRICS
+        self.metrics_file = DEFAULT_METRICS_FILE
+        self.metrics_interval = DEFAULT_METRICS_INTERVAL
+        self.stats = DEFAULT_STATS
         # set overruled options, if any
         self.__dict__.update(kwargs)
 
     def apply(self):
+        # buffered lines of different threads are interleaved per chunk, the parser needs the thread names to untangle them
+        if self.thread_buffer:
+            self.thread_names = True
+        # likewise, the records of all processes end up in one merged stream
+        if self.shared_memory:
+            if sys.version_info < (3, 8):
+                raise Exception('option shared_memory requires python 3.8 or later (multiprocessing.shared_memory, os.register_at_fork)')
+            self.process_names = True
+        if self.jsonl():
+            pass # the fields are selected by JsonTraceFormatter
+        elif self.task_names and not 'taskName' in self.format:
+            self.format = self.format.replace('%(levelname)s', '%(levelname)s:%(taskName)s')
         if self.thread_names and not 'threadName' in self.format:
             self.format = self.format.replace('%(levelname)s', '%(levelname)s:%(threadName)s')
         if self.process_names and not 'processName' in self.format:
             self.format = self.format.replace('%(levelname)s', '%(levelname)s:%(processName)s')
+        if self.monotonic_timing and not 'perf_ns' in self.format:
+            self.format = self.format.replace('%(levelname)s', '%(levelname)s:%(perf_ns)s:%(duration_ns)s')
         patch_autologging.set_error_handling(self.error_handling)
+        patch_autologging.set_error_size_limit(self.error_size_limit)
+        patch_autologging.set_monotonic_timing(self.monotonic_timing)
+        patch_autologging.set_generator_spans(self.generator_spans, self.generator_sample)
+        tracing_flow.set_automatic_flows(self.flows and self.enabled)
+        # metrics do not depend on tracing to file
+        tracing_metrics.set_metrics(self.metrics)
+        tracing_metrics.set_dump(self.metrics_file if self.metrics else None, self.metrics_interval)
+        tracing_stats.set_stats(self.stats)
+
+    def format_header_needed(self):
+        # the parser needs the format, unless it is the default one
+        if self.jsonl():
+            return self.rotating()
+        return self.write_format_header or self.thread_names or self.process_names or self.task_names or self.monotonic_timing or self.rotating()
 
     def get_formatter(self):
         # filter the arguments which are applicable
-        kwargs = {k: getattr(self, k) for k in set.intersection(set(self.__dict__.keys()), set([m[0] for m in inspect.getmembers(TraceFormatter(''))]))}
+        kwargs = {k: getattr(self, k) for k in TraceFormatter.OPTIONS if hasattr(self, k)}
+        if self.jsonl():
+            return JsonTraceFormatter(self.json_fields(), **kwargs)
         return TraceFormatter(self.format, **kwargs)
 
+    def jsonl(self):
+        return self.format == JSONL_FORMAT
+
+    def json_fields(self):
+        """Optional record attributes to write in jsonl format."""
+        options = [('processName', self.process_names), ('threadName', self.thread_names), ('taskName', self.task_names),
+            ('perf_ns', self.monotonic_timing), ('duration_ns', self.monotonic_timing)]
+        return [field for (field, enabled) in options if enabled]
+
+    def rotating(self):
+        return self.max_bytes is not None or self.max_age is not None
+
     def clear_file(self):
         if os.path.exists(self.filename) and self.enabled:
-            os.remove(self.filename)
+            if self.rotating():
+                # keep the history of previous runs
+                rotate_segments(self.filename, self.segments)
+            else:
+                os.remove(self.filename)
+
+
+def segment_filename(filename, index):
+    """Name of a rotated tracing file segment, for example trace.log.gz -> trace.2.log.gz. Index 0 is the current file."""
+    if index == 0:
+        return filename
+    stem, suffix = os.path.splitext(filename)
+    if suffix in COMPRESSION_SUFFIXES:
+        stem, suffix2 = os.path.splitext(stem)
+        suffix = suffix2 + suffix
+    return '{}.{}{}'.format(stem, index, suffix)
+
+
+def rotate_segments(filename, segments):
+    """Shift existing segments by one, dropping the oldest. Afterwards the current file is free to be written."""
+    for index in range(segments - 1, 0, -1):
+        src = segment_filename(filename, index - 1)
+        if os.path.exists(src):
+            getattr(os, 'replace', os.rename)(src, segment_filename(filename, index)) # python2: rename replaces on posix
+    if os.path.exists(filename):
+        os.remove(filename) # segments=1: no history
 
 
 def distribute_attributes(kv, objects):
@@ -150,7 +311,9 @@ class MixedConfiguration():
         self.console_config = ConsoleConfiguration(enabled=True) # stdout
         self.file_config = FileConfiguration(enabled=False)
         self.config_dict = None
+        self.handlers = {}
         self.file_config.enabled = kwargs.pop('tracing', False)
+        self.levels = kwargs.pop('levels', {})
         distribute_attributes(kwargs, {'console_': self.console_config, 'file_': self.file_config})
 
     def clear(self):
@@ -160,29 +323,75 @@ class MixedConfiguration():
         self.file_config.clear_file()
 
     def apply(self):
-        """Apply the configuration."""
+        """Apply the configuration.
+        If a previous configuration is still in place, only the changed handlers, formatters and levels are updated."""
+        global _applied
         # check if autologging has been disabled (typically via environment variable)
         if autologging.traced == autologging._traced_noop:
             self.file_config.enabled = False
-        # reset
-        self.clear()
-        # configure logging
-        self.config_dict = self.make_config_dict()
-        logging.config.dictConfig(self.config_dict)
         # optionally tweak autologging
         self.file_config.apply()
+        tracing_control.set_levels(self.levels)
+        self.config_dict = self.make_config_dict()
+        if not self.update(_applied):
+            self.reset()
+        _applied = self
+        return logging.getLogger(self.name)
+
+    def reset(self):
+        """Full (re)configuration of the logging module."""
+        self.clear()
+        import logging.config # deferred, it pulls in logging.handlers, socket, pickle etc.
+        logging.config.dictConfig(self.config_dict)
+        self.handlers = {name: logging._handlers[name] for name in self.config_dict['handlers']}
         # bootstrap, connect the custom TraceFormatter
         if self.file_config.enabled:
-            logging._handlers['tracehandler'].formatter = self.file_config.get_formatter()
-            # write tracing format header line
-            if self.file_config.write_format_header or self.file_config.thread_names or self.file_config.process_names:
-                logging._handlers['tracehandler'].stream.write('# format: ' + self.file_config.format + '\n')
-        return logging.getLogger(self.name)
+            self.handlers['tracehandler'].formatter = self.file_config.get_formatter()
+            self.write_header()
+
+    def write_header(self, always=False):
+        # write tracing format header line, rotated segments always need one
+        if always or self.file_config.format_header_needed():
+            self.handlers['tracehandler'].write_header(LOGFILE_FORMAT_SPEC + self.file_config.format)
+
+    def update(self, previous):
+        """Update the handlers of the previously applied configuration. Return False if a reset is needed instead."""
+        if previous is None or self.name != previous.name or set(logging.root.handlers) != set(previous.handlers.values()):
+            return False # not applied, or changed by someone else
+        console, previous_console = self.console_config, previous.console_config
+        tracefile, previous_tracefile = self.file_config, previous.file_config
+        if console.enabled != previous_console.enabled or tracefile.enabled != previous_tracefile.enabled:
+            return False
+        if tracefile.enabled and any(getattr(tracefile, k) != getattr(previous_tracefile, k) for k in FILE_HANDLER_OPTIONS):
+            return False
+        if tracefile.enabled and tracefile.jsonl() != previous_tracefile.jsonl():
+            return False # a file cannot mix json lines and a logging format
+        self.handlers = previous.handlers
+        if console.enabled:
+            handler = self.handlers['loghandler']
+            if console.stream is not previous_console.stream:
+                handler.setStream(console.stream)
+            if console.format != previous_console.format:
+                handler.setFormatter(logging.Formatter(console.format))
+            if console.level != previous_console.level:
+                handler.setLevel(console.level)
+        if tracefile.enabled:
+            handler = self.handlers['tracehandler']
+            handler.flush_interval = tracefile.flush_interval
+            if tracefile.level != previous_tracefile.level:
+                handler.setLevel(tracefile.level)
+            if any(getattr(tracefile, k) != getattr(previous_tracefile, k) for k in ('format',) + TraceFormatter.OPTIONS):
+                handler.setFormatter(tracefile.get_formatter())
+                if tracefile.format != previous_tracefile.format:
+                    # the continued file switches format: the parser needs the new one, also when it is the default
+                    self.write_header(always=True)
+        return True
 
     def make_config_dict(self):
         result = {
             'version': 1,
             'formatters': {},
+            'filters': {'levelfilter': {'()': tracing_control.LevelFilter}}, # levels per module, class or function
             'handlers': {},
             'loggers': {
                 self.name: {
@@ -195,13 +404,16 @@ class MixedConfiguration():
         cfg = self.console_config
         if cfg.enabled:
             result['formatters']['logformatter'] = {'format': cfg.format}
-            result['handlers']['loghandler'] = {'class': 'logging.StreamHandler', 'stream': cfg.stream, 'level': cfg.level, 'formatter': 'logformatter'}
+            result['handlers']['loghandler'] = {'class': 'logging.StreamHandler', 'stream': cfg.stream, 'level': cfg.level, 'formatter': 'logformatter', 'filters': ['levelfilter']}
             result['loggers'][self.name]['handlers'].append('loghandler')
         # file configuration
         cfg = self.file_config
         if cfg.enabled:
-            result['formatters']['traceformatter'] = {'format': cfg.format} # NOTE: cannot yet use cfg.get_formatter()
-            result['handlers']['tracehandler'] = {'class': 'logging.FileHandler', 'level': cfg.level, 'formatter': 'traceformatter', 'filename': cfg.filename}
+            result['formatters']['traceformatter'] = {'format': '%(message)s' if cfg.jsonl() else cfg.format} # NOTE: cannot yet use cfg.get_formatter()
+            result['handlers']['tracehandler'] = {'class': __name__ + '.TraceFileHandler', 'level': cfg.level, 'formatter': 'traceformatter', 'filters': ['levelfilter'], 'filename': cfg.filename,
+                'compression': cfg.compression, 'flush_interval': cfg.flush_interval, 'thread_buffer': cfg.thread_buffer, 'shared_memory': cfg.shared_memory}
+            if cfg.rotating():
+                result['handlers']['tracehandler'].update({'class': __name__ + '.RotatingTraceFileHandler', 'max_bytes': cfg.max_bytes, 'max_age': cfg.max_age, 'segments': cfg.segments})
             result['loggers'][self.name]['handlers'].append('tracehandler')
         return result
 
@@ -219,15 +431,30 @@ class RecursiveVisitor():
         return result
 
 
+def current_task_name():
+    """Name of the running asyncio task, or '-' outside of tasks."""
+    asyncio = sys.modules.get('asyncio') # not imported means no tasks
+    if asyncio is not None and asyncio._get_running_loop() is not None:
+        task = asyncio.current_task()
+        if task is not None:
+            return task.get_name()
+    return '-'
+
+
 class TraceFormatter(logging.Formatter):
     """Custom formatter, intended for logging/tracing to file."""
+    OPTIONS = ('fold_newlines', 'timestamp_resolution', 'string_size_limit', 'error_size_limit', 'array_size_limit', 'array_tail_truncation')
+
     def __init__(self, fmt, **kwargs):
         logging.Formatter.__init__(self, fmt=fmt)
         self.fold_newlines = kwargs.get('fold_newlines', DEFAULT_NEWLINE_FOLDING)
         self.timestamp_resolution = int(kwargs.get('timestamp_resolution', DEFAULT_TIMESTAMP_RESOLUTION))
         self.string_size_limit = int(kwargs.get('string_size_limit', DEFAULT_STRING_SIZE_LIMIT))
+        self.error_size_limit = int(kwargs.get('error_size_limit', DEFAULT_ERROR_SIZE_LIMIT))
         self.array_size_limit = int(kwargs.get('array_size_limit', DEFAULT_ARRAY_SIZE_LIMIT))
         self.array_tail_truncation = kwargs.get('array_tail_truncation', DEFAULT_ARRAY_TAIL_TRUNCATION)
+        self.monotonic_fields = fmt is not None and ('perf_ns' in fmt or 'duration_ns' in fmt)
+        self.task_field = fmt is not None and 'taskName' in fmt
         assert(self.timestamp_resolution >= 1)
         assert(self.timestamp_resolution <= 9)
         # python2 backwards compatibility
@@ -235,37 +462,79 @@ class TraceFormatter(logging.Formatter):
             self.default_time_format = '%Y-%m-%d %H:%M:%S'
 
     def format(self, record):
+        # optional self-instrumentation: time per step (see tracing_stats)
+        timer = tracing_stats.timer()
+        truncated = [False] # set by the array step, a holder as python2 has no nonlocal
+        # step: defaults for monotonic timing fields, which are only provided by the tracing proxy
+        if self.monotonic_fields:
+            if not hasattr(record, 'perf_ns'):
+                record.perf_ns = tracing_stats.perf_counter_ns()
+            if not hasattr(record, 'duration_ns'):
+                record.duration_ns = '-'
+        # step: asyncio task name (python >= 3.12 provides it, as None outside of tasks)
+        if self.task_field and getattr(record, 'taskName', None) is None:
+            record.taskName = current_task_name()
         # step: compress arrays in self.args a-la numpy
         if self.array_size_limit != None:
-            def truncate_tail(arg):
-                if len(arg) <= self.array_size_limit:
-                    return arg
-                return list(arg[:self.array_size_limit]) + ['...']
-            def truncate_interior(arg):
-                if len(arg) <= self.array_size_limit:
-                    return arg
-                n1 = int((1 + self.array_size_limit) / 2)
-                n2 = n1 + len(arg) - self.array_size_limit
-                arg1 = list(arg[:n1])
-                arg2 = list(arg[n2:])
-                return arg1 + ['...'] + arg2
-            truncate_function = [truncate_interior, truncate_tail][self.array_tail_truncation]
+            def truncate_function(arg):
+                result = self.truncate_array(arg)
+                truncated[0] = truncated[0] or result is not arg
+                return result
             record.args = RecursiveVisitor(types=(tuple,list), function=truncate_function).apply(record.args)
+        if timer:
+            timer.lap('arguments')
         # step: build the message
         result_string = super(TraceFormatter, self).format(record)
+        if timer:
+            timer.lap('format')
         # step: remove newlines, ensure every entry is on a single line (to make post-processing easier)
         if self.fold_newlines:
             result_string = result_string.replace('\n', '\\n')
-        # step: apply string size limit
-        if self.string_size_limit != None:
-            if len(result_string) > self.string_size_limit:
-                num_characters_truncated = len(result_string) - self.string_size_limit
-                last_part = '<{} characters truncated>'.format(num_characters_truncated)
-                last_idx = self.string_size_limit - len(last_part)
-                result_string = result_string[:last_idx] + last_part
+        # step: apply string size limit, errors have their own (larger) limit
+        limit = self.error_size_limit if record.levelno >= logging.ERROR else self.string_size_limit
+        cut = self.error_cut(record) if record.levelno >= logging.ERROR else 0
+        if limit != None and (len(result_string) > limit or cut):
+            result_string = self.truncate_string(result_string, limit, cut)
+            truncated[0] = True
+        if timer:
+            timer.lap('fold')
+            tracing_stats.count('records')
+            if truncated[0]:
+                tracing_stats.count('truncated')
         # done
         return result_string
 
+    def truncate_array(self, arg):
+        """Apply the array size limit to a list or tuple: cut off the interior (or the tail). Return arg itself if it fits."""
+        if self.array_size_limit is None or len(arg) <= self.array_size_limit:
+            return arg
+        if self.array_tail_truncation:
+            return list(arg[:self.array_size_limit]) + ['...']
+        n1 = int((1 + self.array_size_limit) / 2)
+        n2 = n1 + len(arg) - self.array_size_limit
+        arg1 = list(arg[:n1])
+        arg2 = list(arg[n2:])
+        return arg1 + ['...'] + arg2
+
+    def truncate_string(self, s, limit=None, cut=0):
+        """Apply the string size limit (or given limit), the end is replaced by a marker with the number of characters cut off,
+        including those which were cut off before formatting (cut)."""
+        if limit is None:
+            limit = self.string_size_limit
+        if limit is None or (len(s) <= limit and not cut):
+            return s
+        num_characters_truncated = max(len(s) - limit, 0) + cut
+        last_part = '<{} characters truncated>'.format(num_characters_truncated)
+        last_idx = limit - len(last_part)
+        return s[:last_idx] + last_part
+
+    @staticmethod
+    def error_cut(record):
+        """Number of characters cut off the message of a traced exception before formatting (see patch_autologging.ErrorMessage)."""
+        if not isinstance(record.args, tuple):
+            return 0
+        return sum(arg.cut for arg in record.args if isinstance(arg, patch_autologging.ErrorMessage))
+
     def formatTime(self, record, datefmt=None):
         if datefmt is not None:
             return super().formatTime(record, datefmt)
@@ -277,3 +546,435 @@ class TraceFormatter(logging.Formatter):
         s = t_format % (t, fractional)
         return s
 
+
+class JsonTraceFormatter(TraceFormatter):
+    """Formatter for file_format='jsonl': one json object per record, with typed fields.
+
+    Arguments and return values are written as structured values (after array and string truncation),
+    values which are not plain json are written as their (truncated) repr."""
+    # optional record attributes -> json keys, as selected by the configuration (process_names, thread_names, etc.)
+    FIELDS = {'processName': 'pid', 'threadName': 'tid', 'taskName': 'task', 'perf_ns': 'perf_ns', 'duration_ns': 'duration_ns'}
+    MAX_DEPTH = 20 # nesting depth of structured values, deeper values are written as repr
+
+    def __init__(self, fields=(), **kwargs):
+        TraceFormatter.__init__(self, None, **kwargs)
+        self.fields = [(field, self.FIELDS[field]) for field in fields]
+
+    def format(self, record):
+        timer = tracing_stats.timer()
+        truncated = [] # marks, for the stats (the formatter is shared by threads)
+        d = {'time': record.created, 'level': record.levelname, 'file': record.filename, 'line': record.lineno, 'func': record.funcName}
+        for (field, key) in self.fields:
+            value = getattr(record, field, None)
+            if value is None and field == 'taskName':
+                value = current_task_name()
+            elif value is None and field == 'perf_ns': # only provided by the tracing proxy
+                value = tracing_stats.perf_counter_ns()
+            if value is not None:
+                d[key] = value
+        msg, args = record.msg, record.args
+        if msg == patch_autologging.CALL_MESSAGE:
+            d['type'] = 'call'
+            d['args'] = self.value(args[0], truncated)
+            d['kwargs'] = self.value(args[1], truncated)
+        elif msg == patch_autologging.RETURN_MESSAGE:
+            d['type'] = 'return'
+            if isinstance(args, tuple):
+                args = args[0] # otherwise a returned dict, which LogRecord unpacks
+            d['value'] = self.value(args, truncated)
+        elif msg == patch_autologging.RETURN_ERROR_MESSAGE:
+            d['type'] = 'return'
+            d['error'] = True
+        elif record.levelno == TRACE and isinstance(args, tuple) and len(args) == 2 and args[0] in (tracing_flow.FLOW_START, tracing_flow.FLOW_END):
+            d['type'] = 'flow_start' if args[0] == tracing_flow.FLOW_START else 'flow_end'
+            d['flow'] = args[1]
+        else:
+            d['type'] = 'event'
+            limit = self.error_size_limit if record.levelno >= logging.ERROR else None
+            d['message'] = self.string(record.getMessage(), truncated, limit, self.error_cut(record) if limit else 0)
+            if record.exc_info:
+                d['exception'] = self.string(self.formatException(record.exc_info), truncated, limit)
+        if truncated:
+            d['truncated'] = True
+        if timer:
+            timer.lap('arguments')
+        result_string = json.dumps(d, separators=(',', ':'))
+        if timer:
+            timer.lap('format')
+            tracing_stats.count('records')
+            if truncated:
+                tracing_stats.count('truncated')
+        return result_string
+
+    def value(self, v, truncated, depth=0):
+        """Json-compatible structured value, with array and string size limits applied. Truncations are marked in list truncated."""
+        if v is None or isinstance(v, (bool, int, float)):
+            return v
+        if isinstance(v, str):
+            return self.string(v, truncated)
+        if depth < self.MAX_DEPTH:
+            if isinstance(v, (list, tuple)):
+                result = self.truncate_array(v)
+                if result is not v:
+                    truncated.append(True)
+                return [self.value(x, truncated, depth + 1) for x in result]
+            if isinstance(v, dict):
+                return {self.string(str(k), truncated): self.value(x, truncated, depth + 1) for (k, x) in v.items()}
+        return self.string(repr(v), truncated)
+
+    def string(self, s, truncated, limit=None, cut=0):
+        result = self.truncate_string(s, limit, cut)
+        if result is not s:
+            truncated.append(True)
+        return result
+
+
+# handlers with thread buffers or a compressed stream, which need to be reset in a forked child process
+_forked_handlers = weakref.WeakSet()
+
+def _reset_handlers_after_fork():
+    for handler in list(_forked_handlers):
+        handler.reset_after_fork()
+        # multiprocessing children exit without logging.shutdown, so write what is pending in their exit function
+        # (a child clears the finalizers of its parent first, after which it runs the after-fork hooks)
+        if 'multiprocessing' in sys.modules:
+            import multiprocessing.util
+            multiprocessing.util.register_after_fork(handler, lambda h: multiprocessing.util.Finalize(h, h.flush_at_exit, exitpriority=0))
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_handlers_after_fork)
+
+def _add_forked_handler(handler):
+    _forked_handlers.add(handler)
+    if not hasattr(os, 'register_at_fork'):
+        # python2 has no fork hooks, only multiprocessing children are covered
+        import multiprocessing.util
+        multiprocessing.util.register_after_fork(handler, _reset_multiprocessing_child)
+
+def _reset_multiprocessing_child(handler):
+    handler.reset_after_fork()
+    import multiprocessing.util
+    multiprocessing.util.Finalize(handler, handler.flush_at_exit, exitpriority=0)
+
+
+class CompressedWriter(io.RawIOBase):
+    """Binary file stream which compresses into self-contained members (gzip) or frames (zstd).
+
+    The compressed data of a member is kept in memory until sync() ends it, then it is appended to the file with a single write.
+    So several processes can append to the same file, each with a writer of its own: their members never get interleaved.
+    Readers decompress the members one after the other (gzip and zstd both allow concatenation)."""
+    def __init__(self, filename, mode='a', compression='gzip'):
+        io.RawIOBase.__init__(self)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if 'w' in mode:
+            flags |= os.O_TRUNC
+        self.fd = os.open(filename, flags, 0o666)
+        self.compression = compression
+        self.compressor = None
+        self.pending = [] # compressed data of the current member
+        self.pending_size = 0
+        self.written = os.fstat(self.fd).st_size
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        if self.fd is None:
+            return len(data) # abandoned
+        if self.compressor is None:
+            if self.compression == 'gzip':
+                self.compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            else:
+                self.compressor = zstandard.ZstdCompressor().compressobj()
+        self._add(self.compressor.compress(memoryview(data).tobytes()))
+        return len(data)
+
+    def _add(self, compressed):
+        if compressed:
+            self.pending.append(compressed)
+            self.pending_size += len(compressed)
+
+    def sync(self):
+        """End the current member and append it to the file."""
+        if self.compressor is None or self.fd is None:
+            return
+        self._add(self.compressor.flush())
+        member = memoryview(b''.join(self.pending))
+        self.compressor = None
+        self.pending = []
+        self.pending_size = 0
+        self.written += len(member)
+        while len(member):
+            member = member[os.write(self.fd, member):]
+
+    def tell(self):
+        return self.written + self.pending_size
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.sync()
+        finally:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            io.RawIOBase.close(self)
+
+    def abandon(self):
+        """In a forked child: drop the pending member, the parent writes it."""
+        self.compressor = None
+        self.pending = []
+        self.pending_size = 0
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class TraceFileHandler(logging.FileHandler):
+    """File handler which can write the tracing file compressed (gzip, or zstd if available).
+
+    Compressed data is written in members (see CompressedWriter). Instead of flushing after each record (which would ruin
+    the compression ratio), a flush point ends the member at most every flush_interval seconds, after each
+    record of level ERROR or higher, and when COMPRESSED_MEMBER_SIZE bytes are pending. A crashed process therefore
+    still leaves a readable file. A forked child process appends members of its own.
+
+    With thread_buffer, each thread formats its records without taking the handler lock and collects the lines
+    in a thread-local buffer. The lock is only taken to write a full buffer as a single chunk. All buffers are
+    written at least every flush_interval seconds, after each record of level ERROR or higher, and at close.
+
+    With shared_memory, only this process writes the file: forked child processes pass their formatted lines
+    via shared memory, and a collector thread writes the lines of all processes in timestamp order (see tracing_transport)."""
+    terminator = '\n' # python2 StreamHandler has no terminator
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False, compression=DEFAULT_COMPRESSION, flush_interval=DEFAULT_FLUSH_INTERVAL, thread_buffer=DEFAULT_THREAD_BUFFER, shared_memory=DEFAULT_SHARED_MEMORY):
+        if compression is None:
+            compression = COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1])
+        if compression not in (None, 'gzip', 'zstd'):
+            raise Exception('unsupported compression {}'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise Exception('zstd compression requires the zstandard package')
+        self.compression = compression
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.header = None
+        self.raw = None
+        self.thread_buffer = thread_buffer
+        self.local = threading.local()
+        self.buffers = [] # (thread, lines) for each thread which has logged
+        self.transport = None
+        logging.FileHandler.__init__(self, filename, mode=mode, encoding=encoding, delay=delay)
+        if thread_buffer or compression:
+            _add_forked_handler(self)
+        if shared_memory:
+            import tracing_transport # deferred, it pulls in multiprocessing
+            self.transport = tracing_transport.Transport(self)
+
+    def _open(self):
+        if not self.compression:
+            return logging.FileHandler._open(self)
+        self.raw = CompressedWriter(self.baseFilename, self.mode, self.compression)
+        if sys.version_info < (3,):
+            return io.BufferedWriter(self.raw) # python2 writes str
+        return io.TextIOWrapper(self.raw, encoding=self.encoding)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+        if self.thread_buffer:
+            self.flush_buffers()
+        logging.FileHandler.close(self)
+        self.close_raw()
+
+    def close_raw(self):
+        if self.raw:
+            self.raw.close()
+            self.raw = None
+
+    def detach_stream(self):
+        """In a forked child: drop the inherited stream, without writing the data which the parent still has to write.
+        An uncompressed stream has nothing pending, the inherited compressed stream gets to write nothing at all."""
+        if self.raw:
+            self.raw.abandon()
+        self.stream = None
+        self.raw = None
+
+    def write_header(self, header):
+        """Write a header line, which is repeated at the start of each new segment in case of rotation."""
+        self.header = header
+        TraceFileHandler.write_chunk(self, header + self.terminator) # no rollover check
+        if self.compression:
+            self.sync() # the header goes first, before the members of forked children
+
+    def position(self):
+        """Number of bytes written to disk so far."""
+        if self.raw:
+            return self.raw.tell()
+        return self.stream.tell()
+
+    def emit(self, record):
+        if tracing_stats.STATS_ENABLED:
+            self.emit_chunk(record)
+        else:
+            logging.FileHandler.emit(self, record)
+        if self.compression and record.levelno >= logging.ERROR:
+            self.sync()
+
+    def emit_chunk(self, record):
+        # same as StreamHandler.emit, but writes via write_chunk, which is instrumented
+        try:
+            line = self.format(record) + self.terminator
+            TraceFileHandler.write_chunk(self, line) # rollover is checked by the caller
+            if self.compression:
+                self.flush()
+        except _RAISED_ERRORS:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def handleError(self, record):
+        tracing_stats.count('dropped')
+        logging.FileHandler.handleError(self, record)
+
+    def handle(self, record):
+        if not self.thread_buffer and not self.transport:
+            return logging.FileHandler.handle(self, record)
+        # buffered or transported: no handler lock, only when writing a chunk
+        if not self.filter(record):
+            return False
+        try:
+            line = self.format(record) + self.terminator
+        except Exception:
+            self.handleError(record)
+            return True
+        if self.transport:
+            if not self.transport.put(record.created, line):
+                tracing_stats.count('dropped')
+            return True
+        lines = self.thread_lines()
+        lines.append(line)
+        if record.levelno >= logging.ERROR or record.created - self.last_flush >= self.flush_interval:
+            self.flush_buffers()
+            self.sync()
+        elif len(lines) >= self.thread_buffer:
+            with self.lock:
+                self.write_lines(lines)
+        return True
+
+    def thread_lines(self):
+        try:
+            return self.local.lines
+        except AttributeError:
+            lines = self.local.lines = []
+            with self.lock:
+                self.buffers.append((threading.current_thread(), lines))
+            return lines
+
+    def write_lines(self, lines):
+        # caller holds the lock; the owning thread may append meanwhile, so only remove what is written
+        n = len(lines)
+        if n == 0:
+            return
+        chunk = ''.join(lines[:n])
+        del lines[:n]
+        self.write_chunk(chunk)
+
+    def write_chunk(self, chunk):
+        timer = tracing_stats.timer()
+        if self.stream is None:
+            self.stream = self._open()
+        self.stream.write(chunk)
+        if not self.compression:
+            # nothing may stay behind in the stream buffer, a forked child would write it again
+            self.stream.flush()
+        elif self.raw.pending_size >= COMPRESSED_MEMBER_SIZE:
+            self.sync()
+        if timer:
+            timer.lap('write')
+            tracing_stats.count('bytes', len(chunk))
+
+    def flush_buffers(self):
+        """Write the buffered lines of all threads, and forget the buffers of finished threads."""
+        with self.lock:
+            for (thread, lines) in self.buffers:
+                self.write_lines(lines)
+            self.buffers = [(thread, lines) for (thread, lines) in self.buffers if thread.is_alive()]
+
+    def reset_buffers(self):
+        # in a forked child: the buffered lines are written by the parent process
+        self.local = threading.local()
+        self.buffers = []
+
+    def reset_after_fork(self):
+        if self.thread_buffer:
+            self.reset_buffers()
+        if self.compression and not self.transport:
+            # the pending member is written by the parent, the child appends members of its own (reopened on its first write)
+            self.detach_stream()
+
+    def flush_at_exit(self):
+        if self.thread_buffer:
+            self.flush_buffers()
+        if self.compression and not self.transport:
+            self.sync()
+
+    def flush(self):
+        # called by StreamHandler after each record, and at shutdown
+        if self.thread_buffer:
+            self.flush_buffers()
+        if not self.compression:
+            return logging.FileHandler.flush(self)
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.sync()
+
+    def sync(self):
+        """Write a flush point, all data so far can be decompressed."""
+        with self.lock:
+            self.last_flush = time.time()
+            logging.FileHandler.flush(self)
+            if self.raw:
+                self.raw.sync()
+
+
+class RotatingTraceFileHandler(TraceFileHandler):
+    """Tracing file handler which starts a new segment when the file exceeds max_bytes, or after max_age seconds.
+
+    Older segments are shifted: name.1.log is the previous segment, up to name.<segments-1>.log.
+    Each segment starts with the format header, ttviewer can stitch a set of segments back together."""
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, segments=DEFAULT_SEGMENTS, **kwargs):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segments = segments
+        self.opened = time.time()
+        TraceFileHandler.__init__(self, filename, **kwargs)
+
+    def _open(self):
+        self.opened = time.time()
+        return TraceFileHandler._open(self)
+
+    def emit(self, record):
+        if self.stream and self.should_rollover():
+            self.rollover()
+        TraceFileHandler.emit(self, record)
+
+    def write_chunk(self, chunk):
+        if self.stream and self.should_rollover():
+            self.rollover()
+        TraceFileHandler.write_chunk(self, chunk)
+
+    def should_rollover(self):
+        if self.max_age is not None and time.time() - self.opened >= self.max_age:
+            return True
+        return self.max_bytes is not None and self.position() >= self.max_bytes
+
+    def rollover(self):
+        self.stream.close()
+        self.stream = None
+        self.close_raw()
+        rotate_segments(self.baseFilename, self.segments)
+        self.stream = self._open()
+        if self.header:
+            self.write_header(self.header)
+        self.stream.write(LOGFILE_CONTINUED_MARK + self.terminator)
@@ -6,64 +6,362 @@ Ideally, this is solved directy in autologging, see:
 __author__ = 'Jan Feitsma'
 
 
+import sys
 import logging
 import autologging
-from inspect import isgenerator
+from functools import wraps
+from inspect import isgenerator, isgeneratorfunction
+import tracing_control
+import tracing_metrics
+import tracing_stats
+if sys.version_info >= (3, 5):
+    from inspect import iscoroutinefunction
+    from patch_autologging_async import CoroutineTracing
+else:
+    iscoroutinefunction = lambda function: False
+    class CoroutineTracing(): # python2 has no coroutines
+        pass
 
 
 ERROR_HANDLING_ENABLED = True
+MONOTONIC_TIMING_ENABLED = False
+GENERATOR_SPANS_ENABLED = True # one span per generator, instead of autologging's record per yield
+GENERATOR_SAMPLE = None # in span mode, log every n-th yield (starting with the first), None logs no yields
+ERROR_SIZE_LIMIT = None # characters of the ERROR message which are kept, the formatter marks the rest as truncated
+
+# tracing record messages, the arguments are kept in the record (see extendedlogging.JsonTraceFormatter)
+CALL_MESSAGE = "CALL *%r **%r"
+RETURN_MESSAGE = "RETURN %r"
+RETURN_ERROR_MESSAGE = "RETURN ERROR"
+YIELD_MESSAGE = "YIELD #%d %r"
 
 
 class original_FunctionTracingProxy(autologging._FunctionTracingProxy):
     pass
 
-class patched_FunctionTracingProxy(autologging._FunctionTracingProxy):
+class patched_FunctionTracingProxy(CoroutineTracing, autologging._FunctionTracingProxy):
+    def __init__(self, function, logger):
+        super(patched_FunctionTracingProxy, self).__init__(function, logger)
+        self._coroutine = iscoroutinefunction(function)
+        self._generator = isgeneratorfunction(function)
+        self._metrics_name = tracing_control.callable_name(function)
+
     def __call__(self, function, args, keywords):
-        def _handle(level, msg, args):
-            # try to make pretty function name (python version >= 3.3)
-            fname = function.__name__
-            if hasattr(function, '__qualname__'):
-                fname = function.__qualname__
-            # wrapper around logger.handle, reducing code duplication
-            self._logger.handle(logging.LogRecord(
-                self._logger.name,   # name
-                level,               # level
-                self._func_filename, # pathname
-                self._func_lineno,   # lineno
-                msg,                 # msg
-                args,                # args
-                None,                # exc_info
-                func=fname))
-
-        _handle(autologging.TRACE, "CALL *%r **%r", (args, keywords))
-
-        if ERROR_HANDLING_ENABLED:
-            try:
-                value = function(*args, **keywords)
-            except Exception as e:
-                # tag the exception, to prevent it being logged at each level in the stack
-                if not hasattr(e, 'logged') or not e.logged:
-                    _handle(logging.ERROR, "%s", str(e))
-                e.logged = True
-                _handle(autologging.TRACE, "RETURN ERROR", None)
-                raise
-        else:
+        if self._coroutine:
+            # not awaited here: the span covers the lifetime of the coroutine, from its first to its last step
+            return self._call_coroutine(function, args, keywords)
+        if self._generator and GENERATOR_SPANS_ENABLED:
+            # nothing runs yet: the span starts at the first next
+            return GeneratorSpanProxy(self, function, function(*args, **keywords), args, keywords)
+        t_start = self._call(function, args, keywords)
+        t_metrics = self._metrics_start()
+        try:
             value = function(*args, **keywords)
-
-        _handle(autologging.TRACE, "RETURN %r", (value,))
+        except Exception as e:
+            self._metrics_stop(t_metrics, True)
+            self._error(function, e, t_start)
+            raise
+        self._metrics_stop(t_metrics)
+        self._return(function, value, t_start)
 
         return (autologging._GeneratorIteratorTracingProxy(function, value, self._logger)
                 if isgenerator(value) else value)
 
     __call__.__doc__ = original_FunctionTracingProxy.__call__.__doc__
 
+    def measure(self, function, args, keywords):
+        """Call without tracing, only record metrics (see tracing_metrics)."""
+        if self._coroutine:
+            return self._measure_coroutine(function, args, keywords)
+        t_start = tracing_stats.perf_counter_ns()
+        try:
+            value = function(*args, **keywords)
+        except Exception:
+            tracing_metrics.record(self._metrics_name, tracing_stats.perf_counter_ns() - t_start, True)
+            raise
+        tracing_metrics.record(self._metrics_name, tracing_stats.perf_counter_ns() - t_start)
+        return value
+
+    @staticmethod
+    def _metrics_start():
+        # metrics time the function only, not the logging of its CALL record
+        if tracing_metrics.METRICS_ENABLED:
+            return tracing_stats.perf_counter_ns()
+        return None
+
+    def _metrics_stop(self, t_start, error=False):
+        if t_start is not None:
+            tracing_metrics.record(self._metrics_name, tracing_stats.perf_counter_ns() - t_start, error)
+
+    def _call(self, function, args, keywords):
+        # optional monotonic high-resolution timing, independent of wall clock adjustments and timestamp resolution
+        if MONOTONIC_TIMING_ENABLED:
+            t_start = tracing_stats.perf_counter_ns()
+            self._handle(function, autologging.TRACE, CALL_MESSAGE, (args, keywords), {'perf_ns': t_start})
+            return t_start
+        self._handle(function, autologging.TRACE, CALL_MESSAGE, (args, keywords))
+        return None
+
+    def _return(self, function, value, t_start):
+        self._handle(function, autologging.TRACE, RETURN_MESSAGE, (value,), self._timing(t_start))
+
+    def _error(self, function, e, t_start):
+        if not ERROR_HANDLING_ENABLED:
+            return
+        timing = self._timing(t_start)
+        # the ERROR is logged once, at the innermost traced frame
+        if not reported(e):
+            self._handle(function, logging.ERROR, "%s", (ErrorMessage(e),))
+        self._handle(function, autologging.TRACE, RETURN_ERROR_MESSAGE, None, timing)
+
+    @staticmethod
+    def _timing(t_start):
+        if t_start is None:
+            return None
+        t = tracing_stats.perf_counter_ns()
+        return {'perf_ns': t, 'duration_ns': t - t_start}
+
+    def _handle(self, function, level, msg, args, extra=None):
+        # try to make pretty function name (python version >= 3.3)
+        fname = function.__name__
+        if hasattr(function, '__qualname__'):
+            fname = function.__qualname__
+        # wrapper around logger.handle, reducing code duplication
+        timer = tracing_stats.timer()
+        record = logging.LogRecord(
+            self._logger.name,   # name
+            level,               # level
+            self._func_filename, # pathname
+            self._func_lineno,   # lineno
+            msg,                 # msg
+            args,                # args
+            None,                # exc_info
+            func=fname)
+        if extra:
+            record.__dict__.update(extra)
+        if timer:
+            timer.lap('record')
+        self._logger.handle(record)
+
+
+
+# exceptions are logged (ERROR record) by the innermost traced frame they pass: code object -> tracing_control entry (None: always)
+_reporting_codes = {}
+
+def register_reporting_code(code, entry=None):
+    """Register the code of a frame which logs the exceptions passing through it, if its entry is enabled."""
+    _reporting_codes[code] = entry
+
+def reported(exception):
+    """Return whether given exception, caught in the current traced frame, has been logged already by an inner traced frame.
+    The traceback tells which frames the exception passed, so the exception itself is not tagged: that would fail for
+    exceptions with __slots__, and built-in exceptions do not support weak references either."""
+    tb = getattr(exception, '__traceback__', None)
+    if tb is None and sys.version_info < (3,):
+        tb = sys.exc_info()[2] # python2: the exception being handled
+    if tb is not None:
+        tb = tb.tb_next # the current frame
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        if code in _reporting_codes:
+            entry = _reporting_codes[code]
+            if entry is None or entry.enabled:
+                return True
+        tb = tb.tb_next
+    return False
+
+
+class ErrorMessage():
+    """Message of an ERROR record: str() of the exception, computed when the record is first formatted, then shared by all handlers.
+    It is cut at the error size limit right away, so the formatting steps only handle the part which is kept;
+    the number of characters cut off is kept for the truncation marker of the formatter.
+    An exception which fails to convert does not break the traced program."""
+    __slots__ = ('exception', 'message', 'cut')
+
+    def __init__(self, exception):
+        self.exception = exception
+        self.message = None
+        self.cut = 0
+
+    def __str__(self):
+        if self.message is None:
+            try:
+                self.message = str(self.exception)
+            except Exception:
+                self.message = '<unprintable {} object>'.format(type(self.exception).__name__)
+            self.exception = None
+            if ERROR_SIZE_LIMIT is not None and len(self.message) > ERROR_SIZE_LIMIT:
+                self.cut = len(self.message) - ERROR_SIZE_LIMIT
+                self.message = self.message[:ERROR_SIZE_LIMIT]
+        return self.message
+
 
+class GeneratorSpanProxy(object):
+    """Proxy a generator iterator, traced as a single span: CALL at the first next (or send), RETURN when it is exhausted,
+    closed or garbage collected. The RETURN value summarizes the number of yields and the active time (ns spent in the generator),
+    plus the return value of the generator, if any. Yields are only logged when sampled (GENERATOR_SAMPLE).
+    Like coroutines, generators which are consumed in an interleaved fashion (zip of two traced generators) do not nest:
+    the viewer draws the one which ends first on a lane of its own (see ttvlib.ttstore.TracingStore)."""
+    __autologging_traced__ = True
+
+    def __init__(self, proxy, function, giter, args, keywords):
+        self._proxy = proxy
+        self._function = function
+        self._giter = giter
+        self._args = (args, keywords)
+        self._t_start = None
+        self._started = False
+        self._finished = False
+        self._yields = 0
+        self._active_ns = 0
+
+    @property
+    def __wrapped__(self):
+        return self._giter
+
+    @property
+    def __name__(self):
+        return self._giter.__name__
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._step(lambda: next(self._giter))
+    next = __next__ # python2
+
+    def send(self, value):
+        return self._step(self._giter.send, value)
+
+    def throw(self, *args):
+        return self._step(self._giter.throw, *args)
+
+    def close(self):
+        self._giter.close()
+        if self._started and not self._finished:
+            self._finish(None, closed=True)
+
+    def __del__(self):
+        # abandoned before exhaustion, for example a break out of a for loop
+        if self._started and not self._finished:
+            try:
+                self._finish(None, closed=True)
+            except Exception:
+                pass # interpreter shutdown
+
+    def _step(self, method, *args):
+        if self._finished:
+            return method(*args)
+        if not self._started:
+            self._started = True
+            self._t_start = self._proxy._call(self._function, *self._args)
+        t = tracing_stats.perf_counter_ns()
+        try:
+            value = method(*args)
+        except StopIteration as e:
+            self._active_ns += tracing_stats.perf_counter_ns() - t
+            self._finish(getattr(e, 'value', None)) # python2: no generator return value
+            raise
+        except Exception as e:
+            self._active_ns += tracing_stats.perf_counter_ns() - t
+            self._finished = True
+            self._proxy._error(self._function, e, self._t_start)
+            raise
+        self._active_ns += tracing_stats.perf_counter_ns() - t
+        self._yields += 1
+        if GENERATOR_SAMPLE and (self._yields - 1) % GENERATOR_SAMPLE == 0:
+            self._proxy._handle(self._function, autologging.TRACE, YIELD_MESSAGE, (self._yields, value))
+        return value
+
+    def _finish(self, value, closed=False):
+        self._finished = True
+        summary = {'yields': self._yields, 'active_ns': self._active_ns}
+        if closed:
+            summary['closed'] = True
+        if value is not None:
+            summary['value'] = value
+        self._proxy._return(self._function, summary, self._t_start)
+
+
+# delegators: same as autologging, but registered in tracing_control, so tracing can be switched per callable
+# the per-callable flag is checked first, a disabled callable costs just the delegator call
+# (plus the metrics flag check: with metrics enabled, calls which are not traced are still measured)
+
+def _finish_delegator(delegator, proxy, function):
+    delegator._tracing_proxy = proxy
+    delegator.__wrapped__ = function
+    delegator.__autologging_traced__ = True
+    return delegator
+
+def patched_make_traceable_function(function, logger):
+    entry = tracing_control.register(function)
+    proxy = autologging._FunctionTracingProxy(function, logger)
+    @wraps(function)
+    def autologging_traced_function_delegator(*args, **keywords):
+        if entry.enabled and logger.isEnabledFor(autologging.TRACE):
+            return proxy(function, args, keywords)
+        if tracing_metrics.METRICS_ENABLED:
+            return proxy.measure(function, args, keywords)
+        return function(*args, **keywords)
+    return _finish_delegator(autologging_traced_function_delegator, proxy, function)
+
+def patched_make_traceable_instancemethod(unbound_function, logger):
+    entry = tracing_control.register(unbound_function)
+    proxy = autologging._FunctionTracingProxy(unbound_function, logger)
+    @wraps(unbound_function)
+    def autologging_traced_instancemethod_delegator(self_, *args, **keywords):
+        if entry.enabled and logger.isEnabledFor(autologging.TRACE):
+            return proxy(unbound_function.__get__(self_, self_.__class__), args, keywords)
+        if tracing_metrics.METRICS_ENABLED:
+            return proxy.measure(unbound_function.__get__(self_, self_.__class__), args, keywords)
+        return unbound_function(self_, *args, **keywords)
+    return _finish_delegator(autologging_traced_instancemethod_delegator, proxy, unbound_function)
+
+def patched_make_traceable_classmethod(method_descriptor, logger):
+    function = method_descriptor.__func__
+    entry = tracing_control.register(function)
+    proxy = autologging._FunctionTracingProxy(function, logger)
+    @wraps(function)
+    def autologging_traced_classmethod_delegator(cls, *args, **keywords):
+        if entry.enabled and logger.isEnabledFor(autologging.TRACE):
+            return proxy(method_descriptor.__get__(None, cls), args, keywords)
+        if tracing_metrics.METRICS_ENABLED:
+            return proxy.measure(method_descriptor.__get__(None, cls), args, keywords)
+        return function(cls, *args, **keywords)
+    return classmethod(_finish_delegator(autologging_traced_classmethod_delegator, proxy, function))
+
+
+
+# the proxy frames which log exceptions
+for _code in (patched_FunctionTracingProxy.__call__.__code__, GeneratorSpanProxy._step.__code__):
+    register_reporting_code(_code)
+if hasattr(CoroutineTracing, '_call_coroutine'):
+    register_reporting_code(CoroutineTracing._call_coroutine.__code__)
 
 # apply the patch always, to enable runtime (re)configuration
 autologging._FunctionTracingProxy = patched_FunctionTracingProxy
+autologging._make_traceable_function = patched_make_traceable_function
+autologging._make_traceable_instancemethod = patched_make_traceable_instancemethod
+autologging._make_traceable_classmethod = patched_make_traceable_classmethod
 
 def set_error_handling(b):
     """Enable or disable the error handling feature."""
     global ERROR_HANDLING_ENABLED
     ERROR_HANDLING_ENABLED = b
 
+def set_error_size_limit(limit):
+    """Set the number of characters of ERROR messages which are kept, None keeps all (see ErrorMessage)."""
+    global ERROR_SIZE_LIMIT
+    ERROR_SIZE_LIMIT = limit
+
+def set_monotonic_timing(b):
+    """Enable or disable monotonic timing: perf_ns and duration_ns attributes on CALL/RETURN records."""
+    global MONOTONIC_TIMING_ENABLED
+    MONOTONIC_TIMING_ENABLED = b
+
+def set_generator_spans(b, sample=None):
+    """Trace generators as one span each (see GeneratorSpanProxy), with optionally every sample-th yield logged.
+    When disabled, autologging logs every yield."""
+    global GENERATOR_SPANS_ENABLED, GENERATOR_SAMPLE
+    GENERATOR_SPANS_ENABLED = b
+    GENERATOR_SAMPLE = sample
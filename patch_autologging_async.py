@@ -0,0 +1,33 @@
+"""Coroutine support of the autologging patch (see patch_autologging), in a module of its own as python2 cannot parse it."""
+__author__ = 'Jan Feitsma'
+
+
+import tracing_metrics
+import tracing_stats
+
+
+class CoroutineTracing():
+    """Mixin of the patched tracing proxy: coroutine functions are traced and measured by awaiting them in a coroutine of its own."""
+
+    async def _call_coroutine(self, function, args, keywords):
+        t_start = self._call(function, args, keywords)
+        t_metrics = self._metrics_start()
+        try:
+            value = await function(*args, **keywords)
+        except Exception as e:
+            self._metrics_stop(t_metrics, True)
+            self._error(function, e, t_start)
+            raise
+        self._metrics_stop(t_metrics)
+        self._return(function, value, t_start)
+        return value
+
+    async def _measure_coroutine(self, function, args, keywords):
+        t_start = tracing_stats.perf_counter_ns()
+        try:
+            value = await function(*args, **keywords)
+        except Exception:
+            tracing_metrics.record(self._metrics_name, tracing_stats.perf_counter_ns() - t_start, True)
+            raise
+        tracing_metrics.record(self._metrics_name, tracing_stats.perf_counter_ns() - t_start)
+        return value
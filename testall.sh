@@ -7,6 +7,16 @@ echo python3 tests/test_extendedlogging.py
 python3 tests/test_extendedlogging.py
 echo python2 tests/test_extendedlogging.py
 python2 tests/test_extendedlogging.py
+echo python3 tests/test_extendedlogging_py3.py
+python3 tests/test_extendedlogging_py3.py
+
+# trace analysis tools, only python3 supported
+echo python3 tests/test_ttprofile.py
+python3 tests/test_ttprofile.py
+echo python3 tests/test_ttconvert.py
+python3 tests/test_ttconvert.py
+echo python3 tests/test_ttgenerate.py
+python3 tests/test_ttgenerate.py
 
 # this one is very slow due to HTML rendering tests; only python3 supported
 echo python3 tests/test_ttviewer.py
@@ -1,5 +1,6 @@
 # system imports
 import sys
+import json
 import os
 import shutil
 import time
@@ -9,6 +10,7 @@ import threading
 # own imports
 import testcase
 import extendedlogging
+import tracing_control
 
 # constants
 TMP_FOLDER = '/tmp/test_extendedlogging'
@@ -18,7 +20,49 @@ PATH_TO_DEMOS = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..',
 
 
 
-class TestExtendedLogging(testcase.TestCase):
+class ExtendedLoggingTestCase(testcase.TestCase):
+    '''Helpers of the extendedlogging tests, shared with the python3-only tests (see test_extendedlogging_py3).'''
+
+    def setUp(self):
+        extendedlogging.remove_all_handlers()
+        # wipe temp folder
+        folder = TMP_FOLDER
+        self.folder = folder
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        os.mkdir(self.folder)
+        # configure logger
+        self._configure()
+
+    def _configure(self, **kwargs):
+        extendedlogging.configure(filename=LOG_FILE, **kwargs)
+
+    def tearDown(self):
+        extendedlogging.remove_all_handlers()
+
+    def _compare_logfile(self, expected, *args, **kwargs):
+        # close the log file
+        extendedlogging.remove_all_handlers()
+        self._compare(LOG_FILE, expected, *args, **kwargs)
+
+    def _compare_logfile_linecount(self, expected_linecount):
+        # close the log file
+        extendedlogging.remove_all_handlers()
+        actual_linecount = len(open(LOG_FILE, 'r').readlines())
+        self.assertEqual(actual_linecount, expected_linecount)
+
+    def _get_logfile_max_linesize(self, strip=True):
+        # close the log file
+        extendedlogging.remove_all_handlers()
+        result = 0
+        for line in open(LOG_FILE, 'r').readlines():
+            if strip:
+                line = line.strip()
+            result = max(result, len(line))
+        return result
+
+
+class TestExtendedLogging(ExtendedLoggingTestCase):
 
     def test_logging_info_default(self):
         '''Default configuration shall be to log INFO events, only to console (not file), no timestamps.'''
@@ -241,6 +285,53 @@ TRACE:recurse: RETURN ERROR
         # verify
         self._compare_logfile(expected_content)
 
+    def test_trace_error_handling_exceptions(self):
+        '''Exceptions are logged once, untouched: also those which reject attributes or fail to convert; ERROR lines have their own size limit.'''
+        # setup
+        self._configure(tracing=True, file_format='%(levelname)s:%(message)s', error_size_limit=3000)
+        class FrozenException(Exception):
+            def __setattr__(self, name, value):
+                raise AttributeError(name)
+        class UnprintableException(Exception):
+            def __str__(self):
+                raise RuntimeError('no')
+        @extendedlogging.traced
+        def f(e, depth):
+            if depth:
+                return f(e, depth - 1)
+            raise e
+        # run
+        for e in [FrozenException('frozen'), UnprintableException(), ValueError('x' * 5000)]:
+            with self.assertRaises(type(e)):
+                f(e, 2)
+        extendedlogging.remove_all_handlers()
+        # verify
+        errors = [line.rstrip('\n') for line in open(LOG_FILE) if line.startswith('ERROR:')]
+        self.assertEqual(errors[:2], ['ERROR:frozen', 'ERROR:<unprintable UnprintableException object>'])
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len(errors[2]), 3000)
+        self.assertTrue(errors[2].endswith('<2006 characters truncated>'))
+        self.assertEqual(sum(line.startswith('TRACE:RETURN ERROR') for line in open(LOG_FILE)), 9)
+
+    def test_error_message_cut(self):
+        '''The message of a traced exception is cut at the error size limit before formatting, the marker counts all characters cut off.'''
+        # setup
+        self._configure(tracing=True, file_format='%(message)s', error_size_limit=3000, console_level=extendedlogging.CRITICAL)
+        @extendedlogging.traced
+        def f():
+            raise ValueError('x' * 5000)
+        # run
+        with self.assertRaises(ValueError):
+            f()
+        extendedlogging.remove_all_handlers()
+        # verify
+        errors = [line.rstrip('\n') for line in open(LOG_FILE) if line.startswith('x')]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(errors[0]), 3000)
+        self.assertTrue(errors[0].endswith('x<2000 characters truncated>'))
+        message = extendedlogging.patch_autologging.ErrorMessage(ValueError('x' * 5000))
+        self.assertEqual((len(str(message)), message.cut), (3000, 2000))
+
     def test_multithreading(self):
         '''When multiple threads are active, then trace events are logged with their name.'''
         expected_content = """# format: %(levelname)s:%(threadName)s:%(funcName)s: %(message)s
@@ -278,45 +369,284 @@ TRACE:Thread-2:run: RETURN None
         self.assertTrue(r != 0) # expected exception, ignore
         self._compare(extendedlogging.DEFAULT_LOG_FILE, expected_content)
 
-    # helper functions below
-
-    def setUp(self):
+    def test_compressed_tracing_processes(self):
+        '''Forked child processes append compressed members of their own, after the header of the parent.'''
+        import gzip
+        import multiprocessing
+        # setup
+        logfile = LOG_FILE + '.gz'
+        extendedlogging.configure(filename=logfile, tracing=True, process_names=True)
+        @extendedlogging.traced
+        def f(x):
+            return x
+        def work():
+            for it in range(50):
+                f(it)
+        processes = [multiprocessing.Process(target=work, name='P{}'.format(it)) for it in range(3)]
+        # run
+        f(-1)
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
         extendedlogging.remove_all_handlers()
-        # wipe temp folder
-        folder = TMP_FOLDER
-        self.folder = folder
-        if os.path.isdir(self.folder):
-            shutil.rmtree(self.folder)
-        os.mkdir(self.folder)
-        # configure logger
-        self._configure()
-
-    def _configure(self, **kwargs):
-        extendedlogging.configure(filename=LOG_FILE, **kwargs)
-
-    def tearDown(self):
+        # verify
+        lines = gzip.open(logfile).read().decode('utf-8').splitlines()
+        self.assertTrue(lines[0].startswith('# format: '))
+        self.assertEqual(len(lines), 1 + 2 + 3 * 100)
+        for it in range(3):
+            self.assertEqual(len([line for line in lines if ':P{}:'.format(it) in line]), 100)
+
+    def test_rotating_tracing(self):
+        '''Tracing file rotation: segments are limited in size and number, each starts with the format header, a restart keeps history.'''
+        # setup
+        self._configure(tracing=True, max_bytes=2000, segments=3)
+        # run
+        @extendedlogging.traced
+        def f(x):
+            return x
+        for it in range(100):
+            f(it)
+        extendedlogging.remove_all_handlers()
+        # verify
+        segments = [extendedlogging.segment_filename(LOG_FILE, idx) for idx in range(3)]
+        self.assertEqual(sorted(os.listdir(TMP_FOLDER)), sorted(os.path.basename(f) for f in segments))
+        for segment in segments:
+            lines = open(segment).readlines()
+            self.assertTrue(lines[0].startswith('# format: '))
+            self.assertLess(os.path.getsize(segment), 2000 + len(lines[-1]))
+        # restart: current file becomes the previous segment
+        content = open(segments[0]).read()
+        self._configure(tracing=True, max_bytes=2000, segments=3)
         extendedlogging.remove_all_handlers()
+        self.assertEqual(open(segments[1]).read(), content)
 
-    def _compare_logfile(self, expected, *args, **kwargs):
-        # close the log file
+    def test_thread_buffer(self):
+        '''Thread buffers: lines are written per chunk, interleaved per thread, and all are written at close.'''
+        # setup
+        self._configure(tracing=True, thread_buffer=16, file_format='%(threadName)s:%(message)s')
+        @extendedlogging.traced
+        def f(x):
+            return x
+        def work():
+            for it in range(50):
+                f(it)
+        threads = [threading.Thread(target=work, name='worker{}'.format(it)) for it in range(4)]
+        # run
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        f(-1) # main thread, only buffered
         extendedlogging.remove_all_handlers()
-        self._compare(LOG_FILE, expected, *args, **kwargs)
+        # verify: complete, the order per thread is kept
+        lines = open(LOG_FILE).read().splitlines()
+        self.assertEqual(len(lines), 1 + 4 * 100 + 2)
+        for it in range(4):
+            thread_lines = [line for line in lines if line.startswith('worker{}:'.format(it))]
+            self.assertEqual(thread_lines[:2], ['worker{}:CALL *(0,) **{{}}'.format(it), 'worker{}:RETURN 0'.format(it)])
+            self.assertEqual(thread_lines[-1], 'worker{}:RETURN 49'.format(it))
+        self.assertEqual(lines[-1], 'MainThread:RETURN -1')
+
+    def test_metrics(self):
+        '''Metrics: call counts and latency percentiles per traced callable, merged over threads, without tracing to file.'''
+        import json
+        # setup
+        metrics_file = os.path.join(TMP_FOLDER, 'metrics.jsonl')
+        self._configure(tracing=False, metrics=True, metrics_file=metrics_file, metrics_interval=0.05)
+        @extendedlogging.traced
+        def f(x):
+            if x < 0:
+                raise ValueError('negative')
+            time.sleep(0.001 * x)
+        def work():
+            for x in [1, 1, 1, 10]:
+                f(x)
+        threads = [threading.Thread(target=work, name='worker{}'.format(it)) for it in range(3)]
+        # run
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        extendedlogging.disable_tracing('*') # calls which are not traced are measured too
+        with self.assertRaises(ValueError):
+            f(-1)
+        tracing_control.get().clear_rules()
+        time.sleep(0.2)
+        result = extendedlogging.metrics('*.f', reset=True)
+        # verify
+        self.assertFalse(os.path.isfile(LOG_FILE))
+        self.assertEqual(len(result), 1)
+        (name, m) = list(result.items())[0]
+        qualname = 'f' if sys.version_info[0] < 3 else 'TestExtendedLogging.test_metrics.<locals>.f' # python2 has no __qualname__
+        self.assertEqual(name, __name__ + '.' + qualname)
+        self.assertEqual((m['calls'], m['errors']), (13, 1))
+        self.assertLess(m['min'], 0.001)
+        self.assertTrue(0.001 <= m['p50'] < 0.002)
+        self.assertTrue(0.010 <= m['p90'] <= m['p99'] <= m['max'])
+        self.assertEqual(extendedlogging.metrics(), {})
+        snapshots = [json.loads(line) for line in open(metrics_file)]
+        self.assertGreater(len(snapshots), 1)
+        self.assertEqual(list(snapshots[-1]['metrics'].values())[0]['calls'], 13)
+
+    def test_stats(self):
+        '''Self-instrumentation: time per phase, records, bytes written, truncated and dropped records.'''
+        import logging
+        # setup
+        self._configure(tracing=True, stats=True, array_size_limit=3, string_size_limit=200)
+        @extendedlogging.traced
+        def f(x):
+            return len(x)
+        # run
+        f([1, 2])
+        f(list(range(10))) # array truncated
+        f('x' * 1000) # string truncated
+        raise_exceptions = logging.raiseExceptions
+        logging.raiseExceptions = False
+        try:
+            extendedlogging.info('%d', 'not a number') # dropped
+        finally:
+            logging.raiseExceptions = raise_exceptions
+        result = extendedlogging.stats()
+        extendedlogging.remove_all_handlers()
+        # verify
+        self.assertEqual(result['records'], 6)
+        self.assertEqual(result['bytes'], os.path.getsize(LOG_FILE))
+        self.assertEqual(result['truncated'], 2)
+        self.assertEqual(result['dropped'], 1)
+        for phase in ['record', 'arguments', 'format', 'fold', 'write']:
+            self.assertGreater(result['phases'][phase]['total'], 0.0)
+        self.assertEqual(result['phases']['record']['calls'], 6)
+        self.assertEqual(result['phases']['write']['calls'], 6)
+        self.assertGreater(result['time'], result['per_record'])
+        self.assertTrue(extendedlogging.tracing_stats.summary().startswith('extendedlogging overhead: 6 records'))
+
+    def test_levels_records(self):
+        '''Levels also apply to the records which are not tracing records, by module and function of their origin.'''
+        # setup
+        def f():
+            extendedlogging.info('dropped')
+            extendedlogging.warning('kept')
+        def g():
+            extendedlogging.debug('dropped')
+            extendedlogging.info('kept')
+        self._configure(tracing=True, file_format='%(levelname)s:%(funcName)s:%(message)s', console_level=extendedlogging.ERROR, levels={__name__: 'WARNING', __name__ + '.g': 'INFO'})
+        # run
+        f()
+        g()
+        extendedlogging.info('dropped')
+        # verify
+        expected_content = """WARNING:f:kept
+INFO:g:kept
+"""
+        self._compare_logfile(expected_content)
 
-    def _compare_logfile_linecount(self, expected_linecount):
-        # close the log file
+    def test_generator_span(self):
+        '''A traced generator is one span, also under python2: a CALL at the first next, a RETURN with the yield count when exhausted or closed.'''
+        # setup
+        self._configure(tracing=True, file_format='%(levelname)s:%(message)s', console_level=extendedlogging.ERROR)
+        @extendedlogging.traced
+        def g(n):
+            for it in range(n):
+                yield it
+        # run
+        self.assertEqual(list(g(3)), [0, 1, 2])
+        for x in g(3):
+            break
         extendedlogging.remove_all_handlers()
-        actual_linecount = len(open(LOG_FILE, 'r').readlines())
-        self.assertEqual(actual_linecount, expected_linecount)
+        # verify
+        lines = open(LOG_FILE).read().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].endswith('CALL *(3,) **{}'))
+        self.assertIn("RETURN {", lines[1])
+        self.assertIn("'yields': 3", lines[1])
+        self.assertNotIn("'closed'", lines[1])
+        self.assertIn("'yields': 1", lines[3])
+        self.assertIn("'closed': True", lines[3])
+
+    def test_flow_records(self):
+        '''Flow records are logged on thread start and by flow_start/flow_end, attributed to their caller, also under python2.'''
+        # setup
+        self._configure(tracing=True, flows=True, thread_names=True, file_format='%(levelname)s:%(threadName)s:%(funcName)s:%(message)s', console_level=extendedlogging.ERROR)
+        # run
+        thread = threading.Thread(target=lambda: None, name='worker')
+        thread.start()
+        thread.join()
+        flow_id = extendedlogging.flow_start()
+        extendedlogging.flow_end(flow_id)
+        extendedlogging.remove_all_handlers()
+        # verify
+        lines = open(LOG_FILE).read().splitlines()[1:] # skip the format header
+        self.assertEqual(len(lines), 4)
+        thread_flow_id = lines[0].split()[-1]
+        self.assertEqual(lines[0], 'TRACE:MainThread:patched_start:FLOW_START ' + thread_flow_id)
+        self.assertEqual(lines[1], 'TRACE:worker:__call__:FLOW_END ' + thread_flow_id)
+        self.assertEqual(lines[2], 'TRACE:MainThread:test_flow_records:FLOW_START ' + flow_id)
+        self.assertEqual(lines[3], 'TRACE:MainThread:test_flow_records:FLOW_END ' + flow_id)
+
+    def test_registry_cleanup(self):
+        '''Registry entries of traced callables are dropped along with the callable, repeated decoration does not grow the registry.'''
+        # setup
+        import gc
+        self._configure(tracing=True)
+        def make():
+            @extendedlogging.traced
+            def f():
+                pass
+            return f
+        # run
+        functions = [make() for it in range(100)]
+        pattern = '*.make.<locals>.f' if sys.version_info >= (3,) else '*.f'
+        self.assertEqual(len(extendedlogging.traced_callables(pattern)), 100)
+        del functions
+        gc.collect()
+        # verify
+        self.assertEqual(len(extendedlogging.traced_callables(pattern)), 0)
 
-    def _get_logfile_max_linesize(self, strip=True):
-        # close the log file
+    @unittest.skipIf(sys.version_info >= (3, 8), 'shared memory transport is supported')
+    def test_shared_memory_unsupported(self):
+        '''Before python 3.8, the shared memory transport is refused with a clear error, instead of failing in the handler.'''
+        with self.assertRaises(Exception) as context:
+            self._configure(tracing=True, shared_memory=True)
+        self.assertIn('python 3.8', str(context.exception))
+
+    def test_incremental_reconfigure(self):
+        '''Reconfiguration with the same tracing file only updates the changed levels and formatters, the handlers are kept.'''
+        # setup
+        logger = extendedlogging.configure(filename=LOG_FILE, tracing=True, file_format='%(levelname)s:%(message)s', console_level=extendedlogging.ERROR)
+        handlers = extendedlogging.getLogger().handlers[:]
+        logger.info('first')
+        # run
+        extendedlogging.configure(filename=LOG_FILE, tracing=True, file_format='%(levelname)s:%(message)s', console_level=extendedlogging.ERROR, file_level=extendedlogging.WARNING)
+        logger.info('dropped')
+        logger.warning('second')
+        self.assertEqual(extendedlogging.getLogger().handlers, handlers)
+        self.assertEqual(handlers[1].level, extendedlogging.WARNING)
+        # another filename requires a new handler
+        extendedlogging.configure(filename=LOG_FILE + '.2', tracing=True, console_level=extendedlogging.ERROR)
+        self.assertNotEqual(extendedlogging.getLogger().handlers[1], handlers[1])
+        # verify
+        expected_content = """INFO:first
+WARNING:second
+"""
+        self._compare(LOG_FILE, expected_content)
+
+    def test_reconfigure_format(self):
+        '''A format change in a continued tracing file writes the new format header, also when switching back to the default format.'''
+        # run
+        self._configure(tracing=True, thread_names=True, console_level=extendedlogging.ERROR)
+        extendedlogging.info('first')
+        self._configure(tracing=True, console_level=extendedlogging.ERROR)
+        extendedlogging.info('second')
         extendedlogging.remove_all_handlers()
-        result = 0
-        for line in open(LOG_FILE, 'r').readlines():
-            if strip:
-                line = line.strip()
-            result = max(result, len(line))
-        return result
+        # verify
+        lines = open(LOG_FILE).read().splitlines()
+        default_format = extendedlogging.FileConfiguration().format
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith(extendedlogging.LOGFILE_FORMAT_SPEC) and 'threadName' in lines[0])
+        self.assertIn(':MainThread:', lines[1])
+        self.assertEqual(lines[2], extendedlogging.LOGFILE_FORMAT_SPEC + default_format)
+        self.assertTrue(lines[3].endswith(':second'))
 
 
 
@@ -0,0 +1,406 @@
+# python3-only tests of extendedlogging: language features python2 cannot parse, or checks via the trace analysis tools (ttvlib)
+
+# system imports
+import json
+import os
+import re
+import sys
+import time
+import unittest
+import threading
+
+# own imports
+import extendedlogging
+import ttvlib.ttparse as ttparse
+import ttvlib.ttstore
+import tracing_engine
+import tracing_control
+from test_extendedlogging import ExtendedLoggingTestCase, LOG_FILE, TMP_FOLDER
+
+
+
+
+class TestExtendedLoggingPy3(ExtendedLoggingTestCase):
+
+    def test_compressed_tracing(self):
+        '''Tracing file can be written gzip-compressed, with a flush point after each error, so a crashed process leaves a readable file.'''
+        # setup
+        logfile = LOG_FILE + '.gz'
+        extendedlogging.configure(filename=logfile, tracing=True, flush_interval=3600)
+        # run
+        @extendedlogging.traced
+        def f(x):
+            return x
+        for it in range(100):
+            f(it)
+        extendedlogging.error('oops')
+        # verify, while still open
+        lines = list(ttparse.read_lines(logfile))
+        self.assertEqual(len(lines), 201)
+        self.assertIn(':ERROR:', lines[-1])
+        # verify compression after close
+        extendedlogging.remove_all_handlers()
+        self.assertEqual(len(list(ttparse.read_lines(logfile))), 201)
+        self.assertLess(os.path.getsize(logfile), len(''.join(lines)) / 5)
+
+    def test_shared_memory(self):
+        '''Shared memory transport: only the parent writes, the records of forked children are complete and in timestamp order.'''
+        import multiprocessing
+        # setup
+        self._configure(tracing=True, shared_memory=True, string_size_limit=100000)
+        transport = extendedlogging.logging.root.handlers[-1].transport
+        transport.ring_size = 4096 # smaller than the long line
+        @extendedlogging.traced
+        def f(x):
+            return 'x' * x
+        def work():
+            for it in range(50):
+                f(10000 if it == 25 else it)
+        processes = [multiprocessing.get_context('fork').Process(target=work, name='P{}'.format(it)) for it in range(3)]
+        # run
+        for p in processes:
+            p.start()
+        f(0)
+        for p in processes:
+            p.join()
+        extendedlogging.remove_all_handlers()
+        # verify: complete lines of each process, timestamps in order, rings freed
+        lines = open(LOG_FILE).read().splitlines()
+        self.assertTrue(lines[0].startswith('# format: '))
+        self.assertEqual(len(lines), 1 + 3 * 100 + 2)
+        timestamps = [line[:26] for line in lines[1:]]
+        self.assertEqual(timestamps, sorted(timestamps))
+        store = ttvlib.ttstore.TracingStore()
+        items = []
+        store.handle_duration = lambda start, end: items.append((start.pid, end.data))
+        ttparse.parse_into(LOG_FILE, store, ttparse.parser_for(LOG_FILE))
+        for it in range(3):
+            results = [data for (pid, data) in items if pid == 'P{}'.format(it)]
+            self.assertEqual(len(results), 50)
+            self.assertIn(repr('x' * 10000), results)
+        self.assertEqual(transport.rings, [])
+
+    def test_shared_memory_unstarted_ring(self):
+        '''The ring of a child which never announces its process id (fork failed, child died early) is freed after start_timeout.'''
+        from multiprocessing import shared_memory
+        # setup
+        self._configure(tracing=True, shared_memory=True)
+        transport = extendedlogging.logging.root.handlers[-1].transport
+        transport.start_timeout = 0.1
+        # run: the fork hooks, without a child
+        transport.before_fork()
+        ring = transport.rings[-1]
+        transport.after_fork_in_parent()
+        time.sleep(0.3)
+        # verify
+        self.assertEqual(transport.rings, [])
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=ring.name)
+
+    def test_asyncio_tasks(self):
+        '''Coroutines are traced over their awaited lifetime, each asyncio task gets its own lane.'''
+        import asyncio
+        # setup
+        self._configure(tracing=True, task_names=True)
+        @extendedlogging.traced
+        async def f(x):
+            await asyncio.sleep(0.02 * x)
+            return x
+        async def main():
+            return await asyncio.gather(asyncio.create_task(f(2), name='A'), asyncio.create_task(f(1), name='B'))
+        # run
+        self.assertEqual(asyncio.run(main()), [2, 1])
+        extendedlogging.remove_all_handlers()
+        # verify: interleaved calls on one thread, B returns before A
+        store = ttvlib.ttstore.TracingStore()
+        items = []
+        store.handle_duration = lambda start, end: items.append((start.tid, end.data, end.timestamp - start.timestamp))
+        ttparse.parse_into(LOG_FILE, store, ttparse.LoggingParser())
+        self.assertEqual([item[:2] for item in items], [('B', '1'), ('A', '2')])
+        self.assertGreater(items[1][2], 0.03)
+
+    def test_generator_spans(self):
+        '''A traced generator is one span, from first next to exhaustion or close, with the yield count; yields are logged only when sampled.'''
+        # setup
+        self._configure(tracing=True, file_format='%(levelname)s:%(funcName)s: %(message)s', generator_sample=2)
+        @extendedlogging.traced
+        def g(n):
+            for it in range(n):
+                yield it
+            return 'done'
+        @extendedlogging.traced
+        def f(x):
+            return x
+        # run
+        self.assertEqual([f(x) for x in g(3)], [0, 1, 2])
+        for x in g(3):
+            break
+        # verify
+        expected_content = r"""TRACE:.*g: CALL \*\(3,\) \*\*{}
+TRACE:.*g: YIELD #1 0
+TRACE:.*f: CALL \*\(0,\) \*\*{}
+TRACE:.*f: RETURN 0
+TRACE:.*f: CALL \*\(1,\) \*\*{}
+TRACE:.*f: RETURN 1
+TRACE:.*g: YIELD #3 2
+TRACE:.*f: CALL \*\(2,\) \*\*{}
+TRACE:.*f: RETURN 2
+TRACE:.*g: RETURN {'yields': 3, 'active_ns': \d+, 'value': 'done'}
+TRACE:.*g: CALL \*\(3,\) \*\*{}
+TRACE:.*g: YIELD #1 0
+TRACE:.*g: RETURN {'yields': 1, 'active_ns': \d+, 'closed': True}
+"""
+        self._compare_logfile(expected_content, regex=True)
+        # autologging mode: a record per yield
+        self._configure(tracing=True, generator_spans=False)
+        list(g(3))
+        extendedlogging.remove_all_handlers()
+        self.assertEqual(sum(':YIELD ' in line for line in open(LOG_FILE)), 3)
+
+    def test_flows(self):
+        '''Flow events link the start of a thread or an executor job to the code which runs it.'''
+        import concurrent.futures
+        # setup
+        self._configure(tracing=True, flows=True, thread_names=True)
+        @extendedlogging.traced
+        def f(x):
+            return x
+        @extendedlogging.traced
+        def main():
+            thread = threading.Thread(target=f, args=(1,), name='worker')
+            thread.start()
+            thread.join()
+            with concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='pool') as executor:
+                return executor.submit(f, 2).result()
+        # run
+        self.assertEqual(main(), 2)
+        flow_id = extendedlogging.flow_start()
+        extendedlogging.flow_end(flow_id)
+        extendedlogging.remove_all_handlers()
+        # verify: each flow starts in main and ends in the thread which calls f next
+        store = ttvlib.ttstore.TracingStore()
+        flows = []
+        store.handle_flow_item = lambda item: flows.append((item.type, item.flow_id, item.tid))
+        ttparse.parse_into(LOG_FILE, store, ttparse.LoggingParser())
+        starts = {flow_id: tid for (t, flow_id, tid) in flows if t == 's'}
+        links = [(starts[flow_id], tid) for (t, flow_id, tid) in flows if t == 'f']
+        # the executor also starts its worker thread
+        self.assertEqual(links, [('MainThread', 'worker'), ('MainThread', 'pool_0'), ('MainThread', 'pool_0'), ('MainThread', 'MainThread')])
+
+    def test_tracing_engine(self):
+        '''The low-overhead tracing engine writes the same trace lines as the autologging proxies, without wrapping.'''
+        # setup
+        self._configure(tracing=True, file_format='%(levelname)s:%(message)s')
+        engine = tracing_engine.ENGINE
+        tracing_engine.ENGINE = 'monitor'
+        try:
+            @extendedlogging.traced
+            class myclass():
+                def __init__(self, a):
+                    self.a = a
+                def f(self, x, *args, y=2, **kwargs):
+                    if x < 0:
+                        raise ValueError('negative')
+                    return self.a + x + y
+            @extendedlogging.traced
+            def g(x):
+                return myclass(1).f(x, 5, z=3)
+        finally:
+            tracing_engine.ENGINE = engine
+        # run
+        self.assertFalse(hasattr(g, '__wrapped__'))
+        g(1)
+        try:
+            g(-1)
+        except ValueError:
+            pass
+        # verify
+        expected_content = """TRACE:CALL *(1,) **{}
+TRACE:CALL *(1,) **{}
+TRACE:RETURN None
+TRACE:CALL *(1, 5) **{'y': 2, 'z': 3}
+TRACE:RETURN 4
+TRACE:RETURN 4
+TRACE:CALL *(-1,) **{}
+TRACE:CALL *(1,) **{}
+TRACE:RETURN None
+TRACE:CALL *(-1, 5) **{'y': 2, 'z': 3}
+"""
+        if isinstance(tracing_engine.get_engine(), tracing_engine.MonitoringEngine):
+            expected_content += """ERROR:negative
+"""
+        expected_content += """TRACE:RETURN ERROR
+TRACE:RETURN ERROR
+"""
+        self._compare_logfile(expected_content)
+
+    @unittest.skipUnless(hasattr(sys, 'monitoring'), 'sys.monitoring requires python 3.12')
+    def test_tracing_engine_tool_ids(self):
+        '''The monitoring engine claims the first free tool id, and falls back to setprofile when other tools took them all.'''
+        # setup: other tools take all ids
+        engine, option = tracing_engine._engine, tracing_engine.ENGINE
+        taken = [tool for tool in tracing_engine.MONITORING_TOOL_IDS if sys.monitoring.get_tool(tool) is None]
+        for tool in taken:
+            sys.monitoring.use_tool_id(tool, 'other')
+        try:
+            # run
+            tracing_engine._engine, tracing_engine.ENGINE = None, 'monitor'
+            fallback = tracing_engine.get_engine()
+            sys.monitoring.free_tool_id(taken[-1])
+            tool = tracing_engine.MonitoringEngine.claim_tool_id()
+        finally:
+            tracing_engine._engine, tracing_engine.ENGINE = engine, option
+            for tool_id in taken:
+                sys.monitoring.free_tool_id(tool_id)
+        # verify
+        self.assertIsInstance(fallback, tracing_engine.ProfileEngine)
+        self.assertEqual(tool, taken[-1])
+
+    def test_runtime_control(self):
+        '''Tracing can be switched per callable at runtime, by name pattern, optionally temporarily, or via a trigger file.'''
+        # setup
+        self._configure(tracing=True, file_format='%(funcName)s:%(message)s')
+        @extendedlogging.traced
+        def f():
+            pass
+        @extendedlogging.traced
+        class myclass():
+            def g(self):
+                f()
+        # run
+        try:
+            extendedlogging.disable_tracing('*.test_runtime_control.*')
+            myclass().g() # not traced
+            extendedlogging.enable_tracing('*.myclass.*', duration=0.2)
+            self.assertEqual([entry.enabled for entry in extendedlogging.traced_callables('*.test_runtime_control.*')], [False, True])
+            myclass().g() # only g traced
+            time.sleep(0.3)
+            myclass().g() # not traced
+            triggerfile = os.path.join(TMP_FOLDER, 'trigger')
+            with open(triggerfile, 'w') as fh:
+                fh.write('enable *.f # comment\n')
+            tracing_control.apply_trigger_file(triggerfile)
+            myclass().g() # only f traced
+        finally:
+            tracing_control.get().clear_rules()
+        # verify
+        expected_content = """TestExtendedLoggingPy3.test_runtime_control.<locals>.myclass.g:CALL *() **{}
+TestExtendedLoggingPy3.test_runtime_control.<locals>.myclass.g:RETURN None
+TestExtendedLoggingPy3.test_runtime_control.<locals>.f:CALL *() **{}
+TestExtendedLoggingPy3.test_runtime_control.<locals>.f:RETURN None
+"""
+        self._compare_logfile(expected_content)
+
+    def test_levels(self):
+        '''Levels per module, class or function: tracing is disabled above TRACE, the most specific name wins.'''
+        # setup
+        @extendedlogging.traced
+        def f():
+            pass
+        @extendedlogging.traced
+        class myclass():
+            def g(self):
+                f()
+            def h(self):
+                pass
+        scope = __name__ + '.TestExtendedLoggingPy3.test_levels.<locals>'
+        self._configure(tracing=True, file_format='%(funcName)s:%(message)s', levels={scope: 'INFO', scope + '.myclass.g': extendedlogging.TRACE})
+        # run
+        c = myclass()
+        c.g()
+        c.h()
+        # verify
+        expected_content = """TestExtendedLoggingPy3.test_levels.<locals>.myclass.g:CALL *() **{}
+TestExtendedLoggingPy3.test_levels.<locals>.myclass.g:RETURN None
+"""
+        self._compare_logfile(expected_content)
+        # reconfiguration resets the levels
+        self._configure(tracing=True)
+        self.assertTrue(all(entry.enabled for entry in extendedlogging.traced_callables(scope + '.*')))
+
+    def test_monotonic_timing(self):
+        '''Monotonic timing: CALL/RETURN lines get nanosecond perf counter values, RETURN lines also the duration; parser uses these for span widths.'''
+        # setup
+        self._configure(tracing=True, monotonic_timing=True)
+        # run
+        @extendedlogging.traced
+        def f():
+            pass
+        @extendedlogging.traced
+        def g():
+            f()
+            extendedlogging.info('between')
+            f()
+        g()
+        # verify
+        t = r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{6}'
+        header = re.escape('# format: %(asctime)s:%(levelname)s:%(perf_ns)s:%(duration_ns)s:%(filename)s,%(lineno)d:%(funcName)s:%(message)s')
+        expected_content = r"""{header}
+{t}:TRACE:\d+:-:test_extendedlogging_py3.py,\d+:.*g:CALL .*
+{t}:TRACE:\d+:-:test_extendedlogging_py3.py,\d+:.*f:CALL .*
+{t}:TRACE:\d+:\d+:test_extendedlogging_py3.py,\d+:.*f:RETURN None
+{t}:INFO:\d+:-:test_extendedlogging_py3.py,\d+:g:between
+{t}:TRACE:\d+:-:test_extendedlogging_py3.py,\d+:.*f:CALL .*
+{t}:TRACE:\d+:\d+:test_extendedlogging_py3.py,\d+:.*f:RETURN None
+{t}:TRACE:\d+:\d+:test_extendedlogging_py3.py,\d+:.*g:RETURN None
+""".replace('{t}', t).replace('{header}', header)
+        self._compare_logfile(expected_content, regex=True)
+        # parsed timestamps are strictly increasing, span widths equal the logged durations
+        store = ttvlib.ttstore.TracingStore()
+        items = []
+        store.handle_duration = lambda start, end: items.append((start, end))
+        ttparse.parse_into(LOG_FILE, store, ttparse.LoggingParser())
+        self.assertEqual(len(items), 3)
+        for (start, end) in items:
+            self.assertTrue(start.monotonic and end.monotonic)
+            self.assertGreater(end.timestamp, start.timestamp)
+            self.assertAlmostEqual(end.timestamp - start.timestamp, end.duration, delta=1e-6) # float seconds since epoch: sub-microsecond precision
+
+    def test_jsonl_format(self):
+        '''Structured tracing: one json object per line, with arguments as json values; parsed back by the json lines parser.'''
+        # setup
+        logfile = os.path.join(TMP_FOLDER, 'logfile.jsonl')
+        extendedlogging.configure(filename=logfile, tracing=True, file_format='jsonl', thread_names=True, monotonic_timing=True)
+        # run
+        @extendedlogging.traced
+        def f(x, y=None):
+            return {'n': len(x)}
+        @extendedlogging.traced
+        def g():
+            raise ValueError('oops')
+        f(list(range(1000)), y='abc')
+        extendedlogging.info('between')
+        try:
+            g()
+        except ValueError:
+            pass
+        extendedlogging.remove_all_handlers()
+        # verify lines
+        lines = [json.loads(line) for line in ttparse.read_lines(logfile)]
+        self.assertEqual([d['type'] for d in lines], ['call', 'return', 'event', 'call', 'event', 'return'])
+        self.assertTrue(lines[0]['func'].endswith('f'))
+        self.assertEqual(lines[0]['tid'], 'MainThread')
+        self.assertEqual(lines[0]['args'][0][:3], [0, 1, 2])
+        self.assertTrue(lines[0]['truncated'])
+        self.assertEqual(lines[0]['kwargs'], {'y': 'abc'})
+        self.assertEqual(lines[1]['value'], {'n': 1000})
+        self.assertIsInstance(lines[1]['duration_ns'], int)
+        self.assertEqual(lines[2]['message'], 'between')
+        self.assertTrue(lines[5]['error'])
+        # verify parsing
+        self.assertIsInstance(ttparse.parser_for(logfile), ttparse.JsonLinesParser)
+        store = ttvlib.ttstore.TracingStore()
+        items = []
+        store.handle_duration = lambda start, end: items.append((start, end))
+        ttparse.parse_into(logfile, store, ttparse.parser_for(logfile))
+        self.assertEqual([start.name.split('.')[-1] for (start, end) in items], ['f', 'g'])
+        self.assertEqual(items[0][1].data, {'n': 1000})
+        self.assertEqual(items[1][1].data, 'ERROR')
+        self.assertTrue(all(start.monotonic and end.tid == 'MainThread' for (start, end) in items))
+
+
+
+
+if __name__ == '__main__':
+    # buffering is required for stdout checks
+    unittest.main(buffer=True, exit=False)
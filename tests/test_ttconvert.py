@@ -0,0 +1,273 @@
+
+# system imports
+import os
+import sys
+import gzip
+import json
+import base64
+import shutil
+import unittest
+import zipfile
+import subprocess
+
+# own imports
+import testcase
+import ttvlib.ttconvert
+import ttvlib.ttconvert.runner as runner
+import ttvlib.ttconvert.standard as standard
+import ttvlib.ttparse as ttparse
+import ttvlib.ttstore
+import ttvlib.ttcolumnar as ttcolumnar
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from perfetto.protos.perfetto.trace import perfetto_trace_pb2
+except ImportError:
+    perfetto_trace_pb2 = None
+
+# constants
+TMP_FOLDER = '/tmp/test_ttconvert'
+BASEDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+
+class TestTTConvert(testcase.TestCase):
+
+    def test_collapsed_stacks(self):
+        '''Flamegraph output: self time in microseconds per unique stack.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        outputfile = self._export(logfile, 'fib.collapsed')
+        lines = open(outputfile).read().splitlines()
+        self.assertEqual(len(lines), 7) # recursion depth of fib(7)
+        self.assertEqual(lines[0], 'fib 201')
+        self.assertTrue(lines[-1].startswith('fib;fib;fib;fib;fib;fib;fib '))
+        # total self time equals the duration of the outer call
+        self.assertEqual(sum(int(line.split()[-1]) for line in lines), 3310)
+
+    def test_collapsed_stacks_no_store_limit(self):
+        '''The stacks are aggregated, so the store limit of the viewer does not apply.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        limit = ttvlib.ttstore.STORE_LIMIT
+        ttvlib.ttstore.STORE_LIMIT = 10
+        try:
+            outputfile = self._export(logfile, 'fib.collapsed')
+        finally:
+            ttvlib.ttstore.STORE_LIMIT = limit
+        self.assertEqual(len(open(outputfile).read().splitlines()), 7)
+
+    def test_collapsed_stacks_lanes(self):
+        '''Processes and threads become the root frames.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_multiprocessing.log')
+        outputfile = self._export(logfile, 'mp.folded')
+        lines = open(outputfile).read().splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(lines[0], 'MainProcess;MainThread;main 106409')
+
+    def test_perfetto(self):
+        '''Perfetto protobuf output: a stream of packets, with interned names, much smaller than json.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        outputfile = self._export(logfile, 'fib.pftrace')
+        data = open(outputfile, 'rb').read()
+        # top-level: repeated field 1 (packet), length-delimited
+        numpackets = 0
+        idx = 0
+        while idx < len(data):
+            self.assertEqual(data[idx], 0x0a)
+            idx += 1
+            length, shift = 0, 0
+            while True:
+                b = data[idx]
+                idx += 1
+                length |= (b & 0x7f) << shift
+                shift += 7
+                if b < 0x80:
+                    break
+            idx += length
+            numpackets += 1
+        self.assertEqual(idx, len(data))
+        self.assertEqual(numpackets, 3 + 82) # process, thread, clock snapshot + one packet per line
+        self.assertEqual(data.count(b'fib\x1a'), 1) # interned once, followed by the next interned field
+        self.assertLess(len(data), os.path.getsize(logfile))
+
+    @unittest.skipUnless(perfetto_trace_pb2, 'perfetto protos not installed')
+    def test_perfetto_decode(self):
+        '''Perfetto protobuf output can be decoded with the official protos, delta timestamps add up.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_multiprocessing.log')
+        outputfile = self._export(logfile, 'mp.perfetto-trace')
+        trace = perfetto_trace_pb2.Trace()
+        trace.ParseFromString(open(outputfile, 'rb').read())
+        threads = [p.track_descriptor.thread.thread_name for p in trace.packet if p.HasField('track_descriptor') and p.track_descriptor.HasField('thread')]
+        self.assertEqual(len(threads), 10)
+        events = [p for p in trace.packet if p.HasField('track_event')]
+        self.assertEqual(len(events), 20)
+        # last RETURN of main, relative to first CALL of main
+        t = 0
+        for p in events:
+            if p.HasField('timestamp_clock_id'):
+                continue # absolute, out of order
+            t += p.timestamp
+        self.assertEqual(t, 221831 - 115422)
+
+    def test_columnar(self):
+        '''Columnar output: an npz file with span and event columns and string tables, written without numpy.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_events.log')
+        outputfile = self._export(logfile, 'events.npz')
+        names = zipfile.ZipFile(outputfile).namelist()
+        for name in list(ttcolumnar.SPAN_COLUMNS) + list(ttcolumnar.EVENT_COLUMNS):
+            self.assertIn(name + '.npy', names)
+        # string tables are utf-8 bytes plus offsets
+        for name in ttcolumnar.STRING_TABLES:
+            self.assertIn(name + '_utf8.npy', names)
+            self.assertIn(name + '_offsets.npy', names)
+        data = zipfile.ZipFile(outputfile).read('messages_utf8.npy')
+        self.assertIn(b"'descr': '|u1'", data)
+        self.assertTrue(data.endswith(b'hi!__init__ donedone'))
+
+    @unittest.skipUnless(numpy, 'numpy not installed')
+    def test_columnar_load(self):
+        '''Columnar output loads as numpy arrays: integer microseconds, interned names, nesting depth.'''
+        columns = ttcolumnar.load(self._export(os.path.join(BASEDIR, 'tests', 'demo_fib.log'), 'fib.npz'))
+        self.assertEqual(len(columns['span_start_us']), 41)
+        self.assertEqual(columns['span_start_us'].dtype, numpy.int64)
+        self.assertEqual(list(columns['functions']), ['fib'])
+        outer = columns['span_depth'] == 0
+        self.assertEqual(list(columns['span_duration_us'][outer]), [3310])
+        self.assertEqual(columns['span_depth'].max(), 6)
+        columns = ttcolumnar.load(self._export(os.path.join(BASEDIR, 'tests', 'demo_events.log'), 'events.npz'))
+        self.assertEqual(list(columns['levels'][columns['event_level']]), ['INFO', 'DEBUG', 'WARNING'])
+        self.assertEqual(columns['messages'][columns['event_message'][0]], 'hi!')
+        # non-ascii and long messages
+        logfile = os.path.join(self.folder, 'messages.log')
+        with open(logfile, 'w', encoding='utf-8') as f:
+            f.write('2022-05-08 10:27:12,727564:INFO:demo.py,10:f:caf\u00e9\n')
+            f.write('2022-05-08 10:27:12,727565:INFO:demo.py,10:f:' + 'x' * 100000 + '\n')
+        columns = ttcolumnar.load(self._export(logfile, 'messages.npz'))
+        self.assertEqual(list(columns['messages'][columns['event_message']]), ['caf\u00e9', 'x' * 100000])
+
+    @unittest.skipUnless(numpy, 'numpy not installed')
+    def test_bulk_parser(self):
+        '''The bulk parser gives the same items as the per-line parser; odd lines take the per-line path.'''
+        logfile = os.path.join(self.folder, 'odd.log')
+        lines = open(os.path.join(BASEDIR, 'tests', 'demo_events.log')).readlines()
+        lines += [
+            "2020-09-13 12:26:40,000005:TRACE:a.py,1:f:CALL *('a:b',) **{}\n", # separator in message, cut off as by the regexes
+            '2020-09-13 12:26:40,000006:INFO:a.py,2:f:h\u00e9llo\n', # non-ascii
+            '2020-09-13 12:26:40,007:INFO:a.py,2:f:millisecond resolution\n',
+            '2020-02-29 12:26:40,000008:INFO:a.py,2:f:FLOW_START 12\n',
+            '2020-09-13 12:26:40,000010:TRACE:a.py,1:f:RETURN ERROR\n',
+            '# a comment\n',
+            '1969-12-31 23:59:59,999999:WARNING:a.py,2:f:before epoch\n',
+        ]
+        with open(logfile, 'w') as f:
+            f.writelines(lines)
+        def parse(parser):
+            items = []
+            store = ttvlib.ttstore.TracingStore()
+            store.add = lambda item: items.append(item.__dict__)
+            ttparse.parse_into(logfile, store, parser)
+            return items
+        expected = parse(ttparse.LoggingParser())
+        self.assertEqual(len(expected), 15)
+        self.assertEqual(parse(ttparse.BulkLoggingParser()), expected)
+        ttparse.BULK_LINES, bulk_lines = 3, ttparse.BULK_LINES # batch boundaries
+        try:
+            self.assertEqual(parse(ttparse.BulkLoggingParser()), expected)
+        finally:
+            ttparse.BULK_LINES = bulk_lines
+        # all but the odd lines are parsed in bulk
+        results = ttparse.BulkLoggingParser().parse_lines([line.strip() for line in lines if not line.startswith('#')])
+        self.assertEqual(sum(isinstance(r, str) for r in results), 2) # non-ascii, millisecond resolution
+
+    def test_builtin_html(self):
+        '''The built-in html viewer embeds the json gzip-compressed and base64-encoded, no external tool needed.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        htmlfile = os.path.join(self.folder, 'ttviewer.html')
+        r = runner.Runner(self.folder, [logfile], htmlfile, 100.0)
+        r.run()
+        html = open(htmlfile).read()
+        self.assertNotIn(standard.HTML_TEMPLATE_PLACEHOLDER, html)
+        b64 = html.split('<script id="trace-data" type="application/octet-stream">')[1].split('</script>')[0]
+        embedded = gzip.decompress(base64.b64decode(b64))
+        jsonfile = os.path.join(self.folder, 'demo_fib.log.json')
+        self.assertEqual(embedded, open(jsonfile, 'rb').read())
+        self.assertEqual(len(json.loads(embedded)), 82)
+
+    def test_builtin_html_chunks(self):
+        '''Streaming in chunks gives the same result as a single pass.'''
+        jsonfile = os.path.join(self.folder, 'large.json')
+        with open(jsonfile, 'w') as f:
+            f.write(json.dumps([{'name': 'f{}'.format(i), 'ph': 'i', 'ts': i} for i in range(2000)]))
+        chunk_size = standard.HTML_CHUNK_SIZE
+        try:
+            standard.HTML_CHUNK_SIZE = 3 * 100
+            standard._convert_json2html_builtin(jsonfile, os.path.join(self.folder, 'chunked.html'))
+        finally:
+            standard.HTML_CHUNK_SIZE = chunk_size
+        html = open(os.path.join(self.folder, 'chunked.html')).read()
+        b64 = html.split('<script id="trace-data" type="application/octet-stream">')[1].split('</script>')[0]
+        self.assertEqual(gzip.decompress(base64.b64decode(b64)), open(jsonfile, 'rb').read())
+
+    def test_compressed_input(self):
+        '''Gzip-compressed log files are converted transparently, also when truncated by a crash.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        lines = open(logfile, 'rb').readlines()
+        gzfile = os.path.join(self.folder, 'demo_fib.log.gz')
+        with open(gzfile, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.writelines(lines[:40])
+                f.flush() # flush point, as written by extendedlogging
+                f.writelines(lines[40:])
+                raw.flush()
+                truncated = raw.tell()
+        jsonfile = self._export(gzfile, 'fib.json')
+        self.assertEqual(open(jsonfile).read(), open(self._export(logfile, 'plain.json')).read())
+        # crashed process: no trailer, only the data up to the flush point is readable
+        with open(gzfile, 'r+b') as f:
+            f.truncate(truncated)
+        self.assertEqual(list(ttparse.read_lines(gzfile)), [line.decode() for line in lines[:40]])
+
+    def test_rotated_segments(self):
+        '''A set of rotated segments is converted as one log: calls which span a segment boundary are not auto-closed.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        lines = open(logfile).readlines()
+        header = ttparse.LOGFILE_FORMAT_SPEC + ttparse.DEFAULT_FORMAT_SPEC + '\n'
+        segments = [os.path.join(self.folder, name) for name in ['fib.2.log', 'fib.1.log', 'fib.log']]
+        for (idx, segment) in enumerate(segments):
+            with open(segment, 'w') as f:
+                f.writelines([header] + lines[idx * 30:(idx + 1) * 30])
+        self.assertEqual(ttparse.group_segments(list(reversed(segments)) + [logfile]), [segments, [logfile]])
+        jsonfile = self._export(segments[0], 'fib1.json') # single segment, truncated
+        self.assertIn('UNCLOSED', open(jsonfile).read())
+        r = runner.Runner(self.folder, segments, None, 100.0)
+        r.export(os.path.join(self.folder, 'fib.json'))
+        self.assertEqual(open(os.path.join(self.folder, 'fib.json')).read(), open(self._export(logfile, 'plain.json')).read())
+
+    def test_deferred_imports(self):
+        '''Importing the parser does not load the converter plug-ins, these are loaded on first use of the registry.'''
+        code = 'import sys, ttvlib.ttparse; print("ttvlib.ttconvert" in sys.modules); '
+        code += 'import ttvlib.ttconvert.registry as r; r.get(); print("ttvlib.ttconvert.standard" in sys.modules)'
+        environ = dict(os.environ, PYTHONPATH=BASEDIR)
+        output = subprocess.run([sys.executable, '-c', code], env=environ, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertEqual(output.split(), ['False', 'True'])
+
+    # helper functions below
+
+    def setUp(self):
+        self.folder = TMP_FOLDER
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        os.mkdir(self.folder)
+
+    def _export(self, inputfile, outputname):
+        outputfile = os.path.join(self.folder, outputname)
+        r = runner.Runner(self.folder, [inputfile], None, 100.0)
+        r.export(outputfile)
+        self.assertTrue(os.path.isfile(outputfile))
+        return outputfile
+
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+
+# system imports
+import os
+import io
+import gzip
+import shutil
+import unittest
+
+# own imports
+import testcase
+import ttvlib.ttgenerate as ttgenerate
+import ttvlib.ttparse as ttparse
+import ttvlib.ttprofile as ttprofile
+import ttvlib.ttstore as ttstore
+
+# constants
+TMP_FOLDER = '/tmp/test_ttgenerate'
+
+
+class TestTTGenerate(testcase.TestCase):
+
+    def test_format_variants(self):
+        '''Each format variant is written with its header and parsed back, all calls matched.'''
+        for (name, format_spec) in ttgenerate.FORMATS.items():
+            threads = 1 if name in ('default', 'monotonic') else 3
+            logfile = os.path.join(self.folder, name + '.log')
+            count = ttgenerate.write(logfile, lines=2000, format_spec=format_spec, threads=threads)
+            lines = open(logfile).read().splitlines()
+            self.assertEqual(lines[0], ttparse.LOGFILE_FORMAT_SPEC + format_spec)
+            self.assertEqual(len(lines), count + 1)
+            self.assertGreaterEqual(count, 2000)
+            s = ttprofile.profile(logfile)
+            calls = sum(line.count(':CALL ') for line in lines)
+            self.assertEqual(sum(f.calls for f in s.functions.values()), calls, msg=name)
+
+    def test_lanes_and_unclosed(self):
+        '''Each process/thread is a lane, unclosed frames are closed by the store (at the end of each lane).'''
+        logfile = os.path.join(self.folder, 'lanes.log')
+        ttgenerate.write(logfile, lines=5000, format_spec=ttgenerate.FORMATS['processes'], processes=2, threads=3, unclosed=2)
+        s = ttstore.TracingStore()
+        ttparse.parse_into(logfile, s, ttparse.LoggingParser())
+        self.assertEqual(len(s.stack), 6)
+        self.assertEqual(set(len(stack) for stack in s.stack.values()), {2})
+        self.assertEqual(s.stack[('Process-1', 'Thread-2')][0].name, 'outer0')
+
+    def test_size_and_compression(self):
+        '''Output size can be given in bytes, .gz output is compressed; generation is deterministic.'''
+        self.assertEqual(ttgenerate.parse_size('1.5K'), 1536)
+        self.assertEqual(ttgenerate.parse_size('2G'), 2 * 2**30)
+        logfile = os.path.join(self.folder, 'sized.log.gz')
+        ttgenerate.write(logfile, size=100000, payload=100)
+        content = gzip.open(logfile, 'rt').read()
+        self.assertGreaterEqual(len(content), 100000)
+        self.assertLess(len(content), 110000)
+        output = io.StringIO()
+        ttgenerate.generate(output, size=100000, payload=100)
+        self.assertEqual(output.getvalue(), content)
+
+    def test_indistinguishable_lanes(self):
+        '''Threads must show up in the format, otherwise their calls would not nest.'''
+        with self.assertRaises(ttgenerate.OptionError):
+            ttgenerate.generate(io.StringIO(), lines=10, threads=2)
+
+    # helper functions below
+
+    def setUp(self):
+        self.folder = TMP_FOLDER
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        os.mkdir(self.folder)
+
+
+
+
+if __name__ == '__main__':
+    unittest.main()
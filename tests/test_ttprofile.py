@@ -0,0 +1,143 @@
+
+# system imports
+import os
+import io
+import json
+import shutil
+import pstats
+import unittest
+
+# own imports
+import testcase
+import extendedlogging
+import ttvlib.ttparse as ttparse
+import ttvlib.ttprofile as ttprofile
+import ttvlib.ttstore as ttstore
+
+# constants
+TMP_FOLDER = '/tmp/test_ttprofile'
+BASEDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+
+class TestTTProfile(testcase.TestCase):
+
+    def test_recursion_counts(self):
+        '''Recursive calls are counted like cProfile does: total calls and primitive (non-recursive) calls.'''
+        s = ttprofile.profile(os.path.join(BASEDIR, 'tests', 'demo_fib.log'))
+        self.assertEqual(len(s.functions), 1)
+        f = s.functions[('demo_fib.py', 4, 'fib')]
+        self.assertEqual(f.calls, 41)
+        self.assertEqual(f.primitive_calls, 1)
+        # cumulative time of a recursive function is the outermost call
+        self.assertAlmostEqual(f.cumtime, f.maxtime)
+        self.assertLessEqual(f.percentile(99), f.maxtime)
+        self.assertGreaterEqual(f.percentile(50), f.mintime)
+
+    def test_no_store_limit(self):
+        '''The profile is aggregated, so the store limit of the viewer does not apply.'''
+        limit = ttstore.STORE_LIMIT
+        ttstore.STORE_LIMIT = 10
+        try:
+            s = ttprofile.profile(os.path.join(BASEDIR, 'tests', 'demo_fib.log'))
+        finally:
+            ttstore.STORE_LIMIT = limit
+        self.assertEqual(s.functions[('demo_fib.py', 4, 'fib')].calls, 41)
+
+    def test_self_time(self):
+        '''Self time excludes time spent in traced callees, edges are reported per caller.'''
+        logfile = self._write_log("""2022-01-01 00:00:00,000000:TRACE:a.py,1:outer:CALL *() **{}
+2022-01-01 00:00:00,100000:TRACE:a.py,5:inner:CALL *() **{}
+2022-01-01 00:00:00,100000:INFO:a.py,6:inner:some event
+2022-01-01 00:00:00,400000:TRACE:a.py,5:inner:RETURN None
+2022-01-01 00:00:00,500000:TRACE:a.py,1:outer:RETURN None
+""")
+        s = ttprofile.profile(logfile)
+        outer = s.functions[('a.py', 1, 'outer')]
+        inner = s.functions[('a.py', 5, 'inner')]
+        self.assertAlmostEqual(outer.cumtime, 0.5, places=5)
+        self.assertAlmostEqual(outer.tottime, 0.2, places=5)
+        self.assertAlmostEqual(inner.tottime, 0.3, places=5)
+        self.assertEqual(s.num_events, 1)
+        self.assertEqual(list(s.callers(inner.key).keys()), [outer.key])
+        self.assertEqual(s.callers(outer.key), {})
+        # text report
+        output = io.StringIO()
+        ttprofile.write_text(s, output, sort='cumtime')
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith('a.py:1(outer)'))
+
+    def test_pstats_output(self):
+        '''The pstats output can be loaded by the standard library.'''
+        s = ttprofile.profile(os.path.join(BASEDIR, 'tests', 'demo_multiprocessing.log'))
+        pstatsfile = os.path.join(self.folder, 'profile.pstats')
+        ttprofile.write_pstats(s, pstatsfile)
+        stats = pstats.Stats(pstatsfile)
+        self.assertEqual(stats.total_calls, 10) # 1 main, 3 processes, 6 threads
+        self.assertEqual(stats.prim_calls, 10)
+
+    def test_csv_output(self):
+        '''The csv output has a header line and one line per function.'''
+        s = ttprofile.profile(os.path.join(BASEDIR, 'tests', 'demo_multiprocessing.log'))
+        csvfile = os.path.join(self.folder, 'profile.csv')
+        ttprofile.write_csv(s, csvfile, sort='name')
+        lines = open(csvfile).read().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith('demo_multiprocessing.py,14,doit_thread,6,6,'))
+
+    def test_interleaved_generators(self):
+        '''Traced generators consumed in turns (zip) do not nest: the one which ends first gets a lane of its own, its caller is kept.'''
+        # setup
+        logfile = os.path.join(self.folder, 'input.log')
+        extendedlogging.configure(tracing=True, filename=logfile)
+        @extendedlogging.traced
+        def a(n):
+            for it in range(n):
+                yield it
+        @extendedlogging.traced
+        def b(n):
+            for it in range(n):
+                yield it
+        @extendedlogging.traced
+        def main():
+            return list(zip(a(3), b(5)))
+        # run
+        self.assertEqual(main(), [(0, 0), (1, 1), (2, 2)])
+        extendedlogging.remove_all_handlers()
+        # verify profile: CALL a, CALL b, RETURN a, RETURN b
+        s = ttprofile.profile(logfile)
+        functions = {f.key[2].split('.')[-1]: f for f in s.functions.values()}
+        self.assertEqual(sorted(functions), ['a', 'b', 'main'])
+        self.assertEqual(list(s.callers(functions['a'].key).keys()), [functions['main'].key])
+        self.assertEqual(list(s.callers(functions['b'].key).keys()), [functions['main'].key])
+        # verify json conversion
+        jsonfile = os.path.join(self.folder, 'output.json')
+        store = ttstore.TracingJsonStore(jsonfile)
+        ttparse.parse_into(logfile, store, ttparse.parser_for(logfile))
+        store.close()
+        lanes = {item['name'].split('.')[-1]: item['tid'] for item in json.load(open(jsonfile))}
+        self.assertEqual(lanes['b'], lanes['main'])
+        self.assertNotEqual(lanes['a'], lanes['main'])
+
+    # helper functions below
+
+    def setUp(self):
+        self.folder = TMP_FOLDER
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        os.mkdir(self.folder)
+
+    def tearDown(self):
+        extendedlogging.remove_all_handlers()
+
+    def _write_log(self, content):
+        logfile = os.path.join(self.folder, 'input.log')
+        with open(logfile, 'w') as f:
+            f.write(content)
+        return logfile
+
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 import os
 import subprocess
 import unittest
+from time import sleep
 
 # own imports
 import testcase
@@ -47,8 +48,8 @@ class TestTTViewer(testcase.TestCase):
             args.append('-q')
         actual_output = self._run_cmd(TTVIEWER, *args)
         # checks
-        expected_output = """Converting /tmp/extendedlogging.log \(.*B\) to /tmp/ttviewer/extendedlogging.log.json using parser: LoggingParser ... done \(.*B, n=9\)
-Converting /tmp/ttviewer/extendedlogging.log.json \(.*B\) to /tmp/ttviewer/ttviewer.html using tool: trace2html ... done \(...s, 4.0MB\)"""
+        expected_output = """Converting /tmp/extendedlogging.log \(.*B\) to /tmp/ttviewer/extendedlogging.log.json using parser: BulkLoggingParser ... done \(.*B, n=9\)
+Converting /tmp/ttviewer/extendedlogging.log.json \(.*B\) to /tmp/ttviewer/ttviewer.html using template: ttviewer_template.html ... done \(...s, .*KB\)"""
         if quiet:
             expected_output = ''
         self.assertTrue(os.path.isfile(htmlfile))
@@ -57,13 +58,23 @@ Converting /tmp/ttviewer/extendedlogging.log.json \(.*B\) to /tmp/ttviewer/ttvie
     def test_json_html_render(self):
         '''Operate on a sample json file and render webpage using selenium, including a click on the detailed info pane.'''
         logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
-        self._run_cmd(TTVIEWER, '-n', logfile)
+        self._run_cmd(TTVIEWER, '-n', '--catapult', logfile)
         self._test_json_html_render('demo_fib2.png', click=(730,116))
 
+    def test_builtin_html_render(self):
+        '''Render the default built-in viewer template: the browser decompresses the embedded trace and draws it.'''
+        logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
+        self._run_cmd(TTVIEWER, '-n', logfile)
+        browser = self._open_browser()
+        sleep(1) # nasty
+        status = browser.execute_script("return document.getElementById('status').textContent")
+        browser.quit()
+        self.assertTrue(status.startswith('82 events, 1 lanes, '), 'unexpected viewer status: {}'.format(status))
+
     def test_json_html_render_with_io(self):
         '''Operate on a sample json file and render webpage using selenium, with extra input/output labels.'''
         logfile = os.path.join(BASEDIR, 'tests', 'demo_fib.log')
-        self._run_cmd(TTVIEWER, '-n', logfile, '--io')
+        self._run_cmd(TTVIEWER, '-n', '--catapult', logfile, '--io')
         self._test_json_html_render('demo_fib.png', click=(730,116))
 
     def test_catapult_render(self):
@@ -73,25 +84,25 @@ Converting /tmp/ttviewer/extendedlogging.log.json \(.*B\) to /tmp/ttviewer/ttvie
         logfile = os.path.join(BASEDIR, 'tests', 'demo_catapult.json')
         if not os.path.isfile(logfile):
             self._run_cmd('wget', '-q', '-O', logfile, 'https://www.chromium.org/developers/how-tos/trace-event-profiling-tool/using-frameviewer/nytimes_scroll_trace')
-        self._run_cmd(TTVIEWER, '-n', logfile)
+        self._run_cmd(TTVIEWER, '-n', '--catapult', logfile)
         self._test_json_html_render('demo_catapult.png', sleeptime=5)
 
     def test_events_html_render(self):
         '''Try to render events ... hard to spot, need some trickery, or migrate to Perfetto?'''
         logfile = os.path.join(BASEDIR, 'tests', 'demo_events.log')
-        self._run_cmd(TTVIEWER, '-n', logfile)
+        self._run_cmd(TTVIEWER, '-n', '--catapult', logfile)
         self._test_json_html_render('demo_events.png')
 
     def test_multiprocessing_html_render(self):
         '''Multiple threads/processes are rendered in their own lanes.'''
         logfile = os.path.join(BASEDIR, 'tests', 'demo_multiprocessing.log')
-        self._run_cmd(TTVIEWER, '-n', logfile)
+        self._run_cmd(TTVIEWER, '-n', '--catapult', logfile)
         self._test_json_html_render('demo_multiprocessing.png')
 
     def test_autoclose_openloop_html_render(self):
         '''Without the autoclose functionality, the loop layer would not be rendered because final tick errors out and the log is incomplete.'''
         logfile = os.path.join(BASEDIR, 'tests', 'demo_openloop.log')
-        self._run_cmd(TTVIEWER, '-n', logfile)
+        self._run_cmd(TTVIEWER, '-n', '--catapult', logfile)
         self._test_json_html_render('demo_openloop.png')
 
 
@@ -103,11 +114,9 @@ Converting /tmp/ttviewer/extendedlogging.log.json \(.*B\) to /tmp/ttviewer/ttvie
         if os.path.isfile(htmlfile):
             os.remove(htmlfile)
 
-    def _test_json_html_render(self, expected_pngfile, sleeptime=1, click=None):
+    def _open_browser(self):
         htmlfile = os.path.join(TMPDIR, 'ttviewer.html')
-        # render html, convert to png
         from selenium import webdriver
-        from time import sleep
         options = webdriver.firefox.options.Options()
         options.headless = True
         options.add_argument('--width=1280')
@@ -115,6 +124,12 @@ Converting /tmp/ttviewer/extendedlogging.log.json \(.*B\) to /tmp/ttviewer/ttvie
         service = webdriver.firefox.service.Service(log_path=os.path.devnull) # get rid of geckodriver.log
         browser = webdriver.Firefox(options=options, service=service)
         browser.get('file://' + htmlfile)
+        return browser
+
+    def _test_json_html_render(self, expected_pngfile, sleeptime=1, click=None):
+        # render html, convert to png
+        from selenium import webdriver
+        browser = self._open_browser()
         sleep(sleeptime) # nasty
         if click:
             el = browser.find_element(by=webdriver.common.by.By.XPATH, value="//body")
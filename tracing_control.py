@@ -0,0 +1,239 @@
+"""Runtime control of tracing per function, class or module, without re-decorating.
+
+Each traced callable is registered under its name: '<module>.<qualname>', for example 'demo.MyClass.method'.
+Rules enable or disable tracing for names matching a (fnmatch) pattern, optionally for a limited duration:
+    enable_tracing('mypackage.suspect.*', duration=30)
+    disable_tracing('*')
+The last matching rule wins; without matching rule, the configured level decides (see set_levels).
+Rules are resolved into a flag per callable, so a disabled callable takes a fast path, without any logging calls.
+The levels also apply to the other records, via a handler filter (see LevelFilter).
+
+Rules can also be given at runtime via a trigger file, which is read upon a signal (default SIGUSR1) and/or polled.
+The trigger file has one command per line: 'enable <pattern> [seconds]' or 'disable <pattern> [seconds]'.
+"""
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import weakref
+from fnmatch import fnmatchcase
+import autologging
+
+
+DEFAULT_TRIGGER_FILE = '/tmp/extendedlogging.trigger'
+DEFAULT_TRIGGER_SIGNAL = getattr(signal, 'SIGUSR1', None)
+TRIGGER_COMMENT_CHAR = '#'
+
+
+
+class TracedCallable():
+    """Registry entry of a traced callable. The engines check the enabled flag on each call."""
+    def __init__(self, name):
+        self.name = name
+        self.enabled = True
+        self.listeners = [] # called with the new flag value upon change
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        for listener in self.listeners:
+            listener(enabled)
+
+    def __repr__(self):
+        return '{} ({})'.format(self.name, ['disabled', 'enabled'][self.enabled])
+
+
+def callable_name(function):
+    """Registry name of a callable: '<module>.<qualname>'."""
+    return '{}.{}'.format(getattr(function, '__module__', None), getattr(function, '__qualname__', function.__name__))
+
+
+class Rule():
+    def __init__(self, pattern, enabled, expiry=None):
+        self.pattern = pattern
+        self.enabled = enabled
+        self.expiry = expiry # time.time() based
+
+
+class Registry():
+    def __init__(self):
+        self.callables = weakref.WeakSet() # an entry lives as long as its traced callable (delegator or code)
+        self.rules = []
+        self.levels = {}
+        self.record_levels = {} # (pathname, funcName) -> resolved level, for LevelFilter
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def register(self, function):
+        entry = TracedCallable(callable_name(function))
+        with self.lock:
+            entry.enabled = self.resolve(entry.name)
+            self.callables.add(entry)
+        return entry
+
+    def resolve(self, name):
+        result = self.resolve_level(name) <= autologging.TRACE
+        for rule in self.rules:
+            if fnmatchcase(name, rule.pattern):
+                result = rule.enabled
+        return result
+
+    def resolve_level(self, name):
+        # hierarchical, like logger names: most specific (longest) matching name wins
+        result = logging.NOTSET
+        matchlength = -1
+        for (key, level) in self.levels.items():
+            if (name == key or name.startswith(key + '.')) and len(key) > matchlength:
+                result = level
+                matchlength = len(key)
+        return result
+
+    def set_levels(self, levels):
+        with self.lock:
+            self.levels = {}
+            for (key, level) in levels.items():
+                if not isinstance(level, int):
+                    level = logging.getLevelName(level)
+                    if not isinstance(level, int):
+                        raise Exception('unknown level {} given for {}'.format(levels[key], key))
+                self.levels[key] = level
+            self.record_levels = {}
+            self.update()
+
+    def record_level(self, record):
+        """Resolved level of a record: its function in the module of its source file."""
+        key = (record.pathname, record.funcName)
+        try:
+            return self.record_levels[key]
+        except KeyError:
+            pass
+        level = self.resolve_level('{}.{}'.format(module_name(record.pathname, record.module), record.funcName))
+        self.record_levels[key] = level
+        return level
+
+    def add_rule(self, pattern, enabled, duration=None):
+        with self.lock:
+            # a newer rule for the same pattern replaces the older one
+            self.rules = [rule for rule in self.rules if rule.pattern != pattern]
+            expiry = None
+            if duration is not None:
+                expiry = time.time() + duration
+            self.rules.append(Rule(pattern, enabled, expiry))
+            self.update()
+
+    def clear_rules(self):
+        with self.lock:
+            self.rules = []
+            self.update()
+
+    def update(self):
+        """Drop expired rules, resolve the flags and schedule the next expiry, if any."""
+        with self.lock:
+            t = time.time()
+            self.rules = [rule for rule in self.rules if rule.expiry is None or rule.expiry > t]
+            for entry in list(self.callables):
+                entry.set_enabled(self.resolve(entry.name))
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            expiries = [rule.expiry for rule in self.rules if rule.expiry is not None]
+            if expiries:
+                self.timer = threading.Timer(max(0.0, min(expiries) - t), self.update)
+                self.timer.daemon = True
+                self.timer.start()
+_registry = Registry()
+
+
+class LevelFilter(logging.Filter):
+    """Handler filter which applies the levels (see set_levels) to the records which are not tracing records.
+    A record is matched by '<module>.<function>' of its origin; the function name of a plain logging call is not qualified,
+    so a level given for a class does not apply to it. Tracing records are left to the per-callable flags."""
+    def filter(self, record):
+        if record.levelno <= autologging.TRACE or not _registry.levels:
+            return True
+        return record.levelno >= _registry.record_level(record)
+
+
+def module_name(pathname, default):
+    """Name of the imported module with given source file, default if none."""
+    stem = os.path.splitext(os.path.abspath(pathname))[0]
+    for (name, module) in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if filename and os.path.splitext(os.path.abspath(filename))[0] == stem:
+            return name
+    return default
+
+
+def get():
+    """Get a handle to the registry."""
+    return _registry
+
+def register(function):
+    """Register a traced callable, return its entry."""
+    return _registry.register(function)
+
+def enable_tracing(pattern='*', duration=None):
+    """Enable tracing of all callables whose name matches pattern, optionally for given duration (seconds)."""
+    _registry.add_rule(pattern, True, duration)
+
+def disable_tracing(pattern='*', duration=None):
+    """Disable tracing of all callables whose name matches pattern, optionally for given duration (seconds)."""
+    _registry.add_rule(pattern, False, duration)
+
+def set_levels(levels):
+    """Set the logging level per module, class or function, for example {'mypackage.noisy': 'INFO'}.
+    Tracing is disabled for callables with a level above TRACE, so they never construct records.
+    Handlers with a LevelFilter drop the other records below the level of their origin."""
+    _registry.set_levels(levels)
+
+def traced_callables(pattern='*'):
+    """Return the registry entries of traced callables whose name matches pattern, sorted by name."""
+    entries = [entry for entry in list(_registry.callables) if fnmatchcase(entry.name, pattern)]
+    return sorted(entries, key=lambda entry: entry.name)
+
+
+def apply_trigger_file(filename=DEFAULT_TRIGGER_FILE):
+    """Read given trigger file and apply its commands, see module documentation."""
+    commands = {'enable': enable_tracing, 'disable': disable_tracing}
+    with open(filename, 'r') as f:
+        for line in f:
+            words = line.split(TRIGGER_COMMENT_CHAR)[0].split()
+            if not words:
+                continue
+            if words[0] not in commands or len(words) not in (2, 3):
+                raise Exception('invalid trigger command: "{}"'.format(line.strip()))
+            duration = None
+            if len(words) == 3:
+                duration = float(words[2])
+            commands[words[0]](words[1], duration)
+
+
+def install_trigger(filename=DEFAULT_TRIGGER_FILE, signum=DEFAULT_TRIGGER_SIGNAL, poll_interval=None):
+    """Apply the trigger file upon given signal, and/or each time it has been modified (polling thread)."""
+    def apply():
+        # a bad trigger file must not break the traced program
+        try:
+            apply_trigger_file(filename)
+        except Exception as e:
+            logging.getLogger().warning('could not apply trigger file {}: {}'.format(filename, e))
+    if signum is not None:
+        signal.signal(signum, lambda *args: apply())
+    if poll_interval is not None:
+        def poll():
+            last_mtime = None
+            while True:
+                if os.path.isfile(filename):
+                    mtime = os.path.getmtime(filename)
+                    if mtime != last_mtime:
+                        last_mtime = mtime
+                        apply()
+                time.sleep(poll_interval)
+        thread = threading.Thread(target=poll, name='extendedlogging-trigger')
+        thread.daemon = True # python2 Thread takes no daemon argument
+        thread.start()
@@ -0,0 +1,310 @@
+"""Low-overhead tracing engine, alternative to the autologging function tracing proxies.
+
+Instead of wrapping each traced function, the code objects of decorated functions are registered
+and CALL/RETURN records are produced by interpreter callbacks:
+* sys.monitoring (python >= 3.12), with events enabled only on the registered code objects
+* sys.setprofile as fallback, which is called for all functions, but filters quickly on code object;
+  also used when all tool ids which sys.monitoring could use are taken by other tools
+
+Decorated functions are returned unchanged, so there is no extra frame in tracebacks.
+Like the proxies, tracing can be switched per callable at runtime, see tracing_control.
+The records are the same as those of the tracing proxy, with some differences:
+* arguments are reconstructed from the frame: keyword-only parameters and **kwargs are logged as keywords,
+  all other parameters as positional arguments, including default values
+* the setprofile engine cannot see the exception, so it only logs RETURN ERROR, no ERROR record
+* generator functions and coroutines are traced by the autologging proxy
+
+The engine is chosen at decoration time, via environment variable EXTENDEDLOGGING_TRACING_ENGINE
+or module option ENGINE: 'proxy' (default, autologging), 'monitor' (sys.monitoring if available,
+otherwise setprofile) or 'setprofile'.
+"""
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import dis
+import logging
+import threading
+import inspect
+from inspect import isclass, isroutine, isgeneratorfunction
+import autologging
+import patch_autologging
+import tracing_control
+import tracing_stats
+
+
+ENGINE = os.environ.get('EXTENDEDLOGGING_TRACING_ENGINE', 'proxy')
+ENGINES = ('proxy', 'monitor', 'setprofile')
+MONITORING_TOOL_NAME = 'extendedlogging'
+MONITORING_TOOL_IDS = (2, 3, 4) # the profiler id first, then the ids which python leaves unassigned
+
+# code flags
+CO_VARARGS = 0x04
+CO_VARKEYWORDS = 0x08
+
+# opcodes which return normally from a function; otherwise a return event is due to an exception
+RETURN_OPCODES = set(dis.opmap[name] for name in ('RETURN_VALUE', 'RETURN_CONST') if name in dis.opmap)
+if sys.version_info < (3,):
+    RETURN_OPCODES = set(chr(op) for op in RETURN_OPCODES) # python2 bytecode is a str
+
+# python2 has no coroutines
+iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', lambda function: False)
+isasyncgenfunction = getattr(inspect, 'isasyncgenfunction', lambda function: False)
+
+
+
+class TracedCode():
+    """Tracing details of a registered code object."""
+    def __init__(self, code, logger, skip_first, entry):
+        self.logger = logger
+        self.entry = entry # tracing_control registry entry, with the enabled flag
+        self.skip_first = skip_first # methods: do not log self/cls, like the proxy (bound method)
+        self.filename = code.co_filename
+        self.lineno = code.co_firstlineno
+        self.funcname = getattr(code, 'co_qualname', code.co_name)
+
+    def handle(self, level, msg, args, extra=None):
+        timer = tracing_stats.timer()
+        record = logging.LogRecord(
+            self.logger.name,    # name
+            level,               # level
+            self.filename,       # pathname
+            self.lineno,         # lineno
+            msg,                 # msg
+            args,                # args
+            None,                # exc_info
+            func=self.funcname)
+        if extra:
+            record.__dict__.update(extra)
+        if timer:
+            timer.lap('record')
+        self.logger.handle(record)
+
+
+class Engine():
+    """Base engine: registry of traced code objects and the record producing callbacks."""
+    def __init__(self):
+        self.codes = {}
+        self.local = threading.local() # per thread: stack of (frame, start time) of the logged calls
+        self.installed = False
+
+    def register(self, function, logger, skip_first):
+        code = function.__code__
+        self.codes[code] = TracedCode(code, logger, skip_first, tracing_control.register(function))
+        if not self.installed:
+            self.install()
+            self.installed = True
+        return self.codes[code]
+
+    def install(self):
+        raise NotImplementedError()
+
+    def frames(self):
+        try:
+            return self.local.frames
+        except AttributeError:
+            self.local.frames = []
+            return self.local.frames
+
+    def pop(self, frame):
+        # a return is only logged if its call was logged, also when tracing is switched in between
+        frames = self.frames()
+        if frames and frames[-1][0] is frame:
+            return frames.pop()[1]
+        return None
+
+    def on_call(self, traced, frame):
+        if not traced.entry.enabled or not traced.logger.isEnabledFor(autologging.TRACE):
+            return
+        t_start = tracing_stats.perf_counter_ns()
+        self.frames().append((frame, t_start))
+        args, keywords = self.arguments(frame, traced.skip_first)
+        extra = None
+        if patch_autologging.MONOTONIC_TIMING_ENABLED:
+            extra = {'perf_ns': t_start}
+        traced.handle(autologging.TRACE, patch_autologging.CALL_MESSAGE, (args, keywords), extra)
+
+    def on_return(self, traced, frame, value):
+        t_start = self.pop(frame)
+        if t_start is None:
+            return
+        traced.handle(autologging.TRACE, patch_autologging.RETURN_MESSAGE, (value,), self.timing(t_start))
+
+    def on_error(self, traced, frame, exception):
+        t_start = self.pop(frame)
+        if t_start is None or not patch_autologging.ERROR_HANDLING_ENABLED:
+            return
+        timing = self.timing(t_start)
+        # the ERROR is logged once, at the innermost traced frame
+        if exception is not None and not patch_autologging.reported(exception):
+            traced.handle(logging.ERROR, "%s", (patch_autologging.ErrorMessage(exception),))
+        traced.handle(autologging.TRACE, patch_autologging.RETURN_ERROR_MESSAGE, None, timing)
+
+    @staticmethod
+    def timing(t_start):
+        if not patch_autologging.MONOTONIC_TIMING_ENABLED:
+            return None
+        t = tracing_stats.perf_counter_ns()
+        return {'perf_ns': t, 'duration_ns': t - t_start}
+
+    @staticmethod
+    def arguments(frame, skip_first):
+        """Reconstruct the call arguments from the locals of a frame which just started."""
+        code = frame.f_code
+        local_vars = frame.f_locals
+        names = code.co_varnames
+        n = code.co_argcount
+        nkw = n + getattr(code, 'co_kwonlyargcount', 0) # python2 has no keyword-only parameters
+        args = tuple(local_vars[name] for name in names[int(skip_first):n])
+        keywords = {name: local_vars[name] for name in names[n:nkw]}
+        if code.co_flags & CO_VARARGS:
+            args += tuple(local_vars[names[nkw]])
+            nkw += 1
+        if code.co_flags & CO_VARKEYWORDS:
+            keywords.update(local_vars[names[nkw]])
+        return args, keywords
+
+
+class MonitoringEngine(Engine):
+    """Engine using sys.monitoring (python >= 3.12). Only registered code objects generate start/return events.
+    The tool id is claimed upon creation, see claim_tool_id."""
+    def __init__(self, tool):
+        Engine.__init__(self)
+        self.tool = tool
+
+    @staticmethod
+    def claim_tool_id():
+        """Claim the first free tool id of MONITORING_TOOL_IDS, return None if all are in use (by a profiler, coverage tool etc.)."""
+        for tool in MONITORING_TOOL_IDS:
+            try:
+                sys.monitoring.use_tool_id(tool, MONITORING_TOOL_NAME)
+                return tool
+            except ValueError:
+                pass # in use
+        return None
+
+    def install(self):
+        monitoring = sys.monitoring
+        monitoring.register_callback(self.tool, monitoring.events.PY_START, self.py_start)
+        monitoring.register_callback(self.tool, monitoring.events.PY_RETURN, self.py_return)
+        monitoring.register_callback(self.tool, monitoring.events.PY_UNWIND, self.py_unwind)
+        # unwind events cannot be enabled per code object
+        monitoring.set_events(self.tool, monitoring.events.PY_UNWIND)
+
+    def register(self, function, logger, skip_first):
+        traced = Engine.register(self, function, logger, skip_first)
+        code = function.__code__
+        patch_autologging.register_reporting_code(code, traced.entry)
+        def set_events(enabled):
+            # disabled: no start events at all, return events are still needed for calls in progress
+            events = sys.monitoring.events.PY_RETURN
+            if enabled:
+                events |= sys.monitoring.events.PY_START
+            sys.monitoring.set_local_events(self.tool, code, events)
+        traced.entry.listeners.append(set_events)
+        set_events(traced.entry.enabled)
+        return traced
+
+    def py_start(self, code, offset):
+        self.on_call(self.codes[code], sys._getframe(1))
+
+    def py_return(self, code, offset, value):
+        self.on_return(self.codes[code], sys._getframe(1), value)
+
+    def py_unwind(self, code, offset, exception):
+        traced = self.codes.get(code)
+        if traced is not None:
+            self.on_error(traced, sys._getframe(1), exception)
+
+
+class ProfileEngine(Engine):
+    """Engine using sys.setprofile, which is called for every function call: filter on code object."""
+    def install(self):
+        if hasattr(threading, 'setprofile_all_threads'):
+            threading.setprofile_all_threads(self.profile)
+        else:
+            threading.setprofile(self.profile)
+        sys.setprofile(self.profile)
+
+    def profile(self, frame, event, arg):
+        if event == 'call':
+            traced = self.codes.get(frame.f_code)
+            if traced is not None:
+                self.on_call(traced, frame)
+        elif event == 'return':
+            traced = self.codes.get(frame.f_code)
+            if traced is not None:
+                if frame.f_code.co_code[frame.f_lasti] in RETURN_OPCODES:
+                    self.on_return(traced, frame, arg)
+                else:
+                    self.on_error(traced, frame, None)
+
+
+_engine = None
+
+def get_engine():
+    """Get a handle to the engine, which is created on first use."""
+    global _engine
+    if _engine is None:
+        if ENGINE not in ENGINES:
+            raise Exception('unknown tracing engine {}, expected one of {}'.format(ENGINE, ENGINES))
+        tool = None
+        if ENGINE == 'monitor' and hasattr(sys, 'monitoring'):
+            tool = MonitoringEngine.claim_tool_id()
+        if tool is not None:
+            _engine = MonitoringEngine(tool)
+        else:
+            _engine = ProfileEngine()
+    return _engine
+
+
+def _proxy_only(function):
+    # generators and coroutines are suspended and resumed, which the proxy handles better
+    return isgeneratorfunction(function) or iscoroutinefunction(function) or isasyncgenfunction(function) or not hasattr(function, '__code__')
+
+
+def _register_function(function, logger, skip_first=False):
+    if _proxy_only(function):
+        return autologging._make_traceable_function(function, logger)
+    get_engine().register(function, logger, skip_first)
+    return function
+
+
+def _register_methods(class_, *method_names, **keywords):
+    logger = keywords.get('logger') or logging.getLogger(autologging._generate_logger_name(class_))
+    if method_names or keywords.get('exclude', False):
+        names = autologging._get_traceable_method_names(method_names, class_, exclude=keywords.get('exclude', False))
+    else:
+        names = autologging._get_default_traceable_method_names(class_)
+    proxy_names = []
+    for name in names:
+        member = class_.__dict__[name]
+        function = getattr(member, '__func__', member) # classmethod, staticmethod
+        if _proxy_only(function):
+            proxy_names.append(name)
+        else:
+            get_engine().register(function, logger, not isinstance(member, staticmethod))
+    if proxy_names:
+        autologging._install_traceable_methods(class_, *proxy_names, logger=logger)
+    return class_
+
+
+def traced(*args, **keywords):
+    """Tracing decorator, with the same signature as autologging.traced, using the tracing engine."""
+    obj = args[0] if args else None
+    if obj is None:
+        return traced
+    if isclass(obj):
+        return _register_methods(obj, exclude=keywords.get('exclude', False))
+    if isroutine(obj):
+        return _register_function(obj, logging.getLogger(autologging._generate_logger_name(obj)))
+    if isinstance(obj, logging.Logger):
+        method_names = args[1:]
+        def traced_decorator(class_or_fn):
+            if isclass(class_or_fn):
+                return _register_methods(class_or_fn, *method_names, exclude=keywords.get('exclude', False), logger=obj)
+            return _register_function(class_or_fn, obj)
+        return traced_decorator
+    method_names = args[:]
+    return lambda class_: _register_methods(class_, *method_names, exclude=keywords.get('exclude', False))
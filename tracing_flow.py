@@ -0,0 +1,114 @@
+"""Flow (causality) events: link the code which hands over work to the code which picks it up, across threads and processes.
+
+A flow start record is logged where the work is handed over, a flow end record where it is picked up, with the same id:
+    flow_id = flow_start()    # for example before putting a job on a queue
+    ...
+    flow_end(flow_id)         # in the worker, before handling the job
+The viewer draws an arrow from the call enclosing the start to the first call after the end,
+so the time spent waiting in between becomes visible.
+
+With set_automatic_flows(True) (configure option 'flows'), this is done automatically when starting a threading.Thread
+or a multiprocessing.Process, and when submitting work to a concurrent.futures executor.
+"""
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import logging
+import itertools
+from functools import wraps
+import autologging
+
+
+# message keywords, as recognized by the parser (ttvlib.ttparse)
+FLOW_START = 'FLOW_START'
+FLOW_END = 'FLOW_END'
+
+# flow ids are unique per process, the process id makes them unique over processes
+_counter = itertools.count(1)
+AUTOMATIC_FLOWS_ENABLED = False
+_installed = False
+
+
+
+def flow_start():
+    """Log a flow start record, return the flow id which is to be passed along with the work."""
+    flow_id = '{}.{}'.format(os.getpid(), next(_counter))
+    _log(FLOW_START, flow_id)
+    return flow_id
+
+def flow_end(flow_id):
+    """Log a flow end record for given flow id, as returned by flow_start. None is ignored."""
+    if flow_id is not None:
+        _log(FLOW_END, flow_id)
+
+def _log(keyword, flow_id):
+    # the record is attributed to the caller of flow_start/flow_end
+    logger = logging.getLogger()
+    if not logger.isEnabledFor(autologging.TRACE):
+        return
+    if sys.version_info >= (3, 8):
+        logger.log(autologging.TRACE, '%s %s', keyword, flow_id, stacklevel=3)
+        return
+    # no stacklevel before python 3.8: make the record from the frame of the caller
+    frame = sys._getframe(2)
+    code = frame.f_code
+    record = logger.makeRecord(logger.name, autologging.TRACE, code.co_filename, frame.f_lineno, '%s %s', (keyword, flow_id), None, code.co_name)
+    logger.handle(record)
+
+
+class FlowCall():
+    """Callable which logs the flow end before calling the function. It can be pickled if the function can."""
+    def __init__(self, flow_id, function):
+        self.flow_id = flow_id
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        flow_end(self.flow_id)
+        return self.function(*args, **kwargs)
+
+
+def set_automatic_flows(b):
+    """Enable or disable automatic flow events for threads, processes and executors. The patches are installed on first use."""
+    global AUTOMATIC_FLOWS_ENABLED
+    AUTOMATIC_FLOWS_ENABLED = b
+    if b:
+        _install()
+
+def _install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    import threading
+    import multiprocessing.process
+    # the run method is wrapped per instance, so that subclasses which override run are covered too
+    process = multiprocessing.process
+    for cls in (threading.Thread, process.BaseProcess if hasattr(process, 'BaseProcess') else process.Process):
+        _patch_start(cls)
+    try:
+        import concurrent.futures
+    except ImportError:
+        return # python2 without the futures backport
+    for cls in (concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor):
+        _patch_submit(cls)
+
+def _patch_start(cls):
+    start = cls.start
+    @wraps(start)
+    def patched_start(self):
+        if AUTOMATIC_FLOWS_ENABLED:
+            self.run = FlowCall(flow_start(), self.run)
+        return start(self)
+    cls.start = patched_start
+
+def _patch_submit(cls):
+    submit = cls.submit
+    @wraps(submit)
+    def patched_submit(self, fn, *args, **kwargs):
+        if AUTOMATIC_FLOWS_ENABLED:
+            fn = FlowCall(flow_start(), fn)
+        return submit(self, fn, *args, **kwargs)
+    cls.submit = patched_submit
+
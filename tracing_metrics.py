@@ -0,0 +1,228 @@
+"""Live metrics of traced callables: call counts, errors and latency histograms, without reading back a trace.
+
+When enabled (configure option 'metrics', or set_metrics), each traced call is timed by the tracing proxy,
+also when tracing is disabled for it, so metrics can be collected in production with tracing to file turned off.
+Durations go into HDR-style histograms: logarithmic buckets, each split into linear sub-buckets,
+so percentiles have a bounded relative error over the full range from nanoseconds to hours.
+
+Each thread records into its own shards, without locking; shards are merged on read:
+    extendedlogging.metrics()            # {name: {'calls': ..., 'errors': ..., 'p99': ..., ...}}, times in seconds
+A snapshot can also be appended periodically to a file, as one json line per interval (configure option 'metrics_file').
+The snapshot covers the window since the metrics were enabled or last reset, and includes the call rate.
+
+Names are as in tracing_control: '<module>.<qualname>'.
+"""
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from fnmatch import fnmatchcase
+
+
+# sub-buckets per power of two: relative error of percentiles is below 2**-(SUB_BUCKET_BITS-1), i.e. 0.8%
+SUB_BUCKET_BITS = 8
+PERCENTILES = (50, 90, 99, 99.9)
+DEFAULT_DUMP_INTERVAL = 10.0 # seconds
+
+METRICS_ENABLED = False
+
+# shards of all threads, as (name, shard); replaced by a new list (generation) upon reset
+_shards = []
+_generation = 0
+_window_start = time.time()
+_lock = threading.Lock()
+_local = threading.local()
+_dumper = None
+
+
+
+def _bucket(duration_ns):
+    shift = duration_ns.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return duration_ns
+    return (shift << SUB_BUCKET_BITS) | (duration_ns >> shift)
+
+def _bucket_value(idx):
+    # middle of the bucket
+    shift = idx >> SUB_BUCKET_BITS
+    if shift == 0:
+        return idx
+    return ((idx & ((1 << SUB_BUCKET_BITS) - 1)) << shift) + (1 << (shift - 1))
+
+
+class FunctionMetrics():
+    """Counters and latency histogram of a callable, for one thread (shard) or merged."""
+    __slots__ = ('calls', 'errors', 'total_ns', 'min_ns', 'max_ns', 'counts')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.counts = {} # bucket index -> count
+
+    def add(self, duration_ns, error=False):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        idx = _bucket(duration_ns)
+        counts = self.counts
+        counts[idx] = counts.get(idx, 0) + 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        if other.min_ns is not None and (self.min_ns is None or other.min_ns < self.min_ns):
+            self.min_ns = other.min_ns
+        for (idx, count) in dict(other.counts).items(): # copy, the owning thread may be adding
+            self.counts[idx] = self.counts.get(idx, 0) + count
+
+    def percentile(self, p):
+        """Duration in nanoseconds below which given percentage of the calls fall."""
+        threshold = self.calls * p / 100.0
+        cumulative = 0
+        for idx in sorted(self.counts):
+            cumulative += self.counts[idx]
+            if cumulative >= threshold:
+                return min(max(_bucket_value(idx), self.min_ns), self.max_ns)
+        return self.max_ns
+
+    def summary(self, window=None):
+        """Plain dict, times in seconds."""
+        result = {'calls': self.calls, 'errors': self.errors, 'total': 1e-9 * self.total_ns,
+            'mean': 1e-9 * self.total_ns / max(1, self.calls), 'min': 1e-9 * (self.min_ns or 0), 'max': 1e-9 * self.max_ns}
+        for p in PERCENTILES:
+            result['p{:g}'.format(p)] = 1e-9 * self.percentile(p)
+        if window:
+            result['rate'] = self.calls / window
+        return result
+
+
+def set_metrics(b):
+    """Enable or disable metrics collection. Enabling starts a new window."""
+    global METRICS_ENABLED
+    if b and not METRICS_ENABLED:
+        clear()
+    METRICS_ENABLED = b
+
+def clear():
+    """Drop all counts and start a new window."""
+    global _shards, _generation, _window_start
+    with _lock:
+        _shards = []
+        _generation += 1
+        _window_start = time.time()
+
+def record(name, duration_ns, error=False):
+    """Record a call of given duration, in the shard of the current thread."""
+    shards = getattr(_local, 'shards', None)
+    if shards is None or _local.generation != _generation:
+        shards = _local.shards = {}
+        _local.generation = _generation
+    shard = shards.get(name)
+    if shard is None:
+        shard = shards[name] = FunctionMetrics()
+        with _lock:
+            _shards.append((name, shard))
+    shard.add(duration_ns, error)
+
+
+def merged(pattern='*'):
+    """Merge the shards of all threads, return a dict name -> FunctionMetrics."""
+    with _lock:
+        shards = list(_shards)
+    result = {}
+    for (name, shard) in shards:
+        if fnmatchcase(name, pattern):
+            if name not in result:
+                result[name] = FunctionMetrics()
+            result[name].merge(shard)
+    return result
+
+def metrics(pattern='*', reset=False):
+    """Return the metrics of traced callables matching pattern: a dict name -> summary dict (times in seconds).
+    With reset, counting starts over afterwards."""
+    window = time.time() - _window_start
+    result = {name: m.summary(window) for (name, m) in merged(pattern).items()}
+    if reset:
+        clear()
+    return result
+
+def snapshot():
+    """Snapshot as written to the dump file."""
+    return {'time': time.time(), 'pid': os.getpid(), 'window': time.time() - _window_start, 'metrics': metrics()}
+
+
+def dump(filename):
+    """Append a snapshot to given file, as a single json line."""
+    line = json.dumps(snapshot()) + '\n'
+    with open(filename, 'a') as f:
+        f.write(line) # single write, so lines of different processes do not interleave
+
+class Dumper():
+    """Daemon thread which dumps a snapshot periodically, and a last one at exit."""
+    def __init__(self, filename, interval=DEFAULT_DUMP_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='extendedlogging-metrics')
+        self.thread.daemon = True # python2 Thread takes no daemon argument
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        # a failing dump must not break the traced program
+        try:
+            dump(self.filename)
+        except Exception as e:
+            sys.stderr.write('extendedlogging: could not write metrics to {}: {}\n'.format(self.filename, e))
+
+    def stop(self):
+        self.stopped.set()
+
+def set_dump(filename, interval=DEFAULT_DUMP_INTERVAL):
+    """Dump a snapshot to given file every interval seconds and at exit. None stops dumping."""
+    global _dumper
+    if _dumper is not None:
+        if (_dumper.filename, _dumper.interval) == (filename, interval):
+            return
+        _dumper.stop()
+        _dumper = None
+    if filename is not None:
+        _dumper = Dumper(filename, interval)
+
+def _dump_at_exit():
+    if _dumper is not None and METRICS_ENABLED:
+        _dumper.dump()
+atexit.register(_dump_at_exit)
+
+
+def _restart_after_fork():
+    # a child process counts its own calls; the dump thread did not survive the fork
+    global _dumper
+    clear()
+    if _dumper is not None:
+        _dumper = Dumper(_dumper.filename, _dumper.interval)
+        # multiprocessing children exit without atexit handlers, so dump in their exit function
+        if 'multiprocessing' in sys.modules:
+            import multiprocessing.util
+            multiprocessing.util.register_after_fork(_dumper, lambda d: multiprocessing.util.Finalize(d, _dump_at_exit, exitpriority=0))
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
@@ -0,0 +1,145 @@
+"""Self-instrumentation: the time extendedlogging itself spends per phase, to budget the tracing overhead.
+
+When enabled (configure option 'stats', or set_stats), the following phases are timed:
+    record     creating the log record in the tracing proxy (or tracing engine)
+    arguments  array truncation of the arguments (TraceFormatter)
+    format     building the message (TraceFormatter)
+    fold       newline folding and string size limit (TraceFormatter)
+    write      writing to the tracing file, including compression (TraceFileHandler)
+Also counted: records formatted, bytes written (uncompressed), records dropped (failed to format or write)
+and records truncated (string size limit or array size limit).
+
+Each thread counts in its own shard, without locking; shards are merged on read, see stats().
+At exit, a summary line is logged (INFO).
+"""
+__author__ = 'Jan Feitsma'
+
+
+import os
+import time
+import atexit
+import logging
+import threading
+
+
+PHASES = ('record', 'arguments', 'format', 'fold', 'write')
+COUNTERS = ('records', 'bytes', 'dropped', 'truncated')
+
+STATS_ENABLED = False
+
+# shards of all threads; replaced by a new list upon clear
+_shards = []
+_generation = 0
+_lock = threading.Lock()
+_local = threading.local()
+
+# nanosecond performance counter of the tracing modules; python < 3.7 has none, python2 not even a perf counter
+if hasattr(time, 'perf_counter_ns'):
+    perf_counter_ns = time.perf_counter_ns
+else:
+    _clock = getattr(time, 'perf_counter', time.time)
+    perf_counter_ns = lambda: int(_clock() * 1e9)
+
+
+
+class Stats():
+    """Time (ns) and count per phase, plus counters, for one thread (shard) or merged."""
+    def __init__(self):
+        self.time_ns = dict.fromkeys(PHASES, 0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def merge(self, other):
+        for phase in PHASES:
+            self.time_ns[phase] += other.time_ns[phase]
+            self.calls[phase] += other.calls[phase]
+        for counter in COUNTERS:
+            self.counters[counter] += other.counters[counter]
+
+
+class Timer():
+    """Times consecutive phases: each lap adds the time since the previous lap (or start) to given phase."""
+    __slots__ = ('shard', 't')
+
+    def __init__(self):
+        self.shard = _shard()
+        self.t = perf_counter_ns()
+
+    def lap(self, phase):
+        t = perf_counter_ns()
+        self.shard.time_ns[phase] += t - self.t
+        self.shard.calls[phase] += 1
+        self.t = t
+
+
+def set_stats(b):
+    """Enable or disable self-instrumentation. Enabling starts counting from zero."""
+    global STATS_ENABLED
+    if b and not STATS_ENABLED:
+        clear()
+    STATS_ENABLED = b
+
+def clear():
+    """Drop all counts."""
+    global _shards, _generation
+    with _lock:
+        _shards = []
+        _generation += 1
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None or _local.generation != _generation:
+        shard = _local.shard = Stats()
+        _local.generation = _generation
+        with _lock:
+            _shards.append(shard)
+    return shard
+
+def timer():
+    """Start a Timer if enabled, otherwise return None."""
+    if STATS_ENABLED:
+        return Timer()
+    return None
+
+def count(counter, n=1):
+    """Increment given counter, if enabled."""
+    if STATS_ENABLED:
+        _shard().counters[counter] += n
+
+
+def merged():
+    """Merge the shards of all threads."""
+    with _lock:
+        shards = list(_shards)
+    result = Stats()
+    for shard in shards:
+        result.merge(shard)
+    return result
+
+def stats():
+    """Return the counters, and the time per phase: a dict with 'records', 'bytes', 'dropped', 'truncated',
+    'time' (total seconds), 'per_record' (seconds) and 'phases': phase -> {'calls', 'total', 'mean'} (seconds)."""
+    s = merged()
+    result = dict(s.counters)
+    result['time'] = 1e-9 * sum(s.time_ns.values())
+    result['per_record'] = result['time'] / max(1, s.counters['records'])
+    result['phases'] = {phase: {'calls': s.calls[phase], 'total': 1e-9 * s.time_ns[phase], 'mean': 1e-9 * s.time_ns[phase] / max(1, s.calls[phase])}
+        for phase in PHASES}
+    return result
+
+def summary():
+    """One-line summary of stats()."""
+    s = stats()
+    phases = ', '.join('{} {:.2f}us'.format(phase, 1e6 * s['phases'][phase]['mean']) for phase in PHASES if s['phases'][phase]['calls'])
+    return 'extendedlogging overhead: {records} records, {bytes} bytes, {dropped} dropped, {truncated} truncated, '.format(**s) + \
+        '{:.1f}ms total, {:.2f}us per record ({})'.format(1e3 * s['time'], 1e6 * s['per_record'], phases)
+
+
+def _log_summary():
+    # runs before logging.shutdown (atexit handlers run in reverse order of registration), so it still reaches the handlers
+    if STATS_ENABLED:
+        logging.getLogger().info(summary())
+atexit.register(_log_summary)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=clear) # a child process counts its own overhead
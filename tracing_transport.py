@@ -0,0 +1,317 @@
+"""Shared memory transport: forked child processes hand their trace records to the parent, which alone writes the file.
+
+When enabled (configure option 'shared_memory'), each forked child process writes its formatted records into its own
+ring buffer in shared memory (multiprocessing.shared_memory), instead of appending to the trace file itself.
+A collector thread in the parent drains the rings every collect_interval seconds, and writes the records of all
+processes, including its own, in timestamp order. Records are held back merge_delay seconds to allow for the
+records of other processes to arrive, so the file needs no merge afterwards, and long lines are never interleaved.
+
+Each ring has a single producer (the child, its threads take a lock) and a single consumer (the collector),
+so the positions in the ring header need no inter-process lock: the producer only moves the head, the consumer the tail.
+The ring is a byte stream, a record larger than the ring is written in parts as the collector makes room.
+A child which forks itself announces the ring of its own child to the collector, via its own ring.
+A producer waits at most write_timeout seconds for room (collector gone or stuck), after which its records are dropped.
+A ring whose child does not announce its process id within start_timeout seconds (fork failed, child died early) is freed.
+
+Only forked children (the default multiprocessing start method on Linux) are covered: the rings are created at fork.
+"""
+__author__ = 'Jan Feitsma'
+
+
+import os
+import sys
+import time
+import heapq
+import struct
+import atexit
+import itertools
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+
+DEFAULT_RING_SIZE = 1 << 20 # bytes per child process
+DEFAULT_COLLECT_INTERVAL = 0.05 # seconds
+DEFAULT_MERGE_DELAY = 0.2 # seconds
+DEFAULT_WRITE_TIMEOUT = 5.0 # seconds
+DEFAULT_START_TIMEOUT = 10.0 # seconds, for the child to announce its process id
+WAIT_INTERVAL = 0.001 # seconds, producer polling for room
+
+# ring header: head (bytes written), tail (bytes read), producer pid, state; the data area starts cache line aligned
+HEADER = struct.Struct('<QQqQ')
+HEAD, TAIL, PID, STATE = (0, 8, 16, 24)
+UNKNOWN_PID = 0
+DATA_OFFSET = 64
+COUNTER = struct.Struct('<Q')
+OPEN, CLOSED, BROKEN = (0, 1, 2)
+
+# record frame: created timestamp, payload size, kind; the payload is utf-8
+FRAME = struct.Struct('<dIB')
+KIND_LINE, KIND_RING = (0, 1)
+
+# transports of all handlers, for the fork hooks
+_transports = weakref.WeakSet()
+
+
+
+class Ring():
+    """Byte ring buffer in shared memory, with one producer and one consumer process."""
+    def __init__(self, shm):
+        self.shm = shm
+        self.capacity = shm.size - DATA_OFFSET
+        self.lock = threading.Lock() # producer threads
+        self.partial = bytearray() # consumer: bytes of an incomplete frame
+        self.start_deadline = None # consumer: time.time() by which the producer has to announce its pid
+
+    @classmethod
+    def create(cls, size=DEFAULT_RING_SIZE, start_timeout=DEFAULT_START_TIMEOUT):
+        ring = cls(shared_memory.SharedMemory(create=True, size=DATA_OFFSET + size))
+        ring.set_producer(UNKNOWN_PID)
+        ring.start_deadline = time.time() + start_timeout
+        return ring
+
+    @classmethod
+    def attach(cls, name, start_timeout=DEFAULT_START_TIMEOUT):
+        ring = cls(shared_memory.SharedMemory(name=name))
+        ring.start_deadline = time.time() + start_timeout
+        return ring
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _get(self, offset):
+        return COUNTER.unpack_from(self.shm.buf, offset)[0]
+
+    def _set(self, offset, value):
+        # a single aligned 8-byte store, the other side never sees half of it
+        COUNTER.pack_into(self.shm.buf, offset, value)
+
+    def state(self):
+        return self._get(STATE)
+
+    def set_state(self, state):
+        self._set(STATE, state)
+
+    def set_producer(self, pid):
+        self._set(PID, pid)
+
+    def producer_alive(self):
+        pid = self._get(PID)
+        if pid == UNKNOWN_PID:
+            # the child did not start yet, or never will
+            return self.start_deadline is None or time.time() < self.start_deadline
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def write(self, created, payload, kind=KIND_LINE, timeout=DEFAULT_WRITE_TIMEOUT):
+        """Producer: append a frame, waiting for room if needed. Return False if the frame was dropped."""
+        data = FRAME.pack(created, len(payload), kind) + payload
+        with self.lock:
+            if self.state() != OPEN:
+                return False
+            buf = self.shm.buf
+            written = 0
+            deadline = None
+            while written < len(data):
+                head = self._get(HEAD)
+                room = self.capacity - (head - self._get(TAIL))
+                if room == 0:
+                    if deadline is None:
+                        deadline = time.time() + timeout
+                    elif time.time() >= deadline:
+                        # a partly written frame cannot be taken back, the collector discards the rest of the ring
+                        if written:
+                            self.set_state(BROKEN)
+                        return False
+                    time.sleep(WAIT_INTERVAL)
+                    continue
+                deadline = None
+                n = min(room, len(data) - written)
+                start = head % self.capacity
+                first = min(n, self.capacity - start)
+                buf[DATA_OFFSET + start:DATA_OFFSET + start + first] = data[written:written + first]
+                if first < n:
+                    buf[DATA_OFFSET:DATA_OFFSET + n - first] = data[written + first:written + n]
+                # the data is in place before the head moves
+                self._set(HEAD, head + n)
+                written += n
+        return True
+
+    def read(self):
+        """Consumer: take all bytes written so far."""
+        head = self._get(HEAD)
+        tail = self._get(TAIL)
+        if head == tail:
+            return b''
+        buf = self.shm.buf
+        start = tail % self.capacity
+        end = start + (head - tail)
+        if end <= self.capacity:
+            data = bytes(buf[DATA_OFFSET + start:DATA_OFFSET + end])
+        else:
+            data = bytes(buf[DATA_OFFSET + start:DATA_OFFSET + self.capacity]) + bytes(buf[DATA_OFFSET:DATA_OFFSET + end - self.capacity])
+        self._set(TAIL, head)
+        return data
+
+    def frames(self, data):
+        """Consumer: yield the complete frames as (created, kind, payload), keep the rest for the next read."""
+        self.partial += data
+        pos = 0
+        while len(self.partial) - pos >= FRAME.size:
+            (created, size, kind) = FRAME.unpack_from(self.partial, pos)
+            end = pos + FRAME.size + size
+            if end > len(self.partial):
+                break
+            yield (created, kind, bytes(self.partial[pos + FRAME.size:end]).decode('utf-8', 'replace'))
+            pos = end
+        del self.partial[:pos]
+
+    def release(self):
+        """Consumer: the producer is done, free the shared memory."""
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Transport():
+    """Shared memory transport of a trace file handler.
+
+    In the parent (collector) process, put() queues the lines of the process itself, and a thread merges them
+    with the lines from the rings of the child processes. In a forked child (producer), put() writes into its ring."""
+    def __init__(self, handler, ring_size=DEFAULT_RING_SIZE, collect_interval=DEFAULT_COLLECT_INTERVAL, merge_delay=DEFAULT_MERGE_DELAY, write_timeout=DEFAULT_WRITE_TIMEOUT, start_timeout=DEFAULT_START_TIMEOUT):
+        self.handler = handler
+        self.ring_size = ring_size
+        self.collect_interval = collect_interval
+        self.merge_delay = merge_delay
+        self.write_timeout = write_timeout
+        self.start_timeout = start_timeout
+        self.ring = None # producer: own ring
+        self.forking = None # ring for the child being forked
+        self.rings = [] # collector: rings of the children
+        self.pending = [] # collector: heap of (created, seq, line)
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.start()
+        _transports.add(self)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='extendedlogging-transport', daemon=True)
+        self.thread.start()
+
+    def put(self, created, line):
+        """Hand over a formatted line (including terminator) with its record creation time."""
+        if self.ring is not None:
+            return self.ring.write(created, line.encode('utf-8'), timeout=self.write_timeout)
+        with self.lock:
+            heapq.heappush(self.pending, (created, next(self.seq), line))
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.collect_interval):
+            # a failing collect must not stop the transport
+            try:
+                self.collect()
+            except Exception as e:
+                sys.stderr.write('extendedlogging: could not collect trace records: {}\n'.format(e))
+
+    def collect(self, final=False):
+        """Drain the rings, and write the lines older than merge_delay (all, if final) in timestamp order."""
+        with self.lock:
+            for ring in list(self.rings):
+                self.drain(ring)
+            cutoff = float('inf') if final else time.time() - self.merge_delay
+            lines = []
+            while self.pending and self.pending[0][0] <= cutoff:
+                lines.append(heapq.heappop(self.pending)[2])
+        if lines:
+            with self.handler.lock:
+                self.handler.write_chunk(''.join(lines))
+                self.handler.flush() # flush point of a compressed file, at most every flush_interval
+
+    def drain(self, ring):
+        # caller holds the lock; check for the end of the producer before reading, so nothing written after the read is lost
+        done = ring.state() != OPEN or not ring.producer_alive()
+        for (created, kind, payload) in ring.frames(ring.read()):
+            if kind == KIND_LINE:
+                heapq.heappush(self.pending, (created, next(self.seq), payload))
+            else:
+                self.rings.append(Ring.attach(payload, self.start_timeout))
+        if done:
+            self.rings.remove(ring)
+            ring.release()
+
+    def close(self):
+        """Collector: write all remaining lines and free the rings. Producer: tell the collector this process is done."""
+        if self.ring is not None:
+            self.ring.set_state(CLOSED)
+            return
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.collect(final=True)
+        with self.lock:
+            for ring in self.rings:
+                ring.release()
+            self.rings = []
+
+    def before_fork(self):
+        self.forking = Ring.create(self.ring_size, self.start_timeout)
+        if self.ring is not None:
+            # a child forks: its collector has to learn about the new ring
+            self.ring.write(time.time(), self.forking.name.encode('utf-8'), kind=KIND_RING, timeout=self.write_timeout)
+        else:
+            with self.lock:
+                self.rings.append(self.forking)
+
+    def after_fork_in_parent(self):
+        self.forking = None
+
+    def after_fork_in_child(self):
+        # from now on a producer; the lines and rings of the parent are for the parent to write and free
+        self.ring = self.forking
+        self.forking = None
+        self.ring.lock = threading.Lock()
+        self.ring.set_producer(os.getpid())
+        self.rings = []
+        self.pending = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.handler.detach_stream()
+        # multiprocessing children exit without atexit handlers and logging.shutdown, so close in their exit function
+        if 'multiprocessing' in sys.modules:
+            import multiprocessing.util
+            multiprocessing.util.register_after_fork(self, lambda t: multiprocessing.util.Finalize(t, t.close, exitpriority=0))
+
+
+def _before_fork():
+    for transport in list(_transports):
+        transport.before_fork()
+
+def _after_fork_in_parent():
+    for transport in list(_transports):
+        transport.after_fork_in_parent()
+
+def _after_fork_in_child():
+    for transport in list(_transports):
+        transport.after_fork_in_child()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent, after_in_child=_after_fork_in_child)
+
+
+def _close_at_exit():
+    # a child which exits without closing its handler (os.fork, no logging.shutdown)
+    for transport in list(_transports):
+        if transport.ring is not None:
+            transport.close()
+atexit.register(_close_at_exit)
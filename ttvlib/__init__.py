@@ -1,5 +1,17 @@
-import ttvlib.ttparse
-import ttvlib.ttstore
-import ttvlib.ttconvert
-import ttvlib.ttviewer
+# submodules are imported on first attribute access (for example ttvlib.ttconvert),
+# so that importing a single module, like ttvlib.ttparse, stays cheap
+
+import importlib
+
+SUBMODULES = ['ttparse', 'ttstore', 'ttconvert', 'ttviewer', 'ttprofile', 'ttperfetto', 'ttgenerate', 'ttcolumnar']
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module(__name__ + '.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(SUBMODULES))
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# Columnar datastore for ttviewer
+# writes the spans and events of a log as column arrays in a compressed numpy .npz file, for bulk analysis of many runs:
+#    columns = ttvlib.ttcolumnar.load('run.npz')
+#    slow = columns['span_duration_us'] > 1000
+#    names = columns['functions'][columns['span_function'][slow]]
+# the file is written without numpy (the .npy format is simple), numpy is only needed to read it
+# string tables are stored as utf-8 bytes ({name}_utf8) plus n+1 offsets ({name}_offsets), load() decodes them
+
+import sys
+import zipfile
+import itertools
+from array import array
+
+import ttvlib.ttstore as ttstore
+
+
+# span flags
+FLAG_ERROR = 1 # RETURN ERROR
+FLAG_UNCLOSED = 2 # auto-closed at the end of the log
+
+# columns, with their array typecode; integer codes index into the string tables
+SPAN_COLUMNS = {
+    'span_start_us': 'q',
+    'span_duration_us': 'q',
+    'span_function': 'i',
+    'span_file': 'i',
+    'span_line': 'i',
+    'span_pid': 'i',
+    'span_tid': 'i',
+    'span_depth': 'i',
+    'span_flags': 'b',
+}
+EVENT_COLUMNS = {
+    'event_time_us': 'q',
+    'event_level': 'i',
+    'event_function': 'i',
+    'event_file': 'i',
+    'event_line': 'i',
+    'event_pid': 'i',
+    'event_tid': 'i',
+    'event_message': 'i',
+}
+STRING_TABLES = ['functions', 'files', 'pids', 'tids', 'levels', 'messages']
+
+# npy format, version 1.0: https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_ALIGNMENT = 64
+BYTEORDER = '<' if sys.byteorder == 'little' else '>'
+
+
+
+class StringTable():
+    """Interns strings: each unique string gets a small integer code, in order of appearance."""
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def __call__(self, s):
+        s = '' if s is None else str(s)
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return code
+
+
+class TracingColumnarStore(ttstore.TracingStore):
+    """This data store collects spans (matched start- and end items) and events into column arrays, and writes them as .npz.
+
+    Timestamps and durations are integer microseconds. Functions, files, pids, tids, levels and event messages are interned:
+    their columns hold codes into string tables of the same name. Flows are not stored.
+    Memory usage is a few dozen bytes per span or event, plus the unique strings."""
+    def __init__(self, outputfilename):
+        ttstore.TracingStore.__init__(self)
+        self.outputfilename = outputfilename
+        self.columns = {name: array(typecode) for (name, typecode) in list(SPAN_COLUMNS.items()) + list(EVENT_COLUMNS.items())}
+        self.tables = {name: StringTable() for name in STRING_TABLES}
+
+    def close(self):
+        if self.closed:
+            return
+        ttstore.TracingStore.close(self)
+        self.write()
+
+    def _where(self, item):
+        (filename, _, lineno) = item.args.get('where', '').rpartition(',')
+        return (self.tables['files'](filename), int(lineno) if lineno.isdigit() else 0)
+
+    def handle_duration(self, start_item, end_item):
+        c = self.columns
+        start_us = round(ttstore.MAGIC_MICROSECOND_TIMESTAMP_SCALING * start_item.timestamp)
+        c['span_start_us'].append(start_us)
+        c['span_duration_us'].append(round(ttstore.MAGIC_MICROSECOND_TIMESTAMP_SCALING * end_item.timestamp) - start_us)
+        c['span_function'].append(self.tables['functions'](start_item.name))
+        (filecode, lineno) = self._where(start_item)
+        c['span_file'].append(filecode)
+        c['span_line'].append(lineno)
+        c['span_pid'].append(self.tables['pids'](start_item.pid))
+        c['span_tid'].append(self.tables['tids'](start_item.tid))
+        c['span_depth'].append(len(self.stack[(start_item.pid, start_item.tid)])) # the stack holds the callers
+        flags = 0
+        if end_item.data == 'ERROR':
+            flags |= FLAG_ERROR
+        elif end_item.data == 'UNCLOSED':
+            flags |= FLAG_UNCLOSED
+        c['span_flags'].append(flags)
+        self.count()
+
+    def handle_event_item(self, item):
+        c = self.columns
+        c['event_time_us'].append(round(ttstore.MAGIC_MICROSECOND_TIMESTAMP_SCALING * item.timestamp))
+        c['event_level'].append(self.tables['levels'](item.args.get('level')))
+        c['event_function'].append(self.tables['functions'](item.args.get('funcname')))
+        (filecode, lineno) = self._where(item)
+        c['event_file'].append(filecode)
+        c['event_line'].append(lineno)
+        c['event_pid'].append(self.tables['pids'](item.pid))
+        c['event_tid'].append(self.tables['tids'](item.tid))
+        c['event_message'].append(self.tables['messages'](item.data))
+        self.count()
+
+    def write(self):
+        columns = dict(self.columns)
+        for (name, table) in self.tables.items():
+            (columns[name + '_utf8'], columns[name + '_offsets']) = _encode_strings(table.strings)
+        write_npz(self.outputfilename, columns)
+
+
+
+def _encode_strings(strings):
+    # variable width: a fixed width unicode array would take 4 bytes times the longest string, per string
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('q', [0])
+    offsets.extend(itertools.accumulate(len(b) for b in encoded))
+    return (array('B', b''.join(encoded)), offsets)
+
+
+def _decode_strings(utf8, offsets):
+    data = utf8.tobytes()
+    return [data[a:b].decode('utf-8') for (a, b) in zip(offsets[:-1], offsets[1:])]
+
+
+def _npy(data):
+    # encode an array.array as .npy file content
+    kind = 'u' if data.typecode in 'BHILQ' else 'i'
+    descr = BYTEORDER + kind + str(data.itemsize)
+    if data.itemsize == 1:
+        descr = '|' + kind + '1'
+    payload = data.tobytes()
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, len(data))
+    # pad with spaces and a newline, so the data starts aligned
+    padding = NPY_ALIGNMENT - (len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT
+    header = (header + ' ' * (padding % NPY_ALIGNMENT) + '\n').encode('latin1')
+    return NPY_MAGIC + len(header).to_bytes(2, 'little') + header + payload
+
+
+def write_npz(filename, columns):
+    """Write a dict name -> array.array as compressed .npz file, as numpy.savez_compressed would."""
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+        for (name, data) in columns.items():
+            z.writestr(name + '.npy', _npy(data))
+
+
+def load(filename):
+    """Read a .npz file written by TracingColumnarStore, return a dict name -> numpy array (requires numpy).
+    The string tables are decoded into object arrays of str."""
+    import numpy
+    with numpy.load(filename) as data:
+        columns = dict(data)
+    for name in STRING_TABLES:
+        strings = _decode_strings(columns.pop(name + '_utf8'), columns.pop(name + '_offsets'))
+        columns[name] = numpy.array(strings, dtype=object)
+    return columns
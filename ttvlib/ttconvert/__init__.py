@@ -1,33 +1,49 @@
 # automatic import of all content in current folder
 # merging https://github.com/samwyse/sspp and https://stackoverflow.com/a/43059528
+# the plug-ins are imported on first use (registry.get() or attribute access), not on package import
 
 from glob import glob
 from keyword import iskeyword
 from os.path import dirname, join, split, splitext
-import logging
 import traceback
 import importlib
-logging.basicConfig()
 
 basedir = dirname(__file__)
+_loaded = False
 
-for name in glob(join(basedir, '*.py')):
-    module = splitext(split(name)[-1])[0]
-    if not module.startswith('_') and not iskeyword(module):
-        try:
-            # get a handle on the module
-            mdl = importlib.import_module(__name__+'.'+module)
-            # is there an __all__?  if so respect it
-            if "__all__" in mdl.__dict__:
-                names = mdl.__dict__["__all__"]
-            else:
-                # otherwise we import all names that don't begin with _
-                names = [x for x in mdl.__dict__ if not x.startswith("_")]
-            # now drag them in
-            globals().update({k: getattr(mdl, k) for k in names})
-        except:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning('Ignoring exception while loading the %r plug-in:', module)
-            print(traceback.format_exc())
+
+def load_plugins():
+    """Import all plug-in modules (once), which register their converters, and drag their names into this package."""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    import logging
+    logging.basicConfig()
+    for name in sorted(glob(join(basedir, '*.py'))):
+        module = splitext(split(name)[-1])[0]
+        if not module.startswith('_') and not iskeyword(module):
+            try:
+                # get a handle on the module
+                mdl = importlib.import_module(__name__+'.'+module)
+                # is there an __all__?  if so respect it
+                if "__all__" in mdl.__dict__:
+                    names = mdl.__dict__["__all__"]
+                else:
+                    # otherwise we import all names that don't begin with _
+                    names = [x for x in mdl.__dict__ if not x.startswith("_")]
+                # now drag them in
+                globals().update({k: getattr(mdl, k) for k in names})
+            except:
+                logger = logging.getLogger(__name__)
+                logger.warning('Ignoring exception while loading the %r plug-in:', module)
+                print(traceback.format_exc())
+
+
+def __getattr__(name):
+    # names provided by the plug-ins, for example Runner
+    load_plugins()
+    if name in globals():
+        return globals()[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
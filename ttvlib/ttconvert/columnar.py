@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# columnar converters: spans and events as column arrays in a .npz file, for bulk analysis with numpy or pandas
+
+
+# own imports
+import ttvlib.ttparse as ttparse
+import ttvlib.ttcolumnar as ttcolumnar
+import ttvlib.ttconvert.registry as registry
+
+
+
+def _convert_log2npz(tracefilename, npzfilename):
+    s = ttcolumnar.TracingColumnarStore(npzfilename)
+    ttparse.parse_into(tracefilename, s, _convert_log2npz.parser)
+    s.close()
+    return s.size
+_convert_log2npz.parser = ttparse.BulkLoggingParser()
+
+
+def _convert_jsonl2npz(tracefilename, npzfilename):
+    s = ttcolumnar.TracingColumnarStore(npzfilename)
+    ttparse.parse_into(tracefilename, s, _convert_jsonl2npz.parser)
+    s.close()
+    return s.size
+_convert_jsonl2npz.parser = ttparse.JsonLinesParser()
+
+
+for mask in ttparse.LOG_FILE_MASKS:
+    registry.add_file(_convert_log2npz, mask, '*.npz')
+for mask in ttparse.JSONL_FILE_MASKS:
+    registry.add_file(_convert_jsonl2npz, mask, '*.npz')
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+# flamegraph converters: collapsed (folded) stack format, as understood by flamegraph.pl, speedscope, inferno etc.
+
+
+# own imports
+import ttvlib.ttparse as ttparse
+import ttvlib.ttprofile as ttprofile
+import ttvlib.ttconvert.registry as registry
+
+
+
+def _convert_log2collapsed(tracefilename, collapsedfilename):
+    s = ttprofile.TracingCollapsedStore(collapsedfilename)
+    ttparse.parse_into(tracefilename, s, _convert_log2collapsed.parser)
+    s.close()
+    return len(s.stacks)
+_convert_log2collapsed.parser = ttparse.BulkLoggingParser()
+
+
+for mask in ttparse.LOG_FILE_MASKS:
+    registry.add_file(_convert_log2collapsed, mask, '*.collapsed')
+    registry.add_file(_convert_log2collapsed, mask, '*.folded')
+
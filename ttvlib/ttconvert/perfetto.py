@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+# perfetto converters: native protobuf trace, which opens directly in https://ui.perfetto.dev (no trace2html step)
+
+
+# own imports
+import ttvlib.ttparse as ttparse
+import ttvlib.ttperfetto as ttperfetto
+import ttvlib.ttconvert.registry as registry
+
+
+
+def _convert_log2perfetto(tracefilename, perfettofilename):
+    s = ttperfetto.TracingPerfettoStore(perfettofilename)
+    ttparse.parse_into(tracefilename, s, _convert_log2perfetto.parser)
+    s.close()
+    return s.size
+_convert_log2perfetto.parser = ttparse.BulkLoggingParser()
+
+
+for mask in ttparse.LOG_FILE_MASKS:
+    registry.add_file(_convert_log2perfetto, mask, '*.pftrace')
+    registry.add_file(_convert_log2perfetto, mask, '*.perfetto-trace')
+
@@ -22,11 +22,12 @@ class FolderHandler():
         return self.desc
 
 class FileHandler():
-    def __init__(self, handler, mask):
+    def __init__(self, handler, mask, output):
         self.handler = handler
         self.mask = mask
+        self.output = output
     def __repr__(self):
-        return 'mask ' + self.mask
+        return 'mask ' + self.mask + ' -> ' + self.output
 
 class Registry():
     def __init__(self):
@@ -42,14 +43,16 @@ class Registry():
 _registry = Registry()
 
 def get():
-    """Get a handle to the registry."""
+    """Get a handle to the registry. The plug-ins, which fill it, are imported on first use."""
+    import ttvlib.ttconvert
+    ttvlib.ttconvert.load_plugins()
     return _registry
 
 def add_folder(handler, pruner=None):
     """Register folder handler. The prune option is needed to disambiguate."""
     _registry.folder_handlers.append(FolderHandler(handler, pruner))
 
-def add_file(handler, mask):
-    """Register file handler."""
-    _registry.file_handlers.append(FileHandler(handler, mask))
+def add_file(handler, mask, output='*.json'):
+    """Register file handler. The output mask selects the converter in case multiple handlers accept the same input."""
+    _registry.file_handlers.append(FileHandler(handler, mask, output))
 
@@ -10,9 +10,14 @@ import shutil
 import time
 from fnmatch import fnmatch
 
+import ttvlib.ttparse as ttparse
 import ttvlib.ttconvert.registry as registry
 
 
+# size limit of compressed input files is checked against an estimate of the uncompressed size
+# (tracing files are very repetitive, so gzip and zstd typically achieve at least this ratio)
+COMPRESSION_RATIO_ESTIMATE = 10.0
+
 
 class Runner():
     def __init__(self, tmpdir, inputfiles, outputhtmlfile, sizelimit_mb):
@@ -20,7 +25,7 @@ class Runner():
         self.inputfiles = inputfiles
         self.outputhtmlfile = outputhtmlfile
         self.sizelimit_mb = sizelimit_mb
-        self.messager = lambda x: None
+        self.messager = lambda message, newline=True: None
         self.dryrun = False
         self.registry = registry.get()
         self.jsons = []
@@ -37,6 +42,15 @@ class Runner():
         jsonfile = self.merge() # merge is skipped in case of 1 json file
         self.convert(jsonfile, os.path.join(self.tmpdir, 'ttviewer.html'))
 
+    def export(self, outputfile):
+        """Convert a single input file (or a set of rotated segments) to given output file, instead of producing html."""
+        groups = ttparse.group_segments(self.inputfiles)
+        if len(groups) != 1 or not all(os.path.isfile(f) for f in groups[0]):
+            raise Exception('expected a single input file')
+        for f in groups[0]:
+            self._check_size(f)
+        self.convert(self._unpack(groups[0]), outputfile)
+
     def run_dir(self, inputdir):
         """Run on a directory."""
         if len(self.registry.folder_handlers) == 0:
@@ -56,11 +70,11 @@ class Runner():
             assert os.path.isfile(f), 'cannot mix files with folder: ' + f
         # size check
         for f in inputfiles:
-            if os.path.getsize(f) / 1024.0**2 > self.sizelimit_mb:
-                raise Exception('input file size ({}) of {} exceeds limit of {:.1f}MB'.format(f, self._filesize(f), self.sizelimit_mb))
-        # run
-        for f in inputfiles:
-            if f.endswith('.json'):
+            self._check_size(f)
+        # run, rotated segments of the same log are converted together
+        for group in ttparse.group_segments(inputfiles):
+            f = self._unpack(group)
+            if isinstance(f, str) and f.endswith('.json'):
                 self.copy(f)
             else:
                 self.convert(f)
@@ -78,25 +92,34 @@ class Runner():
         shutil.copy(f, self.tmpdir)
 
     def convert(self, srcfile, tgtfile=None):
-        """Convert a single file."""
-        # get converter
-        converter = self._get_file_handler(srcfile)
+        """Convert a single file, or a list of rotated segments (oldest first)."""
+        # the current (last) segment determines names and converter
+        srcname = srcfile
+        if not isinstance(srcfile, str):
+            srcname = srcfile[-1]
         # determine target file and register it
         if tgtfile is None:
-            tgtfile = os.path.join(self.tmpdir, os.path.basename(srcfile) + '.json')
+            tgtfile = os.path.join(self.tmpdir, os.path.basename(srcname) + '.json')
         self.jsons.append(tgtfile)
+        # get converter
+        converter = self._get_file_handler(srcname, tgtfile)
         # message
         begin_message = 'Converting'
         if self.dryrun:
             begin_message = 'dryrun: Convert'
         def describe_converter(converter):
+            if hasattr(converter, 'describe'):
+                return converter.describe()
             if hasattr(converter, 'tool'):
                 return 'tool: ' + os.path.basename(converter.tool)
             if hasattr(converter, 'parser'):
                 return 'parser: ' + type(converter.parser).__name__
             # just show function name
             return converter.__name__
-        self.messager('{} {} ({}) to {} using {} ...'.format(begin_message, srcfile, self._filesize(srcfile), tgtfile, describe_converter(converter)), newline=self.dryrun)
+        srcdesc = '{} ({})'.format(srcname, self._filesize(srcname))
+        if srcname != srcfile:
+            srcdesc += ' and {} older segments'.format(len(srcfile) - 1)
+        self.messager('{} {} to {} using {} ...'.format(begin_message, srcdesc, tgtfile, describe_converter(converter)), newline=self.dryrun)
         # stop in case of dryrun
         if self.dryrun:
             return
@@ -142,10 +165,25 @@ class Runner():
             return '{:.1f}MB'.format(numbytes / 1024.0**2)
         return '{:.1f}GB'.format(numbytes / 1024.0**3)
 
-    def _get_file_handler(self, f):
-        bb = [fnmatch(os.path.basename(f), fh.mask) for fh in self.registry.file_handlers]
+    @staticmethod
+    def _unpack(group):
+        if len(group) == 1:
+            return group[0]
+        return group
+
+    def _check_size(self, f):
+        numbytes = os.path.getsize(f)
+        compressed = ''
+        if ttparse.compression(f):
+            numbytes *= COMPRESSION_RATIO_ESTIMATE
+            compressed = ', estimated uncompressed size {:.1f}MB'.format(numbytes / 1024.0**2)
+        if numbytes / 1024.0**2 > self.sizelimit_mb:
+            raise Exception('input file size ({}) of {}{} exceeds limit of {:.1f}MB'.format(f, self._filesize(f), compressed, self.sizelimit_mb))
+
+    def _get_file_handler(self, f, tgtfile):
+        bb = [fnmatch(os.path.basename(f), fh.mask) and fnmatch(os.path.basename(tgtfile), fh.output) for fh in self.registry.file_handlers]
         if sum(bb) == 0:
-            raise Exception('none of the registered file masks apply to {}\n{}'.format(f, self.registry))
+            raise Exception('none of the registered file masks apply to {} -> {}\n{}'.format(f, tgtfile, self.registry))
         if sum(bb) > 1:
             raise Exception('multiple file masks apply\n{}'.format(self.registry))
         return self.registry.file_handlers[bb.index(True)].handler
@@ -7,6 +7,8 @@ __author__ = 'Jan Feitsma'
 
 # system imports
 import os
+import zlib
+import base64
 import shutil
 import subprocess
 
@@ -23,11 +25,18 @@ import ttvlib.ttconvert.registry as registry
 #    ln -s /pathto/catapult_py3/tracing/bin/trace2html
 CATAPULT_TRACE_JSON2HTML = 'trace2html'
 
+# by default, html is rendered using the built-in viewer template, which is much faster and needs no external tools
+# catapult trace2html is used only on request (ttviewer option --catapult)
+USE_CATAPULT = False
+HTML_TEMPLATE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ttviewer_template.html')
+HTML_TEMPLATE_PLACEHOLDER = '@TRACE_DATA@'
+HTML_CHUNK_SIZE = 3 * 2**20 # multiple of 3, to keep base64 chunks concatenable
+
 # allow commenting lines
-IGNORE_LINE_CHAR = '#'
+IGNORE_LINE_CHAR = ttparse.IGNORE_LINE_CHAR
 
 # extendedlogging can write format spec as first line in the tracing file (option 'write_format_header')
-LOGFILE_FORMAT_SPEC = '# format: '
+LOGFILE_FORMAT_SPEC = ttparse.LOGFILE_FORMAT_SPEC
 
 
 def _find_utility(utility):
@@ -45,43 +54,71 @@ def _find_utility(utility):
 
 def _convert_log(tracefilename, tmpjsonfilename):
     return parse_and_create_json(tracefilename, tmpjsonfilename, _convert_log.parser)
-_convert_log.parser = ttparse.LoggingParser()
+_convert_log.parser = ttparse.BulkLoggingParser()
+
+
+def _convert_jsonl(tracefilename, tmpjsonfilename):
+    return parse_and_create_json(tracefilename, tmpjsonfilename, _convert_jsonl.parser)
+_convert_jsonl.parser = ttparse.JsonLinesParser()
 
 
 def _convert_json2html(jsonfile, htmlfile):
-    cmd = '{} {} --quiet --output={}'.format(_convert_json2html.tool, jsonfile, htmlfile)
+    if USE_CATAPULT:
+        _convert_json2html_catapult(jsonfile, htmlfile)
+    else:
+        _convert_json2html_builtin(jsonfile, htmlfile)
+def _describe_json2html():
+    if USE_CATAPULT:
+        return 'tool: ' + os.path.basename(CATAPULT_TRACE_JSON2HTML)
+    return 'template: ' + os.path.basename(HTML_TEMPLATE)
+_convert_json2html.describe = _describe_json2html
+
+
+def _convert_json2html_catapult(jsonfile, htmlfile):
+    if _convert_json2html_catapult.tool is None:
+        _convert_json2html_catapult.tool = _find_utility(CATAPULT_TRACE_JSON2HTML)
+    cmd = '{} {} --quiet --output={}'.format(_convert_json2html_catapult.tool, jsonfile, htmlfile)
     subprocess.run(cmd, shell=True, check=True)
-_convert_json2html.tool = _find_utility(CATAPULT_TRACE_JSON2HTML)
+_convert_json2html_catapult.tool = None
+
+
+def _convert_json2html_builtin(jsonfile, htmlfile):
+    # single pass: json is read in chunks, gzip-compressed and base64-encoded straight into the template
+    head, tail = _load_template()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container, as expected by browser DecompressionStream
+    pending = b''
+    with open(jsonfile, 'rb') as fin, open(htmlfile, 'w') as fout:
+        fout.write(head)
+        for chunk in iter(lambda: fin.read(HTML_CHUNK_SIZE), b''):
+            pending += compressor.compress(chunk)
+            n = len(pending) - len(pending) % 3
+            fout.write(base64.b64encode(pending[:n]).decode('ascii'))
+            pending = pending[n:]
+        pending += compressor.flush()
+        fout.write(base64.b64encode(pending).decode('ascii'))
+        fout.write(tail)
+
+
+def _load_template():
+    # the template is read and split only once
+    if _load_template.cache is None:
+        with open(HTML_TEMPLATE, 'r') as f:
+            head, tail = f.read().split(HTML_TEMPLATE_PLACEHOLDER)
+        _load_template.cache = (head, tail)
+    return _load_template.cache
+_load_template.cache = None
 
 
 def parse_and_create_json(inputfilename, outputfilename, parser):
     s = ttstore.TracingJsonStore(outputfilename)
-    with open(inputfilename, 'r') as f:
-        lc = 0
-        for line in f:
-            line = line.strip()
-            lc += 1
-            # optionally configure parser
-            if line.startswith(LOGFILE_FORMAT_SPEC):
-                parser.configure(line.replace(LOGFILE_FORMAT_SPEC, ''))
-                continue
-            # ignore line?
-            if line.startswith(IGNORE_LINE_CHAR):
-                continue
-            # regular line parsing
-            try:
-                r = parser(line)
-            except ttparse.ParseError as e:
-                raise type(e)('at line {}: {}'.format(lc, str(e))) from None
-            # r is None, for a to-be-ignored line
-            if r:
-                try:
-                    s.add(r)
-                except Exception as e:
-                    raise type(e)('at line {}: {}'.format(lc, str(e))) from None
+    ttparse.parse_into(inputfilename, s, parser)
+    s.close()
     return s.size
 
 
-registry.add_file(_convert_log, '*.log')
-registry.add_file(_convert_json2html, '*.json')
+for mask in ttparse.LOG_FILE_MASKS:
+    registry.add_file(_convert_log, mask)
+for mask in ttparse.JSONL_FILE_MASKS:
+    registry.add_file(_convert_jsonl, mask)
+registry.add_file(_convert_json2html, '*.json', '*.html')
 
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+
+'''ttgenerate: write synthetic logging/tracing data, to load-test the analysis tools at scale.
+
+The output looks like a tracing file written by extendedlogging, in any supported '# format: ' header variant.
+Processes and threads (or asyncio tasks) are simulated as lanes, each running repeated call trees of given depth
+and (average) fanout, with INFO events in between. Lanes are interleaved in time slices, as on a real machine.
+Frames can be left unclosed, as happens when a program is killed.
+
+The output size is given in lines and/or bytes (for example 2G), output is gzip-compressed if the filename ends with .gz.
+Generation is deterministic for a given seed.
+'''
+
+__author__ = 'Jan Feitsma'
+
+
+# system imports
+import sys
+import gzip
+import time
+import random
+import argparse
+
+# own imports
+import ttvlib.ttparse as ttparse
+
+
+# format header variants, as written by extendedlogging (see its configure options)
+def _format_spec(*fields):
+    return ttparse.FORMAT_SPEC_SEPARATOR.join(['%(asctime)s', '%(levelname)s'] + list(fields) + ['%(filename)s,%(lineno)d', '%(funcName)s', '%(message)s'])
+FORMATS = {
+    'default': ttparse.DEFAULT_FORMAT_SPEC,
+    'threads': _format_spec('%(threadName)s'),
+    'processes': _format_spec('%(processName)s', '%(threadName)s'),
+    'tasks': _format_spec('%(taskName)s'),
+    'monotonic': _format_spec('%(perf_ns)s', '%(duration_ns)s'),
+    'full': _format_spec('%(perf_ns)s', '%(duration_ns)s', '%(processName)s', '%(threadName)s', '%(taskName)s'),
+}
+DEFAULT_FORMAT = 'default'
+
+# defaults
+DEFAULT_LINES = 10**5
+DEFAULT_DEPTH = 6
+DEFAULT_FANOUT = 3 # average number of callees per call
+DEFAULT_EVENTS = 0.1 # average number of events per call
+DEFAULT_PAYLOAD = 8 # characters of argument data per call
+DEFAULT_SEED = 0
+
+# timing: lines are a few microseconds apart, lanes run in time slices of a few lines
+START_TIME_US = 1600000000 * 10**6
+LINE_INTERVAL_US = 5
+SLICE_LINES = 8
+
+SIZE_SUFFIXES = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+
+
+
+class OptionError(Exception):
+    pass
+
+
+def parse_size(s):
+    '''Parse a byte size such as 1500, 100M or 2G.'''
+    s = str(s).strip().upper()
+    factor = 1
+    if s and s[-1] in SIZE_SUFFIXES:
+        factor = SIZE_SUFFIXES[s[-1]]
+        s = s[:-1]
+    try:
+        return int(float(s) * factor)
+    except ValueError:
+        raise OptionError('invalid size: "{}"'.format(s)) from None
+
+
+class Lane:
+    '''A simulated thread of execution: yields (levelname, filename, lineno, funcName, message) tuples, until told to stop.'''
+    def __init__(self, rng, depth, fanout, events, payload, unclosed, values):
+        self.rng = rng
+        self.depth = depth
+        self.fanout = fanout
+        self.events = events
+        self.payload = repr('x' * payload)
+        self.unclosed = unclosed
+        self.values = values # lane-specific format values (processName, threadName, taskName)
+        self.stack = [] # perf_ns at start of each open frame, for duration_ns
+        self.calls = 0
+        self.stopped = False
+        self.records = self._records()
+
+    def _records(self):
+        # outer frames which never return
+        for it in range(self.unclosed):
+            yield ('TRACE', 'main.py', 1 + it, 'outer{}'.format(it), 'CALL *() **{}')
+        while not self.stopped:
+            yield from self._call(0, 0)
+
+    def _call(self, level, index):
+        self.calls += 1
+        n = self.calls
+        filename = 'module{}.py'.format(level)
+        funcname = 'func{}_{}'.format(level, index)
+        lineno = 1 + 10 * index
+        yield ('TRACE', filename, lineno, funcname, 'CALL *({}, {}) **{{}}'.format(n, self.payload))
+        for it in range(int(self.events) + (self.rng.random() < self.events % 1)):
+            yield ('INFO', filename, lineno + 1, funcname, 'event {} {}'.format(n, it))
+        if level < self.depth:
+            for child in range(self.rng.randint(0, 2 * self.fanout)):
+                if self.stopped:
+                    break
+                yield from self._call(level + 1, child)
+        yield ('TRACE', filename, lineno, funcname, 'RETURN {}'.format(n))
+
+
+def make_lanes(rng, format_spec, processes=1, threads=1, **kwargs):
+    '''One lane per process and thread. Lanes must be distinguishable in the log, otherwise their calls would not nest.'''
+    fields = format_spec.split(ttparse.FORMAT_SPEC_SEPARATOR)
+    if processes > 1 and '%(processName)s' not in fields:
+        raise OptionError('multiple processes require %(processName)s in the format')
+    if threads > 1 and '%(threadName)s' not in fields and '%(taskName)s' not in fields:
+        raise OptionError('multiple threads require %(threadName)s or %(taskName)s in the format')
+    lanes = []
+    for p in range(processes):
+        for t in range(threads):
+            values = {
+                'processName': 'Process-{}'.format(p) if p else 'MainProcess',
+                'threadName': 'Thread-{}'.format(t) if t else 'MainThread',
+                'taskName': 'Task-{}'.format(t + 1),
+            }
+            lanes.append(Lane(rng, values=values, **kwargs))
+    return lanes
+
+
+def generate(output, lines=None, size=None, format_spec=FORMATS[DEFAULT_FORMAT], processes=1, threads=1, depth=DEFAULT_DEPTH,
+        fanout=DEFAULT_FANOUT, events=DEFAULT_EVENTS, payload=DEFAULT_PAYLOAD, unclosed=0, seed=DEFAULT_SEED):
+    '''Write the format header and synthetic lines to given text stream, until given number of lines or bytes is reached.
+    Then the lanes finish their open calls (except the unclosed frames). Return the number of lines written.'''
+    if lines is None and size is None:
+        lines = DEFAULT_LINES
+    ttparse.LoggingParser().configure(format_spec) # raises FormatError on unsupported fields
+    rng = random.Random(seed)
+    lanes = make_lanes(rng, format_spec, processes, threads, depth=depth, fanout=fanout, events=events, payload=payload, unclosed=unclosed)
+    header = ttparse.LOGFILE_FORMAT_SPEC + format_spec + '\n'
+    output.write(header)
+    count = 0
+    nbytes = len(header)
+    t_us = START_TIME_US
+    second = None
+    values = {'perf_ns': 0, 'duration_ns': '-'}
+    active = list(lanes)
+    while active:
+        lane = active[rng.randrange(len(active))]
+        values.update(lane.values)
+        for it in range(rng.randint(1, 2 * SLICE_LINES)):
+            record = next(lane.records, None)
+            if record is None:
+                active.remove(lane)
+                break
+            (levelname, filename, lineno, funcname, message) = record
+            t_us += LINE_INTERVAL_US
+            if t_us // 10**6 != second:
+                second = t_us // 10**6
+                second_str = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(second))
+            perf_ns = 1000 * (t_us - START_TIME_US)
+            duration_ns = '-'
+            if levelname == 'TRACE':
+                if message.startswith('CALL'):
+                    lane.stack.append(perf_ns)
+                else:
+                    duration_ns = perf_ns - lane.stack.pop()
+            values.update(asctime='{},{:06d}'.format(second_str, t_us % 10**6), levelname=levelname, filename=filename, lineno=lineno,
+                funcName=funcname, message=message, perf_ns=perf_ns, duration_ns=duration_ns)
+            line = format_spec % values + '\n'
+            output.write(line)
+            count += 1
+            nbytes += len(line)
+            if (lines is not None and count >= lines) or (size is not None and nbytes >= size):
+                for l in lanes:
+                    l.stopped = True
+    return count
+
+
+def write(filename, **kwargs):
+    '''Generate into given file (gzip-compressed if it ends with .gz), return the number of lines written.'''
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'wt')
+    else:
+        f = open(filename, 'w')
+    with f:
+        return generate(f, **kwargs)
+
+
+
+def parse_args():
+    descriptionTxt = __doc__
+    exampleTxt = '''Example: ttgenerate /tmp/big.log --size 2G --format processes --processes 4 --threads 8 --unclosed 2
+Format is one of {}, or a literal format specification.
+'''.format(', '.join(FORMATS))
+    class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        def __init__(self, prog):
+            argparse.ArgumentDefaultsHelpFormatter.__init__(self, prog, max_help_position=36)
+            argparse.RawDescriptionHelpFormatter.__init__(self, prog, max_help_position=36)
+    parser = argparse.ArgumentParser(description=descriptionTxt, epilog=exampleTxt, formatter_class=CustomFormatter)
+    parser.add_argument('-n', '--lines', type=int, default=None, help='number of lines to write (default {} if no size is given)'.format(DEFAULT_LINES))
+    parser.add_argument('-s', '--size', type=parse_size, default=None, help='number of (uncompressed) bytes to write, for example 100M or 2G')
+    parser.add_argument('-f', '--format', dest='format_spec', default=DEFAULT_FORMAT, help='format header variant')
+    parser.add_argument('-p', '--processes', type=int, default=1, help='number of processes')
+    parser.add_argument('-t', '--threads', type=int, default=1, help='number of threads (or tasks) per process')
+    parser.add_argument('-d', '--depth', type=int, default=DEFAULT_DEPTH, help='call tree depth')
+    parser.add_argument('-F', '--fanout', type=int, default=DEFAULT_FANOUT, help='average number of callees per call')
+    parser.add_argument('-e', '--events', type=float, default=DEFAULT_EVENTS, help='average number of events per call')
+    parser.add_argument('-P', '--payload', type=int, default=DEFAULT_PAYLOAD, help='argument data per call, in characters')
+    parser.add_argument('-u', '--unclosed', type=int, default=0, help='number of frames per lane which are never closed')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='random seed')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not report the result')
+    parser.add_argument('filename', help='output file, .log or .log.gz')
+    args = parser.parse_args()
+    args.format_spec = FORMATS.get(args.format_spec, args.format_spec)
+    return args
+
+
+def run(filename, quiet=False, **kwargs):
+    t_start = time.perf_counter()
+    count = write(filename, **kwargs)
+    if not quiet:
+        sys.stdout.write('wrote {} lines to {} in {:.1f}s\n'.format(count, filename, time.perf_counter() - t_start))
+    return count
+
@@ -6,18 +6,62 @@ __author__ = 'Jan Feitsma'
 
 
 # system imports
+import os
 import re
+import json
+import zlib
+import codecs
 import datetime
+from fnmatch import fnmatch
 from collections import defaultdict
 
 # own imports
 import ttvlib.ttstore as ttstore
 
+# optional imports
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 # default format produced by extendedlogging:
 FORMAT_SPEC_SEPARATOR = ':'
 DEFAULT_FORMAT_SPEC = FORMAT_SPEC_SEPARATOR.join(['%(asctime)s', '%(levelname)s', '%(filename)s,%(lineno)d', '%(funcName)s', '%(message)s'])
 
+# allow commenting lines
+IGNORE_LINE_CHAR = '#'
+
+# extendedlogging can write format spec as first line in the tracing file (option 'write_format_header')
+LOGFILE_FORMAT_SPEC = '# format: '
+
+# extendedlogging marks rotated segments which continue a previous one (the start of open calls is in an older segment)
+LOGFILE_CONTINUED_MARK = '# continued'
+
+# extendedlogging can log flow events (option 'flows', or flow_start/flow_end): message is keyword plus flow id
+FLOW_TYPES = {'FLOW_START': 's', 'FLOW_END': 'f'}
+
+# extendedlogging can write compressed tracing files (option 'compression'), these are decompressed transparently
+COMPRESSED_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+LOG_FILE_MASKS = ['*.log'] + ['*.log' + suffix for suffix in COMPRESSED_SUFFIXES]
+
+# extendedlogging can write structured tracing files (file_format='jsonl'): one json object per line
+JSONL_FORMAT_SPEC = 'jsonl'
+JSONL_FILE_MASKS = ['*.jsonl'] + ['*.jsonl' + suffix for suffix in COMPRESSED_SUFFIXES]
+READ_CHUNK_SIZE = 2**20
+
+# extendedlogging can rotate tracing files (options 'max_bytes', 'max_age'): name.log is current, name.1.log previous, etc.
+SEGMENT_REGEX = re.compile(r'^(.*)\.(\d+)(\.(?:log|jsonl)(?:' + '|'.join(re.escape(suffix) for suffix in COMPRESSED_SUFFIXES) + r')?)$')
+
+
+# bulk parsing of the default format (BulkLoggingParser, requires numpy): lines are parsed in batches,
+# the timestamp has a fixed layout 'YYYY-mm-dd HH:MM:SS,ffffff' and is followed by the first separator
+BULK_LINES = 2**14
+TIMESTAMP_WIDTH = 26
+TIMESTAMP_SEPARATORS = {4: '-', 7: '-', 10: ' ', 13: ':', 16: ':', 19: ',', TIMESTAMP_WIDTH: FORMAT_SPEC_SEPARATOR}
+TIMESTAMP_FIELDS = [(0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19), (20, 26)] # year, month, day, hour, minute, second, microsecond
+MESSAGE_PREFIXES = {'CALL ': 'B', 'RETURN ': 'E'}
+
 
 class ParseError(Exception):
     pass
@@ -36,13 +80,22 @@ class LoggingParser():
         field_to_type['%(asctime)s'] = 'timestamp'
         field_to_type['%(processName)s'] = 'pid'
         field_to_type['%(threadName)s'] = 'tid'
+        field_to_type['%(taskName)s'] = 'task'
         field_to_type['%(levelname)s'] = 'eventlevel'
         field_to_type['%(filename)s,%(lineno)d'] = 'where'
         field_to_type['%(funcName)s'] = 'funcname'
         field_to_type['%(message)s'] = 'data'
+        field_to_type['%(perf_ns)s'] = 'perf_ns'
+        field_to_type['%(perf_ns)d'] = 'perf_ns'
+        field_to_type['%(duration_ns)s'] = 'duration_ns'
         format_fields = format_spec.split(FORMAT_SPEC_SEPARATOR)
         self.tid_in_log = '%(threadName)s' in format_fields
         self.pid_in_log = '%(processName)s' in format_fields
+        self.task_in_log = '%(taskName)s' in format_fields
+        # extendedlogging option 'monotonic_timing'
+        self.perf_in_log = '%(perf_ns)s' in format_fields or '%(perf_ns)d' in format_fields
+        self.duration_in_log = '%(duration_ns)s' in format_fields
+        self.monotonic_offset = {} # per process: wall clock time (s) minus monotonic time (ns), at first item
         class FieldIndexMap(object):
             pass
         self.field_to_idx = FieldIndexMap()
@@ -83,12 +136,12 @@ class LoggingParser():
             raise ParseError('regex match failure: ' + str(regex))
         return handle(itemtype, match.groups())
 
-    def _handle_trace(self, itemtype, regexmatch):
-        ts = regexmatch[self.field_to_idx.timestamp]
+    def _handle_trace(self, itemtype, regexmatch, timestamp=None):
         where = regexmatch[self.field_to_idx.where]
         funcname = regexmatch[self.field_to_idx.funcname]
         data = regexmatch[self.field_to_idx.data]
-        timestamp = self.parse_timestamp(ts)
+        if timestamp is None:
+            timestamp = self.parse_timestamp(regexmatch[self.field_to_idx.timestamp])
         kwargs = {'where': where}
         result = ttstore.TracingItem(timestamp, itemtype, funcname, data, **kwargs)
         # pid/tid
@@ -96,6 +149,8 @@ class LoggingParser():
             result.pid = regexmatch[self.field_to_idx.pid]
         if self.tid_in_log:
             result.tid = regexmatch[self.field_to_idx.tid]
+        self._handle_task(result, regexmatch)
+        self._handle_monotonic(result, regexmatch)
         # do some extra work in case the io labeling option is set
         if itemtype == 'B' and ttstore.INCLUDE_IO_IN_NAME:
             s = data
@@ -107,23 +162,53 @@ class LoggingParser():
             result.sdata = s
         return result
 
-    def _handle_event(self, itemtype, regexmatch):
-        ts = regexmatch[self.field_to_idx.timestamp]
+    def _handle_event(self, itemtype, regexmatch, timestamp=None):
         eventlevel = regexmatch[self.field_to_idx.eventlevel]
         where = regexmatch[self.field_to_idx.where]
         funcname = regexmatch[self.field_to_idx.funcname]
         data = regexmatch[self.field_to_idx.data]
-        timestamp = self.parse_timestamp(ts)
+        if timestamp is None:
+            timestamp = self.parse_timestamp(regexmatch[self.field_to_idx.timestamp])
         # from documentation: The s property specifies the scope of the event. There are four scopes available global (g), process (p) and thread (t)
         kwargs = {'where': where, 'level': eventlevel, 'funcname': funcname, 'snapshot': None}
         result = ttstore.TracingItem(timestamp, itemtype, 'EVENT', data, **kwargs)
+        words = data.split()
+        if len(words) == 2 and words[0] in FLOW_TYPES:
+            result = ttstore.TracingItem(timestamp, FLOW_TYPES[words[0]], 'flow', data, where=where)
+            result.flow_id = words[1]
         # pid/tid
         if self.pid_in_log:
             result.pid = regexmatch[self.field_to_idx.pid]
         if self.tid_in_log:
             result.tid = regexmatch[self.field_to_idx.tid]
+        self._handle_task(result, regexmatch)
+        self._handle_monotonic(result, regexmatch)
         return result
 
+    def _handle_task(self, result, regexmatch):
+        '''Each asyncio task gets its own lane: interleaved tasks on one thread do not nest.'''
+        if self.task_in_log:
+            task = regexmatch[self.field_to_idx.task]
+            if task != '-': # outside of tasks
+                result.tid = task if result.tid is None else '{}/{}'.format(result.tid, task)
+
+    def _handle_monotonic(self, result, regexmatch):
+        '''Map monotonic nanosecond timestamps onto the wall clock timeline, anchored at the first item of each process.
+        This gives sub-microsecond resolution, unaffected by clock adjustments.'''
+        if self.perf_in_log:
+            perf_ns = regexmatch[self.field_to_idx.perf_ns]
+            if perf_ns.isdigit():
+                perf_ns = int(perf_ns)
+                if result.pid not in self.monotonic_offset:
+                    self.monotonic_offset[result.pid] = (result.timestamp, perf_ns)
+                (t0, perf0) = self.monotonic_offset[result.pid]
+                result.timestamp = t0 + 1e-9 * (perf_ns - perf0)
+                result.monotonic = True
+        if self.duration_in_log:
+            duration_ns = regexmatch[self.field_to_idx.duration_ns]
+            if duration_ns.isdigit():
+                result.duration = 1e-9 * int(duration_ns)
+
     def parse_timestamp(self, ts):
         '''Parse timestamp string to seconds since epoch.'''
         # TODO: speedup using https://pypi.org/project/ciso8601/1.0.1/
@@ -138,3 +223,296 @@ class LoggingParser():
         return timestamp
 
 
+class BulkLoggingParser(LoggingParser):
+    '''Parser for large logs in the default format, which parses batches of lines at once (see parse_into).
+
+    A batch is joined into one byte array; numpy locates the line starts and separators, decodes the timestamps
+    with vectorised arithmetic and classifies the lines as CALL, RETURN or event by their message prefix.
+    Only the remaining string fields are split per line. Odd lines (other timestamp resolution, non-ascii characters,
+    anything the regexes would treat differently) take the per-line path, as does everything without numpy or in other formats.'''
+    def configure(self, format_spec=DEFAULT_FORMAT_SPEC):
+        LoggingParser.configure(self, format_spec)
+        self.bulk = format_spec == DEFAULT_FORMAT_SPEC
+
+    def parse_lines(self, lines):
+        '''Parse given (stripped) lines. Return a list with per line its TracingItem, or the line itself if it needs the per-line path.'''
+        np = _import_numpy()
+        if not self.bulk or np is None or not lines:
+            return list(lines)
+        data = np.frombuffer('\n'.join(lines).encode('utf-8'), dtype=np.uint8)
+        newlines = np.flatnonzero(data == ord('\n'))
+        if len(newlines) != len(lines) - 1 or len(data) == 0:
+            return list(lines)
+        starts = np.concatenate(([0], newlines + 1))
+        ends = np.append(newlines, len(data))
+        # ascii lines only, so that byte offsets are character offsets
+        nonascii = np.concatenate(([0], np.cumsum(data >= 0x80)))
+        ok = (ends - starts > TIMESTAMP_WIDTH) & (nonascii[ends] == nonascii[starts])
+        # timestamp layout
+        chars = data[np.minimum(starts[:, None] + np.arange(TIMESTAMP_WIDTH + 1), len(data) - 1)].astype(np.int64)
+        for (idx, c) in TIMESTAMP_SEPARATORS.items():
+            ok &= chars[:, idx] == ord(c)
+        digits = chars - ord('0')
+        values = []
+        for (begin, end) in TIMESTAMP_FIELDS:
+            ok &= ((digits[:, begin:end] >= 0) & (digits[:, begin:end] <= 9)).all(axis=1)
+            values.append((digits[:, begin:end] * 10 ** np.arange(end - begin - 1, -1, -1)).sum(axis=1))
+        (year, month, day, hour, minute, second, microsecond) = values
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        days_in_month = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 0, 12)] + (leap & (month == 2))
+        ok &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month) & (hour < 24) & (minute < 60) & (second < 60)
+        # days since epoch, from the civil date (proleptic gregorian calendar, as datetime)
+        y = year - (month <= 2)
+        era = y // 400
+        yoe = y - 400 * era
+        doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+        days = 146097 * era + 365 * yoe + yoe // 4 - yoe // 100 + doy - 719468
+        # as timedelta.total_seconds(): integer microseconds divided by 10**6, for identical results
+        timestamps = ((((days * 24 + hour) * 60 + minute) * 60 + second) * 10**6 + microsecond) / 10**6
+        # message start: after the 4th separator (level, where, funcname), the separators within the timestamp excluded
+        separators = np.flatnonzero(data == ord(FORMAT_SPEC_SEPARATOR))
+        k = np.searchsorted(separators, starts + TIMESTAMP_WIDTH) + 3
+        ok &= k < len(separators)
+        message = separators[np.minimum(k, len(separators) - 1)] + 1
+        ok &= message <= ends
+        itemtypes = np.full(len(lines), 'i')
+        for (prefix, itemtype) in MESSAGE_PREFIXES.items():
+            p = np.frombuffer(prefix.encode(), dtype=np.uint8)
+            match = (message + len(p) <= ends) & (data[np.minimum(message[:, None] + np.arange(len(p)), len(data) - 1)] == p).all(axis=1)
+            itemtypes[match] = itemtype
+        # remaining fields per line
+        result = list(lines)
+        offset = TIMESTAMP_WIDTH + 1
+        for (idx, line, timestamp, itemtype) in zip(np.flatnonzero(ok).tolist(), [lines[i] for i in np.flatnonzero(ok)], timestamps[ok].tolist(), itemtypes[ok].tolist()):
+            (level, where, funcname, message) = line[offset:].split(FORMAT_SPEC_SEPARATOR, 3)
+            if itemtype == 'B':
+                message = message[5:]
+            elif itemtype == 'E':
+                if 'CALL' in line:
+                    continue
+                message = message[7:]
+            elif 'CALL' in line or 'RETURN' in line:
+                continue
+            data = message.partition(FORMAT_SPEC_SEPARATOR)[0] # as the regexes
+            if not (level and where and funcname and data):
+                continue
+            fields = (None, level, where, funcname, data)
+            if itemtype == 'i':
+                result[idx] = self._handle_event(itemtype, fields, timestamp)
+            else:
+                result[idx] = self._handle_trace(itemtype, fields, timestamp)
+        return result
+
+
+_numpy = None
+
+def _import_numpy():
+    # numpy is optional, and imported on first use because it takes a while
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+class JsonLinesParser():
+    '''Parser for structured tracing files (extendedlogging option file_format='jsonl'): a json.loads per line, no regexes.'''
+    ITEM_TYPES = {'call': 'B', 'return': 'E', 'event': 'i', 'flow_start': 's', 'flow_end': 'f'}
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, format_spec=JSONL_FORMAT_SPEC):
+        if format_spec != JSONL_FORMAT_SPEC:
+            raise FormatError('expected format "{}", got "{}"'.format(JSONL_FORMAT_SPEC, format_spec))
+        self.monotonic_offset = {} # per process: see LoggingParser._handle_monotonic
+
+    def __call__(self, line):
+        '''Parse given line and return TracingItem object.'''
+        try:
+            d = json.loads(line)
+            itemtype = self.ITEM_TYPES[d['type']]
+            timestamp = d['time']
+            where = '{},{}'.format(d['file'], d['line'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ParseError('invalid json line: {}'.format(e)) from None
+        if itemtype == 'B':
+            data = {'args': d.get('args'), 'kwargs': d.get('kwargs')}
+            result = ttstore.TracingItem(timestamp, itemtype, d['func'], data, where=where)
+            if ttstore.INCLUDE_IO_IN_NAME:
+                result.sdata = json.dumps(data['args'] + [data['kwargs']])[1:-1]
+        elif itemtype == 'E':
+            data = 'ERROR' if d.get('error') else d.get('value')
+            result = ttstore.TracingItem(timestamp, itemtype, d['func'], data, where=where)
+            if ttstore.INCLUDE_IO_IN_NAME:
+                result.sdata = str(data)
+        elif itemtype == 'i':
+            result = ttstore.TracingItem(timestamp, itemtype, 'EVENT', d.get('message'), where=where, level=d['level'], funcname=d['func'], snapshot=None)
+        else:
+            result = ttstore.TracingItem(timestamp, itemtype, 'flow', d['flow'], where=where)
+            result.flow_id = d['flow']
+        result.pid = d.get('pid')
+        result.tid = d.get('tid')
+        task = d.get('task')
+        if task is not None and task != '-':
+            result.tid = task if result.tid is None else '{}/{}'.format(result.tid, task)
+        perf_ns = d.get('perf_ns')
+        if perf_ns is not None:
+            if result.pid not in self.monotonic_offset:
+                self.monotonic_offset[result.pid] = (result.timestamp, perf_ns)
+            (t0, perf0) = self.monotonic_offset[result.pid]
+            result.timestamp = t0 + 1e-9 * (perf_ns - perf0)
+            result.monotonic = True
+        duration_ns = d.get('duration_ns')
+        if duration_ns is not None:
+            result.duration = 1e-9 * duration_ns
+        return result
+
+
+def parser_for(filename):
+    '''Return a parser for given log file, based on its name: json lines or logging format.'''
+    if any(fnmatch(filename, mask) for mask in JSONL_FILE_MASKS):
+        return JsonLinesParser()
+    return BulkLoggingParser()
+
+
+def parse_into(inputfilename, store, parser):
+    '''Parse given log file line by line and feed the resulting items into store. Return the number of lines read.
+    A list of rotated segments (oldest first, see group_segments) is parsed as a single log, so open calls carry over.
+    Parsers with a parse_lines method (BulkLoggingParser) get the lines in batches.
+    The parser starts with its default format, a format of a previously parsed file does not carry over.'''
+    parser.configure()
+    lc = 0
+    items = 0
+    bulk = hasattr(parser, 'parse_lines')
+    batch = [] # (line number, line), for bulk parsing
+    for line in read_segments(inputfilename):
+        line = line.strip()
+        lc += 1
+        if line.startswith(IGNORE_LINE_CHAR) and batch:
+            items += _parse_batch(batch, store, parser)
+            batch = []
+        # first segment may be preceded by a dropped one
+        if line.startswith(LOGFILE_CONTINUED_MARK):
+            store.continued = store.continued or items == 0
+            continue
+        # optionally configure parser
+        if line.startswith(LOGFILE_FORMAT_SPEC):
+            parser.configure(line.replace(LOGFILE_FORMAT_SPEC, ''))
+            continue
+        # ignore line?
+        if line.startswith(IGNORE_LINE_CHAR):
+            continue
+        if bulk:
+            batch.append((lc, line))
+            if len(batch) >= BULK_LINES:
+                items += _parse_batch(batch, store, parser)
+                batch = []
+            continue
+        # regular line parsing
+        if _parse_line(lc, line, store, parser):
+            items += 1
+    if batch:
+        items += _parse_batch(batch, store, parser)
+    return lc
+
+
+def _parse_line(lc, line, store, parser, r=None):
+    # parse (unless already parsed) and add to store, return whether an item was added
+    if r is None:
+        try:
+            r = parser(line)
+        except ParseError as e:
+            raise type(e)('at line {}: {}'.format(lc, str(e))) from None
+    # r is None, for a to-be-ignored line
+    if r:
+        try:
+            store.add(r)
+        except Exception as e:
+            raise type(e)('at line {}: {}'.format(lc, str(e))) from None
+        return True
+    return False
+
+
+def _parse_batch(batch, store, parser):
+    # bulk parse, odd lines are returned as such and take the per-line path
+    results = parser.parse_lines([line for (lc, line) in batch])
+    items = 0
+    for ((lc, line), r) in zip(batch, results):
+        if r is line:
+            r = None
+        if _parse_line(lc, line, store, parser, r):
+            items += 1
+    return items
+
+
+def compression(filename):
+    '''Return the compression of given file (derived from its suffix), or None.'''
+    return COMPRESSED_SUFFIXES.get(os.path.splitext(filename)[1])
+
+
+def _decompressor(method):
+    if method == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if zstandard is None:
+        raise Exception('reading zstd compressed files requires the zstandard package')
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _read_decompressed(inputfilename, method):
+    '''Generate decompressed data blocks. Handles concatenated streams (appended runs) and tolerates
+    a truncated tail, as left behind by a crashed process: everything up to the last flush point is returned.'''
+    with open(inputfilename, 'rb') as f:
+        d = _decompressor(method)
+        while True:
+            data = f.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            while data:
+                yield d.decompress(data)
+                data = b''
+                if d.eof:
+                    # next stream, if any
+                    data = d.unused_data
+                    d = _decompressor(method)
+
+
+def read_lines(inputfilename):
+    '''Generate the lines of given (optionally compressed) log file.'''
+    method = compression(inputfilename)
+    if method is None:
+        with open(inputfilename, 'r') as f:
+            yield from f
+        return
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    pending = ''
+    for data in _read_decompressed(inputfilename, method):
+        lines = (pending + decoder.decode(data)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    # an incomplete last line is dropped, it can only be the result of truncation
+
+
+def read_segments(inputfilenames):
+    '''Generate the lines of given log file, or of a list of files, in order.'''
+    if isinstance(inputfilenames, str):
+        inputfilenames = [inputfilenames]
+    for inputfilename in inputfilenames:
+        yield from read_lines(inputfilename)
+
+
+def group_segments(inputfilenames):
+    '''Group rotated segments which belong to the same log, ordered oldest first. Other files are a group on their own.
+    Groups are returned in order of first appearance.'''
+    groups = {}
+    for inputfilename in inputfilenames:
+        m = SEGMENT_REGEX.match(inputfilename)
+        key, index = inputfilename, 0
+        if m:
+            key, index = m.group(1) + m.group(3), int(m.group(2))
+        groups.setdefault(key, []).append((index, inputfilename))
+    return [[f for (index, f) in sorted(group, reverse=True)] for group in groups.values()]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Perfetto datastore for ttviewer
+# writes the native protobuf trace format (a stream of TracePacket messages), which opens directly in https://ui.perfetto.dev
+# documentation: https://perfetto.dev/docs/reference/trace-packet-proto
+# (only the handful of messages needed for slices and instant events are encoded, using a minimal built-in encoder)
+
+import ttvlib.ttstore as ttstore
+
+
+# protobuf field numbers (see perfetto/protos/perfetto/trace/...)
+TRACE_PACKET = 1
+PACKET_TIMESTAMP = 8
+PACKET_CLOCK_SNAPSHOT = 6
+PACKET_SEQUENCE_ID = 10
+PACKET_TRACK_EVENT = 11
+PACKET_INTERNED_DATA = 12
+PACKET_SEQUENCE_FLAGS = 13
+PACKET_TIMESTAMP_CLOCK_ID = 58
+PACKET_DEFAULTS = 59
+PACKET_TRACK_DESCRIPTOR = 60
+CLOCK_SNAPSHOT_CLOCKS = 1
+CLOCK_ID = 1
+CLOCK_TIMESTAMP = 2
+CLOCK_IS_INCREMENTAL = 3
+CLOCK_UNIT_MULTIPLIER_NS = 4
+DEFAULTS_TIMESTAMP_CLOCK_ID = 58
+EVENT_DEBUG_ANNOTATIONS = 4
+EVENT_TYPE = 9
+EVENT_NAME_IID = 10
+EVENT_TRACK_UUID = 11
+ANNOTATION_NAME_IID = 1
+ANNOTATION_STRING_VALUE = 6
+INTERNED_EVENT_NAMES = 2
+INTERNED_ANNOTATION_NAMES = 3
+INTERNED_IID = 1
+INTERNED_NAME = 2
+TRACK_UUID = 1
+TRACK_PROCESS = 3
+TRACK_THREAD = 4
+PROCESS_PID = 1
+PROCESS_NAME = 6
+THREAD_PID = 1
+THREAD_TID = 2
+THREAD_NAME = 5
+
+# protobuf enum values
+EVENT_TYPE_SLICE_BEGIN = 1
+EVENT_TYPE_SLICE_END = 2
+EVENT_TYPE_INSTANT = 3
+SEQ_INCREMENTAL_STATE_CLEARED = 1
+SEQ_NEEDS_INCREMENTAL_STATE = 2
+BUILTIN_CLOCK_BOOTTIME = 6
+
+# timestamps are written as deltas on an incremental clock, in microseconds (the resolution of the log files)
+INCREMENTAL_CLOCK_ID = 64
+INCREMENTAL_CLOCK_UNIT_NS = 1000
+
+# all packets are written by a single writer
+SEQUENCE_ID = 1
+
+
+
+def _varint(value):
+    result = bytearray()
+    while value > 0x7f:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+def _field_varint(field, value):
+    return _varint(field << 3) + _varint(value)
+
+def _field_bytes(field, data):
+    return _varint((field << 3) | 2) + _varint(len(data)) + data
+
+def _field_string(field, s):
+    return _field_bytes(field, str(s).encode('utf-8', 'replace'))
+
+
+
+class TracingPerfettoStore(ttstore.TracingStore):
+    """This data store writes trace items as Perfetto protobuf trace.
+
+    Event names and annotation names are interned: each unique string is written only once.
+    Timestamps are delta-encoded, which keeps most of them in a single or a few bytes."""
+    def __init__(self, outputfilename):
+        ttstore.TracingStore.__init__(self)
+        self.output = open(outputfilename, 'wb')
+        self.tracks = {} # (pid, tid) -> track uuid
+        self.processes = {} # pid -> int
+        self.interned_names = {}
+        self.interned_annotations = {}
+        self.last_ts = None # in INCREMENTAL_CLOCK_UNIT_NS
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        ttstore.TracingStore.close(self)
+        self.output.close()
+
+    def handle_event_item(self, item):
+        annotations = {'where': item.args.get('where'), 'level': item.args.get('level'), 'data': item.data}
+        self.write_event(item, EVENT_TYPE_INSTANT, item.args.get('funcname', item.name), annotations)
+
+    def handle_start_item(self, item):
+        ttstore.TracingStore.handle_start_item(self, item)
+        self.write_event(item, EVENT_TYPE_SLICE_BEGIN, item.name, {'where': item.args.get('where'), 'inputs': item.data})
+
+    def handle_duration(self, start_item, end_item):
+        self.write_event(end_item, EVENT_TYPE_SLICE_END, None, {'outputs': end_item.data})
+
+    def write_event(self, item, event_type, name, annotations):
+        track_uuid = self.get_track(item.pid, item.lane())
+        interned = b''
+        event = _field_varint(EVENT_TYPE, event_type) + _field_varint(EVENT_TRACK_UUID, track_uuid)
+        if name is not None:
+            iid, new = self.intern(self.interned_names, name)
+            if new:
+                interned += _field_bytes(INTERNED_EVENT_NAMES, _field_varint(INTERNED_IID, iid) + _field_string(INTERNED_NAME, name))
+            event += _field_varint(EVENT_NAME_IID, iid)
+        for (k, v) in annotations.items():
+            if v is None:
+                continue
+            iid, new = self.intern(self.interned_annotations, k)
+            if new:
+                interned += _field_bytes(INTERNED_ANNOTATION_NAMES, _field_varint(INTERNED_IID, iid) + _field_string(INTERNED_NAME, k))
+            event += _field_bytes(EVENT_DEBUG_ANNOTATIONS, _field_varint(ANNOTATION_NAME_IID, iid) + _field_string(ANNOTATION_STRING_VALUE, v))
+        packet = self.timestamp(item.timestamp) + _field_bytes(PACKET_TRACK_EVENT, event)
+        if interned:
+            packet += _field_bytes(PACKET_INTERNED_DATA, interned)
+        self.write_packet(packet, SEQ_NEEDS_INCREMENTAL_STATE)
+        self.count()
+
+    def timestamp(self, t):
+        ts = int(round(t * 1e9 / INCREMENTAL_CLOCK_UNIT_NS))
+        if self.last_ts is None:
+            self.write_clock_snapshot(ts)
+        delta = ts - self.last_ts
+        if delta < 0:
+            # slightly out of order (different threads/processes): use an absolute timestamp instead, incremental clock is not affected
+            return _field_varint(PACKET_TIMESTAMP, ts * INCREMENTAL_CLOCK_UNIT_NS) + _field_varint(PACKET_TIMESTAMP_CLOCK_ID, BUILTIN_CLOCK_BOOTTIME)
+        self.last_ts = ts
+        return _field_varint(PACKET_TIMESTAMP, delta)
+
+    def write_clock_snapshot(self, ts):
+        # relate the incremental clock to the trace clock, and make it the default for all following packets
+        self.last_ts = ts
+        clocks = _field_bytes(CLOCK_SNAPSHOT_CLOCKS, _field_varint(CLOCK_ID, BUILTIN_CLOCK_BOOTTIME) + _field_varint(CLOCK_TIMESTAMP, ts * INCREMENTAL_CLOCK_UNIT_NS))
+        clocks += _field_bytes(CLOCK_SNAPSHOT_CLOCKS, _field_varint(CLOCK_ID, INCREMENTAL_CLOCK_ID) + _field_varint(CLOCK_TIMESTAMP, ts)
+            + _field_varint(CLOCK_IS_INCREMENTAL, 1) + _field_varint(CLOCK_UNIT_MULTIPLIER_NS, INCREMENTAL_CLOCK_UNIT_NS))
+        packet = _field_varint(PACKET_TIMESTAMP, ts * INCREMENTAL_CLOCK_UNIT_NS) + _field_varint(PACKET_TIMESTAMP_CLOCK_ID, BUILTIN_CLOCK_BOOTTIME)
+        packet += _field_bytes(PACKET_CLOCK_SNAPSHOT, clocks)
+        packet += _field_bytes(PACKET_DEFAULTS, _field_varint(DEFAULTS_TIMESTAMP_CLOCK_ID, INCREMENTAL_CLOCK_ID))
+        self.write_packet(packet, SEQ_INCREMENTAL_STATE_CLEARED)
+
+    def get_track(self, pid, tid):
+        key = (pid, tid)
+        if key in self.tracks:
+            return self.tracks[key]
+        # perfetto wants numeric pid/tid, logging provides names: number them in order of appearance
+        if pid not in self.processes:
+            self.processes[pid] = len(self.processes) + 1
+            descriptor = _field_varint(TRACK_UUID, self.processes[pid] << 16)
+            descriptor += _field_bytes(TRACK_PROCESS, _field_varint(PROCESS_PID, self.processes[pid]) + _field_string(PROCESS_NAME, pid or 'MainProcess'))
+            self.write_packet(_field_bytes(PACKET_TRACK_DESCRIPTOR, descriptor))
+        uuid = (self.processes[pid] << 16) + len(self.tracks) + 1
+        self.tracks[key] = uuid
+        thread = _field_varint(THREAD_PID, self.processes[pid]) + _field_varint(THREAD_TID, uuid) + _field_string(THREAD_NAME, tid or 'MainThread')
+        self.write_packet(_field_bytes(PACKET_TRACK_DESCRIPTOR, _field_varint(TRACK_UUID, uuid) + _field_bytes(TRACK_THREAD, thread)))
+        return uuid
+
+    @staticmethod
+    def intern(table, s):
+        if s in table:
+            return table[s], False
+        table[s] = len(table) + 1
+        return table[s], True
+
+    def write_packet(self, packet, flags=0):
+        packet += _field_varint(PACKET_SEQUENCE_ID, SEQUENCE_ID)
+        if flags:
+            packet += _field_varint(PACKET_SEQUENCE_FLAGS, flags)
+        self.output.write(_field_bytes(TRACE_PACKET, packet))
+
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+
+'''ttprofile: aggregate logging/tracing data into a profile report.
+
+For each traced function, the CALL/RETURN pairs are matched (per process/thread) and aggregated into
+call count, total (inclusive) time, self (exclusive) time, min/max/percentile durations and caller->callee edges.
+
+Input is processed in streaming fashion: memory usage scales with the number of unique functions
+and call edges, not with the number of lines, so it also works for logs which are too big for ttviewer.
+
+Output can be a text table, a CSV file and/or a pstats-compatible file (python -m pstats, snakeviz, ...).
+'''
+
+
+# system imports
+import sys
+import csv
+import math
+import marshal
+import argparse
+from collections import defaultdict
+
+# own imports
+import ttvlib.ttstore as ttstore
+import ttvlib.ttparse as ttparse
+
+
+# relative precision of the duration histogram, used for percentiles
+HISTOGRAM_PRECISION = 0.01
+
+# percentiles to report
+REPORT_PERCENTILES = (50, 90, 99)
+
+# sort keys which can be used in the text report
+SORT_KEYS = ('calls', 'tottime', 'cumtime', 'max', 'name')
+DEFAULT_SORT_KEY = 'tottime'
+
+
+
+class DurationHistogram:
+    """Streaming duration histogram with logarithmic buckets, to estimate percentiles in constant memory."""
+    def __init__(self, precision=HISTOGRAM_PRECISION):
+        self.log_base = math.log(1.0 + precision)
+        self.buckets = defaultdict(int)
+        self.count = 0
+
+    def add(self, duration):
+        # durations are in seconds, zero duration (equal timestamps) gets its own bucket
+        idx = None
+        if duration > 0:
+            idx = int(math.floor(math.log(duration) / self.log_base))
+        self.buckets[idx] += 1
+        self.count += 1
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        threshold = self.count * p / 100.0
+        cumulative = self.buckets.get(None, 0)
+        if cumulative >= threshold:
+            return 0.0
+        for idx in sorted(k for k in self.buckets.keys() if k is not None):
+            cumulative += self.buckets[idx]
+            if cumulative >= threshold:
+                # report the bucket center
+                return math.exp((idx + 0.5) * self.log_base)
+        return math.exp((idx + 0.5) * self.log_base)
+
+
+class FunctionProfile:
+    """Aggregated statistics of a single function."""
+    def __init__(self, key):
+        self.key = key # (filename, lineno, funcname), like pstats
+        self.calls = 0
+        self.primitive_calls = 0 # calls which are not recursive
+        self.tottime = 0.0 # self time
+        self.cumtime = 0.0 # total time, excluding recursive calls
+        self.mintime = None
+        self.maxtime = 0.0
+        self.histogram = DurationHistogram()
+
+    def add(self, duration, selftime, recursive):
+        self.calls += 1
+        self.tottime += selftime
+        if not recursive:
+            self.primitive_calls += 1
+            self.cumtime += duration
+        if self.mintime is None or duration < self.mintime:
+            self.mintime = duration
+        self.maxtime = max(self.maxtime, duration)
+        self.histogram.add(duration)
+
+    def percentile(self, p):
+        # histogram buckets are approximate, but the extremes are known exactly
+        return min(max(self.histogram.percentile(p), self.mintime or 0.0), self.maxtime)
+
+    def name(self):
+        return '{}:{}({})'.format(*self.key)
+
+
+class EdgeProfile:
+    """Aggregated statistics of a caller->callee edge."""
+    def __init__(self):
+        self.calls = 0
+        self.primitive_calls = 0
+        self.tottime = 0.0
+        self.cumtime = 0.0
+
+    def add(self, duration, selftime, recursive):
+        self.calls += 1
+        self.tottime += selftime
+        if not recursive:
+            self.primitive_calls += 1
+            self.cumtime += duration
+
+
+class TracingProfileStore(ttstore.TracingStore):
+    """This data store aggregates trace items into per-function statistics, instead of storing them."""
+    def __init__(self):
+        ttstore.TracingStore.__init__(self)
+        self.functions = {}
+        self.edges = defaultdict(EdgeProfile) # key: (caller, callee)
+        self.active = defaultdict(lambda: defaultdict(int)) # per thread: count of function on the stack, to detect recursion
+        self.num_events = 0
+        self.limit = float('inf') # aggregated, memory does not grow with the number of durations
+
+    def handle_event_item(self, item):
+        self.num_events += 1
+
+    def handle_start_item(self, item):
+        ttstore.TracingStore.handle_start_item(self, item)
+        item.child_time = 0.0
+        self.active[(item.pid, item.tid)][self.function_key(item)] += 1
+
+    def handle_duration(self, start_item, end_item):
+        tkey = (start_item.pid, start_item.tid)
+        fkey = self.function_key(start_item)
+        duration = max(0.0, end_item.timestamp - start_item.timestamp)
+        selftime = max(0.0, duration - start_item.child_time)
+        self.active[tkey][fkey] -= 1
+        recursive = self.active[tkey][fkey] > 0
+        # function statistics
+        if fkey not in self.functions:
+            self.functions[fkey] = FunctionProfile(fkey)
+        self.functions[fkey].add(duration, selftime, recursive)
+        # caller statistics, the caller is now on top of the stack
+        stack = self.stack[tkey]
+        if len(stack):
+            parent = stack[-1]
+            parent.child_time += duration
+            self.edges[(self.function_key(parent), fkey)].add(duration, selftime, recursive)
+        self.count()
+
+    @staticmethod
+    def function_key(item):
+        filename, lineno = item.args['where'], 0
+        if ',' in filename:
+            filename, lineno = filename.rsplit(',', 1)
+            lineno = int(lineno)
+        return (filename, lineno, item.name)
+
+    def callers(self, fkey):
+        '''Return dict of caller key to EdgeProfile.'''
+        return {caller: edge for ((caller, callee), edge) in self.edges.items() if callee == fkey}
+
+    def sorted_functions(self, sort=DEFAULT_SORT_KEY):
+        if sort == 'name':
+            return sorted(self.functions.values(), key=lambda f: f.name())
+        attr = {'calls': 'calls', 'tottime': 'tottime', 'cumtime': 'cumtime', 'max': 'maxtime'}[sort]
+        return sorted(self.functions.values(), key=lambda f: getattr(f, attr), reverse=True)
+
+
+class TracingCollapsedStore(ttstore.TracingStore):
+    """This data store aggregates self time per unique call stack, for flamegraph tools.
+
+    Output is the collapsed (folded) stack format: one line per unique stack, 'a;b;c <self-time-us>'.
+    Memory usage scales with the number of unique stacks, not with the number of durations."""
+    def __init__(self, outputfilename):
+        ttstore.TracingStore.__init__(self)
+        self.outputfilename = outputfilename
+        self.stacks = defaultdict(float)
+        self.limit = float('inf') # aggregated, memory does not grow with the number of durations
+
+    def close(self):
+        if self.closed:
+            return
+        ttstore.TracingStore.close(self)
+        self.write()
+
+    def handle_start_item(self, item):
+        tkey = (item.pid, item.tid)
+        stack = self.stack[tkey]
+        if len(stack):
+            prefix = stack[-1].path
+        else:
+            # root frames are the lanes, if any
+            prefix = ';'.join(self.frame_name(k) for k in tkey if k)
+        item.path = self.frame_name(item.name)
+        if prefix:
+            item.path = prefix + ';' + item.path
+        item.child_time = 0.0
+        ttstore.TracingStore.handle_start_item(self, item)
+
+    def handle_duration(self, start_item, end_item):
+        duration = max(0.0, end_item.timestamp - start_item.timestamp)
+        self.stacks[start_item.path] += max(0.0, duration - start_item.child_time)
+        stack = self.stack[(start_item.pid, start_item.tid)]
+        if len(stack):
+            stack[-1].child_time += duration
+        self.count()
+
+    @staticmethod
+    def frame_name(name):
+        # semicolon is the frame separator, space separates the value
+        return str(name).replace(';', ':').replace(' ', '_')
+
+    def write(self):
+        with open(self.outputfilename, 'w') as f:
+            for (path, selftime) in sorted(self.stacks.items()):
+                us = int(round(ttstore.MAGIC_MICROSECOND_TIMESTAMP_SCALING * selftime))
+                if us > 0:
+                    f.write('{} {}\n'.format(path, us))
+
+
+
+def profile(inputfilenames, parser=None):
+    '''Parse given log file(s) and return the profile store.'''
+    if isinstance(inputfilenames, str):
+        inputfilenames = [inputfilenames]
+    s = TracingProfileStore()
+    for group in ttparse.group_segments(inputfilenames):
+        ttparse.parse_into(group, s, parser or ttparse.parser_for(group[-1]))
+    s.close()
+    return s
+
+
+def write_text(store, output=sys.stdout, sort=DEFAULT_SORT_KEY, limit=None, callers=False):
+    '''Write a human-readable table, times in milliseconds.'''
+    percentile_headers = ['p{}'.format(p) for p in REPORT_PERCENTILES]
+    headers = ['ncalls', 'tottime', 'cumtime', 'min', 'max'] + percentile_headers
+    output.write(' '.join('{:>10s}'.format(h) for h in headers) + '  function\n')
+    functions = store.sorted_functions(sort)
+    if limit:
+        functions = functions[:limit]
+    def ms(t):
+        return '{:10.3f}'.format(1e3 * t)
+    for f in functions:
+        ncalls = str(f.calls)
+        if f.primitive_calls != f.calls:
+            ncalls = '{}/{}'.format(f.calls, f.primitive_calls)
+        columns = ['{:>10s}'.format(ncalls), ms(f.tottime), ms(f.cumtime), ms(f.mintime or 0.0), ms(f.maxtime)]
+        columns += [ms(f.percentile(p)) for p in REPORT_PERCENTILES]
+        output.write(' '.join(columns) + '  ' + f.name() + '\n')
+        if callers:
+            for (caller, edge) in sorted(store.callers(f.key).items(), key=lambda kv: kv[1].cumtime, reverse=True):
+                output.write('{:>10s} {} {}  <- {}\n'.format(str(edge.calls), ms(edge.tottime), ms(edge.cumtime), '{}:{}({})'.format(*caller)))
+
+
+def write_csv(store, outputfilename, sort=DEFAULT_SORT_KEY):
+    '''Write one row per function, times in seconds.'''
+    percentile_headers = ['p{}'.format(p) for p in REPORT_PERCENTILES]
+    with open(outputfilename, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['filename', 'lineno', 'function', 'calls', 'primitive_calls', 'tottime', 'cumtime', 'min', 'max'] + percentile_headers)
+        for p in store.sorted_functions(sort):
+            row = list(p.key) + [p.calls, p.primitive_calls, p.tottime, p.cumtime, p.mintime, p.maxtime]
+            row += [p.percentile(pc) for pc in REPORT_PERCENTILES]
+            w.writerow(row)
+
+
+def write_pstats(store, outputfilename):
+    '''Write marshalled stats as produced by cProfile, so the standard pstats module (and tools building on it) can load it.'''
+    stats = {}
+    for (fkey, f) in store.functions.items():
+        callers = {}
+        for (caller, edge) in store.callers(fkey).items():
+            callers[caller] = (edge.primitive_calls, edge.calls, edge.tottime, edge.cumtime)
+        stats[fkey] = (f.primitive_calls, f.calls, f.tottime, f.cumtime, callers)
+    with open(outputfilename, 'wb') as f:
+        marshal.dump(stats, f)
+
+
+
+def parse_args():
+    descriptionTxt = __doc__
+    exampleTxt = '''Example: ttprofile tests/demo_fib.log --sort cumtime --callers
+    ncalls    tottime    cumtime        min        max        p50        p90        p99  function
+      41/1      3.310      3.310      0.037      3.310      0.043      0.718      3.310  demo_fib.py:4(fib)
+        40      3.109      0.000  <- demo_fib.py:4(fib)
+'''
+    class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        def __init__(self, prog):
+            argparse.ArgumentDefaultsHelpFormatter.__init__(self, prog, max_help_position=36)
+            argparse.RawDescriptionHelpFormatter.__init__(self, prog, max_help_position=36)
+    parser = argparse.ArgumentParser(description=descriptionTxt, epilog=exampleTxt, formatter_class=CustomFormatter)
+    parser.add_argument('-s', '--sort', default=DEFAULT_SORT_KEY, choices=SORT_KEYS, help='sort key for the text table')
+    parser.add_argument('-l', '--limit', type=int, default=None, help='only show the first N functions in the text table')
+    parser.add_argument('-c', '--callers', action='store_true', help='show caller->callee edges in the text table')
+    parser.add_argument('--csv', dest='csvfile', default=None, type=str, help='also write CSV to given file')
+    parser.add_argument('--pstats', dest='pstatsfile', default=None, type=str, help='also write pstats-compatible file')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not write the text table to stdout')
+    parser.add_argument('filenames', help='input file(s), in chronological order', nargs='+', metavar='filename')
+    return parser.parse_args()
+
+
+def run(filenames, sort=DEFAULT_SORT_KEY, limit=None, callers=False, csvfile=None, pstatsfile=None, quiet=False):
+    s = profile(filenames)
+    if not quiet:
+        write_text(s, sys.stdout, sort=sort, limit=limit, callers=callers)
+    if csvfile:
+        write_csv(s, csvfile, sort=sort)
+    if pstatsfile:
+        write_pstats(s, pstatsfile)
+    return s
+
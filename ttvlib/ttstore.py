@@ -37,25 +37,29 @@ class OutOfMemoryError(Exception):
     pass
 
 
-class TracingJsonStore:
-    """This data store holds trace items and can write them as json for the catapult traceviewer.
-    
-    Start- and end items form a duration; they come in pairs.
+class TracingStore:
+    """Base data store, which matches start- and end items per thread into durations.
 
-    Items must arrive in order, i.e. increasing timestamp and properly nested."""
-    def __init__(self, outputfilename):
-        self.items = []
+    Derived classes decide what to do with completed durations and events.
+
+    Items must arrive in order, i.e. increasing timestamp and properly nested. Except for spans which are consumed in turns,
+    like two traced generators in a zip: a span which ends before the ones started after it is taken out of the stack,
+    and marked interleaved, so it is drawn on a lane of its own (see TracingItem.lane)."""
+    def __init__(self):
         self.stack = defaultdict(lambda: [])
         self.last_timestamp = 0
         self.size = 0
         self.limit = STORE_LIMIT
-        self.output = open(outputfilename, 'w')
         self.lasttimestamps = {}
+        self.closed = False
+        self.continued = False # log continues a dropped segment, so tolerate end items of which the start item is missing
 
-    def __del__(self):
+    def close(self):
+        """Finish the store: close dangling items. Can safely be called more than once."""
+        if self.closed:
+            return
+        self.closed = True
         self.auto_close(verbose=AUTOCLOSE_VERBOSE)
-        self.output.write(']\n')
-        self.output.close()
 
     def auto_close(self, verbose=True):
         # when a program has exited abnormally, it can cause an incomplete log
@@ -94,11 +98,16 @@ class TracingJsonStore:
             self.handle_end_item(item)
         elif item.type == 'i':
             self.handle_event_item(item)
+        elif item.type in ('s', 'f'):
+            self.handle_flow_item(item)
         else:
             raise ItemTypeError('unrecognized trace item type: {}'.format(item.type))
 
     def handle_event_item(self, item):
-        self.write_item(item)
+        pass
+
+    def handle_flow_item(self, item):
+        pass
 
     def handle_start_item(self, item):
         key = (item.pid, item.tid)
@@ -107,19 +116,84 @@ class TracingJsonStore:
 
     def handle_end_item(self, item):
         key = (item.pid, item.tid)
-        start_item = self.stack[key].pop()
+        if self.continued and not self.stack[key]:
+            self.lasttimestamps[key] = item.timestamp
+            return
+        stack = self.stack[key]
+        above = []
+        if stack and item.name != stack[-1].name:
+            # interleaved span: the matching start item is deeper in the stack
+            idx = self.find_start(stack, item)
+            if idx is None:
+                thread_detail = ''
+                if item.tid:
+                    thread_detail = ' at thread {}'.format(item.tid)
+                raise StackError('item pop inconsistency{}: popped item is "{}:{}", expected name is "{}"'.format(thread_detail, item.args['where'], item.name, stack[-1].name))
+            above = stack[idx + 1:]
+            del stack[idx + 1:]
+            stack[-1].interleaved = item.interleaved = True
+        start_item = stack.pop()
+        # explicit duration (extendedlogging option 'monotonic_timing') determines the span width
+        if item.duration is not None:
+            item.timestamp = start_item.timestamp + item.duration
         self.lasttimestamps[key] = item.timestamp
-        if item.name != start_item.name:
-            thread_detail = ''
-            if item.tid:
-                thread_detail = ' at thread {}'.format(item.tid)
-            raise StackError('item pop inconsistency{}: popped item is "{}:{}", expected name is "{}"'.format(thread_detail, item.args['where'], item.name, start_item.name))
         # set a reference so the rendered label ('name') can be adapted
         start_item.end = item
-        # write
-        self.write_item(start_item)
+        # the stack now holds the parent (caller) of this duration, if any
+        self.handle_duration(start_item, item)
+        # the spans started after the interleaved one remain open
+        stack.extend(above)
+
+    @staticmethod
+    def find_start(stack, item):
+        """Index of the innermost open start item matching given end item, None if there is none."""
+        for idx in range(len(stack) - 1, -1, -1):
+            if stack[idx].name == item.name and stack[idx].args.get('where') == item.args.get('where'):
+                return idx
+        return None
+
+    def handle_duration(self, start_item, end_item):
+        pass
+
+    def count(self):
+        # throw an error if the amount of data is getting large
+        self.size += 1
+        if self.size > self.limit:
+            raise OutOfMemoryError('store limit exceeded: {}'.format(self.limit))
+
+
+class TracingJsonStore(TracingStore):
+    """This data store holds trace items and can write them as json for the catapult traceviewer.
+    
+    Start- and end items form a duration; they come in pairs.
+
+    Items must arrive in order, i.e. increasing timestamp and properly nested."""
+    def __init__(self, outputfilename):
+        TracingStore.__init__(self)
+        self.output = open(outputfilename, 'w')
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        TracingStore.close(self)
+        if self.size == 0:
+            self.output.write('[\n')
+        self.output.write(']\n')
+        self.output.close()
+
+    def handle_event_item(self, item):
         self.write_item(item)
 
+    def handle_flow_item(self, item):
+        self.write_item(item)
+
+    def handle_duration(self, start_item, end_item):
+        self.write_item(start_item)
+        self.write_item(end_item)
+
     def write_item(self, item):
         # file header?
         if self.size == 0:
@@ -131,9 +205,7 @@ class TracingJsonStore:
         self.output.write(json.dumps(item.dict()))
         self.output.write('\n')
         # file end is handled at closure
-        self.size += 1
-        if self.size > self.limit:
-            raise OutOfMemoryError('store limit exceeded: {}'.format(self.limit))
+        self.count()
 
 
 
@@ -147,16 +219,28 @@ class TracingItem:
         self.type = itemtype
         self.data = data # string, raw (for detail pane)
         self.sdata = data # string, pretty (for io labeling)
+        self.duration = None # float, optional, for end items
+        self.monotonic = False # timestamp derived from high-resolution monotonic clock
+        self.flow_id = None # string, for flow start/end items
+        self.interleaved = False # span which does not nest with the spans around it, see TracingStore
         self.args = {}
         for (k, v) in kwargs.items():
             self.args[k] = v
 
+    def lane(self):
+        '''Thread lane to draw the item on: interleaved spans get a lane of their own, named after the thread and function.'''
+        if self.interleaved:
+            return self.name if self.tid is None else '{}/{}'.format(self.tid, self.name)
+        return self.tid
+
     def dict(self):
         '''Return dict for json conversion.'''
         t = self.timestamp
         ts = int(MAGIC_MICROSECOND_TIMESTAMP_SCALING * self.timestamp)
+        if self.monotonic or self.duration is not None:
+            ts = round(MAGIC_MICROSECOND_TIMESTAMP_SCALING * self.timestamp, 1) # sub-microsecond resolution, as far as float seconds since epoch allow
         name = self.name
-        d = {'name': name, 'ts': ts, 'ph': self.type, 'pid': self.pid, 'tid': self.tid, 'args': self.args}
+        d = {'name': name, 'ts': ts, 'ph': self.type, 'pid': self.pid, 'tid': self.lane(), 'args': self.args}
         if self.type == 'B':
             if INCLUDE_IO_IN_NAME:
                 end_item = self.end
@@ -170,6 +254,10 @@ class TracingItem:
                 d['name'] = name
             d['args']['starttime'] = datetime.datetime.fromtimestamp(t).strftime(READABLE_TIMESTAMP_FORMAT)
             d['args']['inputs'] = self.data
+        if self.type in ('s', 'f'):
+            # start binds to the enclosing slice, end to the next slice on its thread
+            d['id'] = self.flow_id
+            d['cat'] = 'flow'
         if self.type == 'E':
             d['args']['endtime'] = datetime.datetime.fromtimestamp(t).strftime(READABLE_TIMESTAMP_FORMAT)
             d['args']['outputs'] = self.data
@@ -1,16 +1,20 @@
 #!/usr/bin/env python
 
 
-'''ttviewer: visualize logging/tracing/timing data as Gantt charts using Google Chrome built-in viewer (catapult).
+'''ttviewer: visualize logging/tracing/timing data as Gantt charts in a browser.
 
 Several kinds of data files are supported.
 
-The browser (cli) needs a .html file, produced by catapult trace2html.
-All necessary conversions are done/attempted:
-If a trace .json file is given, then it is converted to .html using catapult trace2html.
+The browser (cli) needs a .html file. All necessary conversions are done/attempted:
 If one or more .log files are given, then they are parsed under the assumption the content is python (auto)logging, merged into .json.
+Rotated segments of the same log (name.2.log, name.1.log, name.log) are stitched together into a single .json.
+A trace .json file is embedded into a built-in lightweight html viewer (no external tools needed),
+or optionally converted to .html using Google Chrome built-in viewer (catapult trace2html).
 
 More converters to .json could be registered in ttvlib/ttconvert.
+
+Instead of viewing, a single input file can also be converted to another format with --output,
+where the converter is selected by the output file extension, for example .collapsed for flamegraph tools.
 '''
 
 __author__ = 'Jan Feitsma'
@@ -48,6 +52,7 @@ class TraceViewer(object):
         self.verbose = verbose
         self.limit = DEFAULT_INPUT_LIMIT_MB
         self.dryrun = False
+        self.output = None
         self.runner_class = ttvlib.ttconvert.Runner
 
     def run(self, dryrun=False):
@@ -58,6 +63,9 @@ class TraceViewer(object):
         runner = self.runner_class(self.tmpdir, self.filenames, htmlfile, self.limit)
         runner.dryrun = dryrun
         runner.messager = self._message
+        if self.output:
+            runner.export(self.output)
+            return
         runner.run()
         if self.view:
             self._launch_browser(htmlfile)
@@ -91,13 +99,21 @@ class TraceViewer(object):
 def parse_args():
     descriptionTxt = __doc__
     exampleTxt = '''Example: ttviewer.py tests/demo_fib.log --io
+Converting tests/demo_fib.log (5.1KB) to /tmp/ttviewer/demo_fib.log.json using parser: LoggingParser ... done (0.0s, 14.4KB, n=82)
+Converting /tmp/ttviewer/demo_fib.log.json (14.4KB) to /tmp/ttviewer/ttviewer.html using template: ttviewer_template.html ... done (0.0s, 15.0KB)
+Launching browser ...
+
+Example: ttviewer.py tests/demo_fib.log --io --catapult
 Converting tests/demo_fib.log (5.1KB) to /tmp/ttviewer/ttviewer.json using parser: LoggingParser ... done (0.0s, 13.3KB, n=82)
 Converting /tmp/ttviewer/ttviewer.json (13.3KB) to /tmp/ttviewer/ttviewer.html using tool: trace2html ... done (1.5s, 4.0MB)
 Launching browser ... # see tests/demo_fib.png
 
-Example: ttviewer.py tests/demo_catapult.json
+Example: ttviewer.py tests/demo_catapult.json --catapult
 Converting tests/demo_catapult.json (13.2MB) to /tmp/ttviewer/ttviewer.html using tool: trace2html ... done (1.9s, 8.3MB)
 Launching browser ... # see tests/demo_catapult.png
+
+Example: ttviewer.py tests/demo_fib.log -o /tmp/fib.collapsed
+Converting tests/demo_fib.log (5.1KB) to /tmp/fib.collapsed using parser: LoggingParser ... done (0.0s, 139B, n=7)
 '''
     class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
         def __init__(self, prog):
@@ -111,16 +127,20 @@ Launching browser ... # see tests/demo_catapult.png
     parser.add_argument('-L', '--limit', type=float, default=DEFAULT_INPUT_LIMIT_MB, help='input file size limit in MB')
     parser.add_argument('-b', '--browser', default=DEFAULT_BROWSER, type=str, help='which browser to use')
     parser.add_argument('--io', action='store_true', help='render with input->output labels')
+    parser.add_argument('--catapult', action='store_true', help='render html using catapult trace2html instead of the built-in viewer')
+    parser.add_argument('-o', '--output', default=None, type=str, help='convert single input file to given output file (format by extension) instead of viewing')
     parser.add_argument('filenames', help='input file(s)', nargs='+', metavar='filename')
     return parser.parse_args()
 
 
-def run(filenames, browser=DEFAULT_BROWSER, io=False, limit=DEFAULT_INPUT_LIMIT_MB, noviewer=False, quiet=False, dryrun=False):
+def run(filenames, browser=DEFAULT_BROWSER, io=False, catapult=False, limit=DEFAULT_INPUT_LIMIT_MB, noviewer=False, quiet=False, dryrun=False, output=None):
     # configure
     ttvlib.ttstore.INCLUDE_IO_IN_NAME = io
+    ttvlib.ttconvert.standard.USE_CATAPULT = catapult
     s = TraceViewer(filenames, view=not noviewer, verbose=not quiet)
     s.browser = browser
     s.limit = limit
+    s.output = output
     # execute
     s.run(dryrun)
 